@@ -0,0 +1,23 @@
+import os
+import sys
+from pathlib import Path
+
+APP_NAME = 'FormatConverter'
+
+
+def get_cache_dir():
+    """获取程序缓存目录（不存在时自动创建）"""
+    override = os.environ.get('FORMATCONVERTER_CACHE_DIR')
+    if override:
+        cache_dir = Path(override)
+    elif sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or str(Path.home() / 'AppData' / 'Local')
+        cache_dir = Path(base) / APP_NAME / 'cache'
+    elif sys.platform == 'darwin':
+        cache_dir = Path.home() / 'Library' / 'Caches' / APP_NAME
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or str(Path.home() / '.cache')
+        cache_dir = Path(base) / APP_NAME.lower()
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
@@ -0,0 +1,103 @@
+"""短音频批量转换。
+
+几秒钟的音频片段编码本身很快，逐个转换时大部分时间花在启动 FFmpeg 进程上。
+批量模式把多个输入放进同一次 FFmpeg 调用：每个输入一个 -i，每个输出用
+-map 选中对应输入的音轨，编码参数与单文件转换完全相同。
+
+批大小按实测开销计算：设启动一次 FFmpeg 需要 S 秒、每个文件的编码需要 E 秒，
+n 个文件合并后启动开销的占比为 S / (S + n·E)，取使其不超过 target_overhead 的
+最小 n。批大小越大，出错时需要逐个重试的文件也越多，因此还有上限。
+"""
+import math
+import os
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+
+from ffmpeg_runner import get_startupinfo
+
+
+@dataclass
+class AudioBatchOptions:
+    """批量转换参数"""
+    max_file_size: int = 8 * 1024 ** 2  # 只合并不超过该大小的输入（字节）
+    batch_size: int = None              # 固定批大小，None 时按实测开销自动计算
+    min_batch: int = 2
+    max_batch: int = 32
+    target_overhead: float = 0.1        # 进程启动开销占总耗时的目标比例
+
+
+def is_batchable(job, options):
+    """小的音频输入才参与批量转换"""
+    if options is None or job.file_type != 'audio':
+        return False
+    try:
+        return os.path.getsize(job.input_path) <= options.max_file_size
+    except OSError:
+        return False
+
+
+def batch_command(ffmpeg_path, entries):
+    """合并多个转换的 FFmpeg 命令，entries 为 [(输入路径, 编码参数, 输出路径)]"""
+    cmd = [ffmpeg_path, '-hide_banner', '-y']
+    for input_path, _, _ in entries:
+        cmd += ['-i', str(input_path)]
+    for index, (_, args, output_path) in enumerate(entries):
+        cmd += ['-map', f'{index}:a:0'] + list(args) + [str(output_path)]
+    return cmd
+
+
+def measure_spawn(ffmpeg_path):
+    """启动一次几乎不做任何工作的 FFmpeg 所需的时间（秒）"""
+    started = time.perf_counter()
+    subprocess.run(
+        [ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', 'anullsrc', '-t', '0', '-f', 'null', '-'],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        startupinfo=get_startupinfo()
+    )
+    return time.perf_counter() - started
+
+
+class BatchSizer:
+    """根据实测的启动开销和单文件编码耗时决定批大小"""
+
+    def __init__(self, options):
+        self.options = options
+        self.spawn_seconds = None  # 启动一次 FFmpeg 的耗时
+        self.file_seconds = None   # 批量模式下每个文件的平均编码耗时
+        self._lock = threading.Lock()
+
+    def calibrate(self, ffmpeg_path):
+        """测量进程启动开销，只测一次"""
+        if self.spawn_seconds is None and self.options.batch_size is None:
+            spawn = measure_spawn(ffmpeg_path)
+            with self._lock:
+                self.spawn_seconds = spawn
+
+    def observe(self, count, elapsed):
+        """记录一次批量转换的文件数和总耗时"""
+        if self.spawn_seconds is None or count <= 0:
+            return
+        per_file = max(elapsed - self.spawn_seconds, 0.0) / count
+        with self._lock:
+            if self.file_seconds is None:
+                self.file_seconds = per_file
+            else:
+                self.file_seconds = 0.7 * self.file_seconds + 0.3 * per_file
+
+    @property
+    def batch_size(self):
+        options = self.options
+        if options.batch_size:
+            return options.batch_size
+        with self._lock:
+            spawn, per_file = self.spawn_seconds, self.file_seconds
+        if spawn is None or not per_file:
+            # 还没有实测数据，先按上限合并
+            return options.max_batch
+        ratio = options.target_overhead
+        size = math.ceil(spawn * (1 - ratio) / (ratio * per_file))
+        return max(options.min_batch, min(options.max_batch, size))
@@ -0,0 +1,390 @@
+"""格式转换基准测试。
+
+在本地生成合成输入（FFmpeg lavfi 的 testsrc / sine，Pillow 生成的 RGBA、P、L 图片），
+对界面允许的每一组 源格式 → 目标格式 执行转换，记录耗时、CPU 时间、峰值内存和
+输出大小，结果写入 JSON。compare 子命令与保存的基线对比，发现退化时返回非零。
+
+    python benchmark.py run -o results.json
+    python benchmark.py compare baseline.json results.json
+    python benchmark.py pcm
+
+pcm 子命令对比 WAV → WAV 的进程内路径与 FFmpeg 在不同时长下的耗时，给出分界点，
+用来设置 PcmOptions.max_resample_duration。
+
+每个用例在独立的子进程中执行，峰值内存取该进程及其 FFmpeg 子进程的最大值。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from convert_engine import ConversionEngine, ConversionJob
+from ffmpeg_caps import find_ffmpeg
+from media_formats import AUDIO_FORMATS, IMAGE_FORMATS, VIDEO_FORMATS
+from pcm_fast import PcmOptions, convert_wav
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，只记录耗时和输出大小
+    resource = None
+
+RESULT_VERSION = 1
+IMAGE_MODES = ('RGBA', 'P', 'L')
+
+# 对比时的默认阈值：相对增幅超过 threshold 且绝对增幅超过 min_seconds 才算退化
+DEFAULT_THRESHOLD = 0.15
+DEFAULT_MIN_SECONDS = 0.05
+
+# pcm 子命令的默认测试时长（秒）和输入采样率
+PCM_DURATIONS = (0.5, 1, 2, 4, 8, 16, 32, 64)
+PCM_RATES = (48000, 22050, 44100)
+
+
+# ---- 合成输入 ----
+
+def make_image(mode, size):
+    """生成带渐变、色块和透明区域的图片"""
+    width, height = size
+    img = Image.linear_gradient('L').resize(size).convert('RGBA')
+    draw = ImageDraw.Draw(img)
+    for index in range(8):
+        x = index * width // 8
+        draw.rectangle((x, height // 4, x + width // 16, height * 3 // 4),
+                       fill=(index * 32, 255 - index * 32, 128, 255))
+    draw.ellipse((width // 3, height // 3, width * 2 // 3, height * 2 // 3), fill=(0, 0, 0, 0))
+    if mode == 'P':
+        return img.convert('RGB').quantize(colors=64)
+    return img.convert(mode)
+
+
+def generate_images(work_dir, size):
+    """每种图片格式各生成 RGBA、P、L 三种模式；格式不支持的模式跳过"""
+    sources = []
+    for ext in sorted(IMAGE_FORMATS):
+        for mode in IMAGE_MODES:
+            path = work_dir / f'image_{mode}{ext}'
+            try:
+                make_image(mode, size).save(path)
+            except (OSError, ValueError):
+                continue
+            sources.append(('image', ext[1:], mode, path))
+    return sources
+
+
+def generate_media(engine, work_dir, duration, size):
+    """用 lavfi 合成源生成每种音视频格式的输入文件"""
+    ffmpeg = engine.ffmpeg_path
+    video_src = ['-f', 'lavfi', '-i', f'testsrc=size={size[0]}x{size[1]}:rate=25:duration={duration}']
+    audio_src = ['-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={duration}']
+    sources = []
+    for ext in sorted(VIDEO_FORMATS):
+        path = work_dir / f'video{ext}'
+        args = engine.video_args(ext[1:])
+        subprocess.run([ffmpeg, '-v', 'error', '-y'] + video_src + audio_src
+                       + ['-pix_fmt', 'yuv420p'] + args + [str(path)], check=True)
+        sources.append(('video', ext[1:], None, path))
+    for ext in sorted(AUDIO_FORMATS):
+        path = work_dir / f'audio{ext}'
+        subprocess.run([ffmpeg, '-v', 'error', '-y'] + audio_src
+                       + engine.audio_args(ext[1:]) + [str(path)], check=True)
+        sources.append(('audio', ext[1:], None, path))
+    return sources
+
+
+def build_cases(sources):
+    """与界面一致：同类型中除源扩展名以外的所有格式都是目标"""
+    formats = {'image': IMAGE_FORMATS, 'video': VIDEO_FORMATS, 'audio': AUDIO_FORMATS}
+    cases = []
+    for file_type, source_format, mode, path in sources:
+        for ext in sorted(formats[file_type]):
+            target = ext[1:]
+            if target == source_format:
+                continue
+            name = f'{file_type} {source_format}'
+            if mode:
+                name += f'[{mode}]'
+            cases.append({
+                'case': f'{name}->{target}',
+                'type': file_type,
+                'source': source_format,
+                'mode': mode,
+                'target': target,
+                'input': str(path)
+            })
+    return cases
+
+
+# ---- 执行 ----
+
+def _usage():
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own, children
+
+
+def run_case(case, ffmpeg_path, output_path):
+    """在当前进程中执行一个用例（由子进程调用），返回测量结果"""
+    engine = ConversionEngine(ffmpeg_path)
+    job = ConversionJob(case['input'], output_path, case['type'], case['target'])
+    before = _usage()
+    started = time.perf_counter()
+    result = {'error': None, 'path_taken': None}
+    try:
+        result['path_taken'] = engine.convert(job).path_taken
+    except Exception as e:
+        result['error'] = str(e).splitlines()[0]
+    result['wall'] = time.perf_counter() - started
+
+    after = _usage()
+    if after is not None:
+        (own0, child0), (own1, child1) = before, after
+        result['cpu'] = (own1.ru_utime + own1.ru_stime + child1.ru_utime + child1.ru_stime
+                         - own0.ru_utime - own0.ru_stime - child0.ru_utime - child0.ru_stime)
+        # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+        scale = 1 if sys.platform == 'darwin' else 1024
+        result['peak_rss'] = max(own1.ru_maxrss, child1.ru_maxrss) * scale
+    else:
+        result['cpu'] = result['peak_rss'] = None
+    result['output_size'] = os.path.getsize(output_path) if os.path.exists(output_path) else None
+    return result
+
+
+def _run_in_subprocess(case, ffmpeg_path, output_path):
+    payload = json.dumps({'case': case, 'ffmpeg': ffmpeg_path, 'output': str(output_path)})
+    proc = subprocess.run([sys.executable, str(Path(__file__).resolve()), '_case', payload],
+                          capture_output=True, encoding='utf-8', errors='replace')
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        detail = proc.stderr.strip().splitlines()
+        return {'error': detail[-1] if detail else f'退出码 {proc.returncode}',
+                'wall': None, 'cpu': None, 'peak_rss': None, 'output_size': None,
+                'path_taken': None}
+    # 转换过程中的日志也会打印到标准输出，结果在最后一行
+    return json.loads(lines[-1])
+
+
+def _median(values):
+    values = [v for v in values if v is not None]
+    return statistics.median(values) if values else None
+
+
+def run_benchmark(ffmpeg_path, duration=3, video_size=(640, 360), image_size=(1920, 1080),
+                  repeat=1, types=None, match=None):
+    """生成输入并执行所有用例，返回结果字典"""
+    engine = ConversionEngine(ffmpeg_path)
+    types = types or ('image', 'video', 'audio')
+    with tempfile.TemporaryDirectory(prefix='formatconverter_bench_') as work_dir:
+        work_dir = Path(work_dir)
+        sources = []
+        if 'image' in types:
+            sources += generate_images(work_dir, image_size)
+        if 'video' in types or 'audio' in types:
+            sources += [s for s in generate_media(engine, work_dir, duration, video_size)
+                        if s[0] in types]
+        cases = build_cases(sources)
+        if match:
+            cases = [case for case in cases if match in case['case']]
+
+        results = []
+        for number, case in enumerate(cases, 1):
+            output_path = work_dir / f'out_{number}.{case["target"]}'
+            runs = [_run_in_subprocess(case, ffmpeg_path, output_path) for _ in range(repeat)]
+            record = dict(case)
+            del record['input']
+            record.update({
+                'wall': _median(r['wall'] for r in runs),
+                'cpu': _median(r['cpu'] for r in runs),
+                'peak_rss': max((r['peak_rss'] for r in runs if r['peak_rss']), default=None),
+                'output_size': runs[-1]['output_size'],
+                'path_taken': runs[-1]['path_taken'],
+                'error': next((r['error'] for r in runs if r['error']), None)
+            })
+            results.append(record)
+            status = f"失败：{record['error']}" if record['error'] else f"{record['wall']:.3f} 秒"
+            print(f"[{number}/{len(cases)}] {case['case']}  {status}", file=sys.stderr)
+
+    return {
+        'version': RESULT_VERSION,
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'pillow': Image.__version__,
+            'ffmpeg': engine.caps.version,
+            'cpu_count': os.cpu_count(),
+            'duration': duration,
+            'video_size': list(video_size),
+            'image_size': list(image_size),
+            'repeat': repeat
+        },
+        'results': results
+    }
+
+
+def _best_time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def pcm_crossover(ffmpeg_path, durations=PCM_DURATIONS, rates=PCM_RATES, repeat=3):
+    """WAV → WAV 进程内路径与 FFmpeg 的耗时对比，返回 {采样率: [(时长, 进程内, FFmpeg)]}。
+
+    输入为立体声 16 位 PCM；FFmpeg 的耗时包含进程启动，与引擎中的实际调用相同。
+    """
+    engine = ConversionEngine(ffmpeg_path)
+    options = PcmOptions()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='formatconverter_pcm_') as work_dir:
+        work_dir = Path(work_dir)
+        source, fast_output, ffmpeg_output = (work_dir / 'source.wav', work_dir / 'fast.wav',
+                                              work_dir / 'ffmpeg.wav')
+        cmd = ([ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-i', str(source), '-y']
+               + engine.audio_args('wav') + [str(ffmpeg_output)])
+        for rate in rates:
+            rows = results[rate] = []
+            for duration in durations:
+                subprocess.run([ffmpeg_path, '-v', 'error', '-y', '-f', 'lavfi', '-i',
+                                f'sine=frequency=440:sample_rate={rate}:duration={duration}',
+                                '-ac', '2', '-c:a', 'pcm_s16le', str(source)], check=True)
+                fast = _best_time(lambda: convert_wav(source, fast_output, options), repeat)
+                slow = _best_time(lambda: subprocess.run(cmd, check=True), repeat)
+                rows.append((duration, fast, slow))
+    return results
+
+
+def crossover_point(rows):
+    """进程内路径开始慢于 FFmpeg 的最短时长；一直更快时返回 None"""
+    return next((duration for duration, fast, slow in rows if fast > slow), None)
+
+
+# ---- 对比 ----
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, min_seconds=DEFAULT_MIN_SECONDS):
+    """返回 [(用例, 指标, 基线值, 当前值, 说明)]，只包含退化和新出现的失败"""
+    base_by_case = {r['case']: r for r in baseline['results']}
+    problems = []
+    for record in current['results']:
+        base = base_by_case.get(record['case'])
+        if base is None:
+            continue
+        if record['error'] and not base['error']:
+            problems.append((record['case'], 'error', None, None, record['error']))
+            continue
+        if record['error'] or base['error']:
+            continue
+        for metric, floor in (('wall', min_seconds), ('cpu', min_seconds),
+                              ('peak_rss', 1024 * 1024), ('output_size', 1024)):
+            old, new = base.get(metric), record.get(metric)
+            if not old or new is None:
+                continue
+            if new > old * (1 + threshold) and new - old > floor:
+                problems.append((record['case'], metric, old, new,
+                                 f'+{(new / old - 1) * 100:.0f}%'))
+    return problems
+
+
+def _format_value(metric, value):
+    if value is None:
+        return '-'
+    if metric in ('wall', 'cpu'):
+        return f'{value:.3f}s'
+    return f'{value / 1024:.0f}K'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='格式转换基准测试')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='生成合成输入并执行全部转换')
+    run.add_argument('-o', '--output', required=True, help='结果 JSON 文件')
+    run.add_argument('--ffmpeg', default=None, help='ffmpeg 路径，默认使用自带或 PATH 中的')
+    run.add_argument('--duration', type=float, default=3, help='音视频输入时长（秒）')
+    run.add_argument('--video-size', default='640x360', help='视频分辨率')
+    run.add_argument('--image-size', default='1920x1080', help='图片分辨率')
+    run.add_argument('--repeat', type=int, default=1, help='每个用例重复次数，取中位数')
+    run.add_argument('--type', action='append', choices=['image', 'video', 'audio'],
+                     help='只测试某类文件，可重复指定')
+    run.add_argument('-k', '--match', default=None, help='只运行名称包含该字符串的用例')
+
+    cmp_parser = sub.add_parser('compare', help='与基线对比')
+    cmp_parser.add_argument('baseline', help='基线结果 JSON')
+    cmp_parser.add_argument('current', help='本次结果 JSON')
+    cmp_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='相对增幅阈值，默认 0.15')
+    cmp_parser.add_argument('--min-seconds', type=float, default=DEFAULT_MIN_SECONDS,
+                            help='耗时的绝对增幅阈值（秒）')
+
+    pcm_parser = sub.add_parser('pcm', help='WAV 进程内转换与 FFmpeg 的分界点')
+    pcm_parser.add_argument('--ffmpeg', default=None, help='ffmpeg 路径，默认使用自带或 PATH 中的')
+    pcm_parser.add_argument('--repeat', type=int, default=3, help='每个时长重复次数，取最短耗时')
+
+    case_parser = sub.add_parser('_case')
+    case_parser.add_argument('payload')
+
+    args = parser.parse_args(argv)
+
+    if args.command == '_case':
+        payload = json.loads(args.payload)
+        result = run_case(payload['case'], payload['ffmpeg'], payload['output'])
+        print(json.dumps(result))
+        return 0
+
+    if args.command == 'run':
+        ffmpeg_path = args.ffmpeg or find_ffmpeg()
+        if not ffmpeg_path:
+            print("找不到 ffmpeg，请用 --ffmpeg 指定", file=sys.stderr)
+            return 2
+        parse_size = lambda text: tuple(int(v) for v in text.lower().split('x'))
+        data = run_benchmark(ffmpeg_path, args.duration, parse_size(args.video_size),
+                             parse_size(args.image_size), args.repeat, args.type, args.match)
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            json.dump(data, fp, ensure_ascii=False, indent=2)
+        failed = sum(1 for r in data['results'] if r['error'])
+        print(f"完成 {len(data['results'])} 个用例，失败 {failed} 个，结果已写入 {args.output}")
+        return 0
+
+    if args.command == 'pcm':
+        ffmpeg_path = args.ffmpeg or find_ffmpeg()
+        if not ffmpeg_path:
+            print("找不到 ffmpeg，请用 --ffmpeg 指定", file=sys.stderr)
+            return 2
+        for rate, rows in pcm_crossover(ffmpeg_path, repeat=args.repeat).items():
+            print(f"{rate} Hz 立体声 -> 44100 Hz")
+            for duration, fast, slow in rows:
+                print(f"  {duration:>6g} 秒  进程内 {fast:.4f}s  FFmpeg {slow:.4f}s  "
+                      f"{slow / fast:.2f}x")
+            point = crossover_point(rows)
+            print(f"  分界点：{f'{point:g} 秒' if point is not None else '测试范围内进程内路径始终更快'}")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as fp:
+        baseline = json.load(fp)
+    with open(args.current, encoding='utf-8') as fp:
+        current = json.load(fp)
+    problems = compare(baseline, current, args.threshold, args.min_seconds)
+    for case, metric, old, new, note in problems:
+        if metric == 'error':
+            print(f"失败    {case}: {note}")
+        else:
+            print(f"退化    {case} {metric}: {_format_value(metric, old)} -> "
+                  f"{_format_value(metric, new)} ({note})")
+    print(f"共 {len(current['results'])} 个用例，发现 {len(problems)} 处退化")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,8 +25,8 @@ def build_project():
             '--distpath', build_dir,    # 直接输出到build目录
             '--add-data', f'{os.path.join(root_dir, "icons")}:icons',  # 添加图标资源
             '--hidden-import', 'PIL',
-            '--hidden-import', 'PIL._imagingtk',
-            '--hidden-import', 'PIL._tkinter_finder',
+            # 程序不使用 Tk，不打包 tkinter 和 Pillow 的 Tk 支持，缩小体积、加快启动
+            '--exclude-module', 'tkinter',
             '--hidden-import', 'PyQt5',
             '--hidden-import', 'PyQt5.QtCore',
             '--hidden-import', 'PyQt5.QtGui',
@@ -0,0 +1,799 @@
+"""媒体转换引擎，不依赖 PyQt5，可直接在脚本或服务中使用。
+
+同步用法：
+    engine = ConversionEngine(ffmpeg_path)
+    engine.convert(ConversionJob('a.mkv', 'a.mp4', 'video', 'mp4'))
+
+异步用法（一个事件循环同时监管多个 FFmpeg 子进程）：
+    results = asyncio.run(engine.convert_many_async(jobs, concurrency=32))
+
+Pillow 只在转换图片时才导入，界面和纯音视频任务的启动不为它付出时间。
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from audio_batch import BatchSizer, batch_command
+from ffmpeg_caps import get_capabilities
+from ffmpeg_runner import FFmpegError, run_ffmpeg, run_ffmpeg_async
+from image_anim import ANIMATED_TARGETS, is_animated, save_animation
+from image_limits import ImageLimits, check_frame_budget, estimate_peak, load_within_limits
+from media_probe import probe_image, probe_media
+from metrics import REGISTRY, JobTrace, log_event, profiled, stage
+from pcm_fast import convert_wav, is_eligible
+from result_cache import file_digest, make_key, unlink_shared
+from size_target import SIZE_TARGET_FORMATS, audio_bitrate, container_overhead, encode_to_size
+from video_frames import FRAME_REQUIRES, FrameOptions, extract_frames
+from video_segments import encode_segmented, should_segment
+
+# 视频转换采用的处理方式
+PATH_COPY = 'copy'              # 音视频流直接复制（仅重新封装）
+PATH_COPY_VIDEO = 'copy_video'  # 复制视频流，只转码音频
+PATH_TRANSCODE = 'transcode'    # 全部重新编码
+PATH_IMAGE = 'image'
+PATH_CACHED = 'cached'          # 命中结果缓存，未重新转换
+PATH_FRAMES = 'frames'          # 从视频中抽取预览帧
+PATH_PCM = 'pcm'                # WAV 在进程内转换，不启动 FFmpeg
+
+PATH_NAMES = {
+    PATH_COPY: '流复制',
+    PATH_COPY_VIDEO: '复制视频/转码音频',
+    PATH_TRANSCODE: '重新编码',
+    PATH_IMAGE: '图片转换',
+    PATH_CACHED: '缓存命中',
+    PATH_FRAMES: '抽帧',
+    PATH_PCM: '进程内 WAV 转换'
+}
+
+# 各容器可以直接容纳的编码（ffprobe 的 codec_name），源文件编码都在其中时无需重新编码
+CONTAINER_CODECS = {
+    'mp4': {
+        'video': {'h264', 'hevc', 'mpeg4', 'av1', 'vp9'},
+        'audio': {'aac', 'mp3', 'ac3', 'eac3', 'opus', 'alac'}
+    },
+    'mkv': {
+        'video': {'h264', 'hevc', 'mpeg4', 'av1', 'vp8', 'vp9', 'mpeg2video', 'theora'},
+        'audio': {'aac', 'mp3', 'ac3', 'eac3', 'opus', 'vorbis', 'flac', 'pcm_s16le', 'dts'}
+    },
+    'mov': {
+        'video': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'},
+        'audio': {'aac', 'mp3', 'alac', 'ac3', 'pcm_s16le'}
+    },
+    'avi': {
+        # MP4/MKV 中的 H.264 需要转换码流格式才能放进 AVI，这里不做流复制
+        'video': {'mpeg4', 'mjpeg', 'msmpeg4v2', 'msmpeg4v3'},
+        'audio': {'mp3', 'ac3', 'pcm_s16le'}
+    },
+    'flv': {
+        'video': {'flv1', 'h264'},
+        'audio': {'mp3', 'aac'}
+    },
+    'wmv': {
+        'video': {'wmv1', 'wmv2'},
+        'audio': {'wmav1', 'wmav2'}
+    }
+}
+
+# 静态图片的保存参数，也是结果缓存键的一部分
+IMAGE_SAVE_OPTIONS = {
+    'quality': 95,  # JPEG质量设置
+    'optimize': True  # 优化文件大小
+}
+
+# 编码方案：在速度和输出体积之间取舍，各容器的具体参数见 video_codec_args / audio_args
+PROFILE_FASTEST = 'fastest'
+PROFILE_BALANCED = 'balanced'
+PROFILE_SMALLEST = 'smallest'
+DEFAULT_PROFILE = PROFILE_BALANCED
+
+PROFILE_NAMES = {
+    PROFILE_FASTEST: '最快',
+    PROFILE_BALANCED: '均衡',
+    PROFILE_SMALLEST: '最小体积'
+}
+
+# libx264 各方案的 (preset, crf)
+X264_PROFILES = {
+    PROFILE_FASTEST: ('veryfast', '23'),
+    PROFILE_BALANCED: ('medium', '23'),
+    PROFILE_SMALLEST: ('slow', '26')
+}
+
+_ERROR_PREFIX = {
+    'image': '图片转换错误',
+    'video': '视频转换错误',
+    'audio': '音频转换错误'
+}
+
+
+class ConversionError(Exception):
+    """转换失败，消息可直接展示给用户；job 为失败的任务（如果已知）"""
+
+    def __init__(self, message, job=None):
+        super().__init__(message)
+        self.job = job
+
+
+@dataclass
+class ConversionJob:
+    """一个转换任务"""
+    input_path: str
+    output_path: str
+    file_type: str
+    target_format: str
+    media_info: object = None  # 导入阶段探测到的 MediaInfo，可选
+    profile: str = None        # 编码方案，None 时使用引擎的默认方案
+    threads: int = None        # FFmpeg 线程数上限，None 时由 FFmpeg 自行决定
+    size_target: object = None  # SizeTarget，MP4 / MKV / MOV 按目标大小或码率选择 CRF
+
+
+@dataclass
+class ConversionResult:
+    """转换结果"""
+    job: ConversionJob
+    output_path: str
+    elapsed: float
+    path_taken: str = PATH_TRANSCODE
+    estimated_peak: int = None       # 图片任务按尺寸估算的像素缓冲峰值（字节），不是实测值
+    estimated_speedup: float = None  # 分段编码相对单进程编码的估算加速比，需开启 estimate_speedup
+    timings: dict = None             # 各阶段耗时（秒）
+
+
+def default_output_path(input_path, output_dir, target_format):
+    """默认输出文件名：<原文件名>_converted.<目标格式>"""
+    return Path(output_dir) / f"{Path(input_path).stem}_converted.{target_format}"
+
+
+def flatten_to_rgb(img):
+    """把带透明通道或调色板的图片合成到白色背景上，返回 RGB 图片"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        from PIL import Image
+
+        # 创建白色背景
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        # 如果有透明通道，进行alpha合成；直接以原图作蒙版，Pillow 会使用其 alpha 通道，
+        # 不需要 split() 复制出每个通道
+        if 'A' in img.mode:
+            background.paste(img, mask=img)
+        else:
+            background.paste(img)
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def pil_format(target_format):
+    """目标扩展名对应的 Pillow 格式名"""
+    target_format = target_format.upper()
+    return 'JPEG' if target_format == 'JPG' else target_format
+
+
+def convert_image_file(input_path, output_path, target_format, on_progress=None,
+                       ffmpeg_path=None, limits=None, trace=None):
+    """转换一张图片；不依赖引擎实例，可在子进程中直接调用。
+
+    input_path / output_path 也可以是文件对象（如 BytesIO），此时应让 ffmpeg_path 为 None。
+    limits 为 ImageLimits，限制输出尺寸和内存预算；trace 为 JobTrace，记录解码和编码
+    阶段的耗时。返回估算的像素缓冲峰值（字节），按图片尺寸和模式计算，并非实测。
+    """
+    from PIL import Image
+
+    limits = limits or ImageLimits()
+    # 打开图片（只解析文件头）
+    with Image.open(input_path) as img:
+        _report(on_progress, 30)
+
+        # 动图转为 GIF / WebP 时逐帧转换，保留所有帧
+        if target_format in ANIMATED_TARGETS and is_animated(img):
+            peak = check_frame_budget(img, limits)
+            with stage(trace, 'encode'):
+                save_animation(img, input_path, output_path, target_format, on_progress,
+                               ffmpeg_path)
+            return peak
+
+        with stage(trace, 'decode'):
+            if limits.active:
+                img, peak = load_within_limits(img, limits)
+            else:
+                peak = estimate_peak(img.size, img.mode, img.size)
+
+            # 如果是PNG或其他带透明通道的格式，需要先转换为RGB
+            img = flatten_to_rgb(img)
+        _report(on_progress, 60)
+
+        # 保存图片（output_path 也可以是可写的文件对象）
+        if not hasattr(output_path, 'write'):
+            output_path = str(output_path)
+        with stage(trace, 'encode'):
+            img.save(output_path, pil_format(target_format), **IMAGE_SAVE_OPTIONS)
+    _report(on_progress, 100)
+    return peak
+
+
+def choose_video_path(media_info, target_format):
+    """根据探测到的源编码选择流复制、仅转码音频或完整转码"""
+    accepted = CONTAINER_CODECS.get(target_format)
+    if media_info is None or accepted is None:
+        return PATH_TRANSCODE
+    video_streams = media_info.video_streams
+    if not video_streams:
+        return PATH_TRANSCODE
+    if not all(s.codec_name in accepted['video'] for s in video_streams):
+        return PATH_TRANSCODE
+    if all(s.codec_name in accepted['audio'] for s in media_info.audio_streams):
+        return PATH_COPY
+    return PATH_COPY_VIDEO
+
+
+def verify_output(output_path):
+    """检查输出文件"""
+    output_path = Path(output_path)
+    if not output_path.exists():
+        raise Exception("转换失败：输出文件未生成")
+    if output_path.stat().st_size == 0:
+        raise Exception("转换失败：输出文件大小为0")
+
+
+def _report(on_progress, percent, info=None):
+    if on_progress is not None:
+        on_progress(percent, info)
+
+
+def _duration(job):
+    """探测到的输入时长；没有时由 FFmpeg 输出中解析"""
+    return getattr(job.media_info, 'duration', None)
+
+
+def _ffmpeg_progress(on_progress):
+    """把 FFmpeg 进度映射到 10-100 区间"""
+    if on_progress is None:
+        return None
+
+    def callback(info):
+        percent = 10 + int(info.percent * 0.9) if info.percent is not None else None
+        on_progress(percent, info)
+    return callback
+
+
+class ConversionEngine:
+    """图片、视频、音频转换的统一入口。
+
+    on_progress 回调的参数为 (percent, info)：percent 为 0-100 的整数或 None，
+    info 为 FFmpeg 任务的 ProgressInfo，图片任务为 None。
+    """
+
+    def __init__(self, ffmpeg_path=None, image_limits=None, result_cache=None,
+                 segment_options=None, profile=DEFAULT_PROFILE, metrics=None,
+                 image_profile_dir=None, audio_batch=None, pcm=None):
+        self.ffmpeg_path = ffmpeg_path
+        self.profile = profile
+        self.metrics = metrics or REGISTRY  # MetricsRegistry，记录任务数和各阶段耗时
+        self.image_profile_dir = image_profile_dir  # 设置后图片任务的 cProfile 结果写入该目录
+        self.image_limits = image_limits or ImageLimits()
+        self.result_cache = result_cache  # ResultCache，None 表示不使用缓存
+        self.segment_options = segment_options  # SegmentOptions，None 表示不分段编码
+        self.audio_batch = audio_batch  # AudioBatchOptions，None 表示短音频不合并转换
+        self.batch_sizer = BatchSizer(audio_batch) if audio_batch else None
+        self.pcm = pcm  # PcmOptions，None 表示 WAV 转 WAV 也使用 FFmpeg
+
+    @property
+    def caps(self):
+        if not self.ffmpeg_path:
+            raise Exception("未设置 ffmpeg 路径")
+        return get_capabilities(self.ffmpeg_path)
+
+    # ---- 同步接口 ----
+
+    def convert(self, job, on_progress=None):
+        """执行一个转换任务，失败时抛出 ConversionError"""
+        trace = JobTrace(job)
+        try:
+            cmd = None
+            if job.file_type == 'image':
+                trace.path_taken = PATH_IMAGE
+            else:
+                with trace.stage('probe'):
+                    self._ensure_media_info(job)
+                with trace.stage('caps'):
+                    self.caps
+                cmd, trace.path_taken = self.plan_command(job)
+                if is_eligible(job, self.pcm):
+                    trace.path_taken = PATH_PCM
+            with trace.stage('cache'):
+                key = self.cache_key(job, cmd, trace.path_taken)
+                cached = self._fetch_cached(job, key, on_progress)
+            if cached:
+                trace.path_taken = PATH_CACHED
+            else:
+                if job.file_type == 'image':
+                    trace.estimated_peak = self.convert_image(job, on_progress, trace)
+                else:
+                    _report(on_progress, 10)
+                    try:
+                        if self._size_targeted(job):
+                            # 抽样和完整编码分别计入 sample / encode 阶段
+                            self.convert_to_size(job, cmd, on_progress, trace)
+                        else:
+                            with trace.stage('encode'):
+                                if trace.path_taken == PATH_PCM:
+                                    convert_wav(job.input_path, job.output_path, self.pcm)
+                                elif self._use_segments(job, trace.path_taken):
+                                    trace.estimated_speedup = self.convert_segmented(job,
+                                                                                     on_progress)
+                                else:
+                                    run_ffmpeg(cmd, duration=_duration(job),
+                                               on_progress=_ffmpeg_progress(on_progress))
+                    except FFmpegError as e:
+                        raise Exception(f"FFmpeg 错误: {e}")
+                    with trace.stage('verify'):
+                        verify_output(job.output_path)
+                    _report(on_progress, 100)
+                with trace.stage('cache'):
+                    self._store_cached(job, key)
+        except Exception as e:
+            raise self._fail(trace, e) from e
+        return self._finish(trace)
+
+    def convert_image(self, job, on_progress=None, trace=None):
+        """转换图片，返回预计的像素缓冲峰值（字节）；设置了 image_profile_dir 时采集 cProfile"""
+        with profiled(self.image_profile_dir, Path(job.input_path).stem):
+            return convert_image_file(job.input_path, job.output_path, job.target_format,
+                                      on_progress, self.ffmpeg_path, self.image_limits, trace)
+
+    def _finish(self, trace):
+        """任务成功：输出日志、记录指标并返回结果"""
+        record = trace.record()
+        log_event('job_done', **record)
+        self.metrics.record_job(record)
+        job = trace.job
+        return ConversionResult(job, str(job.output_path), trace.elapsed, trace.path_taken,
+                                trace.estimated_peak, trace.estimated_speedup,
+                                record['stages'])
+
+    def _fail(self, trace, error):
+        """任务失败：输出日志、记录指标并返回要抛出的 ConversionError"""
+        error = self._wrap_error(trace.job, error)
+        record = trace.record(error)
+        log_event('job_failed', level=logging.WARNING, **record)
+        self.metrics.record_job(record)
+        return error
+
+    def run_traced(self, trace, work):
+        """执行引擎之外实现的转换（例如流式转换）：调用 work()，与引擎自己的任务一样
+        输出日志、记录指标。成功时返回 ConversionResult，失败时抛出 ConversionError。
+        """
+        try:
+            work()
+        except Exception as e:
+            raise self._fail(trace, e) from e
+        return self._finish(trace)
+
+    def cache_key(self, job, cmd=None, path_taken=None):
+        """结果缓存键：输入内容哈希 + 全部转换参数；未启用缓存时返回 None"""
+        if self.result_cache is None:
+            return None
+        params = {'type': job.file_type, 'target': job.target_format}
+        if job.file_type == 'image':
+            from PIL import __version__ as pillow_version
+
+            params['save'] = IMAGE_SAVE_OPTIONS
+            params['limits'] = asdict(self.image_limits)
+            params['pillow'] = pillow_version
+        else:
+            # 命令中的输入、输出路径不影响结果，替换为占位符
+            paths = {str(job.input_path): '{input}', str(job.output_path): '{output}'}
+            args = [paths.get(arg, arg) for arg in cmd[1:]]
+            # 线程数只影响速度，不作为缓存键的一部分
+            if '-threads' in args:
+                index = args.index('-threads')
+                del args[index:index + 2]
+            params['args'] = args
+            params['ffmpeg'] = self.caps.version
+            if path_taken == PATH_PCM:
+                # 进程内转换的重采样结果与 FFmpeg 不同，不能共用缓存
+                params['pcm'] = [self.pcm.sample_rate, self.pcm.taps]
+            if self._size_targeted(job):
+                params['size_target'] = asdict(job.size_target)
+        return make_key(file_digest(job.input_path), params)
+
+    def _fetch_cached(self, job, key, on_progress=None):
+        """命中缓存时生成输出并返回 True；未命中时清理与缓存共用数据的旧输出"""
+        if key is not None and self.result_cache.fetch(key, job.output_path):
+            _report(on_progress, 100)
+            return True
+        unlink_shared(job.output_path)
+        return False
+
+    def _store_cached(self, job, key):
+        if key is None:
+            return
+        try:
+            self.result_cache.store(key, job.output_path)
+        except OSError as e:
+            # 缓存写入失败不影响转换结果
+            log_event('cache_store_failed', level=logging.WARNING, output=str(job.output_path),
+                      error=str(e))
+
+    def _size_targeted(self, job):
+        return (job.size_target is not None and job.file_type == 'video'
+                and job.target_format in SIZE_TARGET_FORMATS)
+
+    def convert_to_size(self, job, cmd, on_progress=None, trace=None):
+        """按 job.size_target 抽样选择 CRF 后完整编码，返回选用的 CRF"""
+        profile = self.job_profile(job)
+        codec_args = self.video_codec_args(job.target_format, profile)
+        frame_rate = job.media_info.frame_rate if job.media_info is not None else None
+        return encode_to_size(self.ffmpeg_path, job.input_path, job.output_path, cmd,
+                              codec_args['video'], audio_bitrate(codec_args['audio'], job.media_info),
+                              _duration(job), job.size_target, _ffmpeg_progress(on_progress), trace,
+                              frame_rate, container_overhead(job.target_format, job.media_info))
+
+    def _use_segments(self, job, path_taken):
+        return (job.file_type == 'video' and path_taken == PATH_TRANSCODE
+                and not self._size_targeted(job)
+                and should_segment(self.segment_options, job.target_format, _duration(job)))
+
+    def convert_segmented(self, job, on_progress=None):
+        """长视频分段并行编码，返回估算的加速比"""
+        def callback(percent):
+            _report(on_progress, percent)
+        return encode_segmented(self.ffmpeg_path, job.input_path, job.output_path,
+                                self.video_codec_args(job.target_format, self.job_profile(job)),
+                                self.segment_options, _duration(job), callback, job.threads)
+
+    def extract_frames(self, input_path, output_dir, target_format='jpg', options=None,
+                       on_progress=None):
+        """从视频中抽帧（options 为 FrameOptions），返回 [(时间点, 输出路径)]。
+
+        output_dir 下按 <原文件名>_<序号>.<格式> 命名；失败时抛出 ConversionError。
+        """
+        job = ConversionJob(input_path, output_dir, 'video', target_format)
+        options = options or FrameOptions(count=1)
+        trace = JobTrace(job)
+        trace.path_taken = PATH_FRAMES
+        try:
+            with trace.stage('probe'):
+                self._ensure_media_info(job)
+            with trace.stage('caps'):
+                required = FRAME_REQUIRES.get(target_format)
+                if required and not self.caps.has_encoder(required[0]):
+                    raise Exception(f"当前 FFmpeg 不支持 {required[1]} 编码")
+            _report(on_progress, 10)
+            try:
+                with trace.stage('encode'):
+                    frames = extract_frames(self.ffmpeg_path, input_path, output_dir,
+                                            target_format, _duration(job), options)
+            except FFmpegError as e:
+                raise Exception(f"FFmpeg 错误: {e}")
+            _report(on_progress, 100)
+        except Exception as e:
+            raise self._fail(trace, e) from e
+        self._finish(trace)
+        return frames
+
+    def job_profile(self, job):
+        profile = job.profile or self.profile
+        if profile not in PROFILE_NAMES:
+            raise ValueError(f"未知的编码方案: {profile}")
+        return profile
+
+    def _ensure_media_info(self, job):
+        """视频任务需要源编码信息来判断能否流复制，导入阶段未探测时在这里补上"""
+        if job.file_type == 'video':
+            self.probe_job(job)
+
+    def probe_job(self, job):
+        """导入阶段未探测的任务在这里补上 media_info；探测失败时保持 None
+        （视频按重新编码处理，耗时按文件大小估计）"""
+        if job.media_info is not None:
+            return
+        try:
+            if job.file_type == 'image':
+                job.media_info = probe_image(job.input_path)
+            elif self.ffmpeg_path:
+                job.media_info = probe_media(job.input_path, self.ffmpeg_path, job.file_type)
+        except Exception as e:
+            log_event('probe_failed', level=logging.WARNING, input=str(job.input_path),
+                      error=str(e))
+
+    def plan_command(self, job):
+        """生成视频或音频任务的 FFmpeg 命令，返回 (命令, 处理方式)"""
+        # 基础命令参数
+        base_cmd = [
+            self.ffmpeg_path,
+            '-hide_banner',
+            '-i', str(job.input_path),
+            '-y'
+        ]
+        profile = self.job_profile(job)
+        if job.file_type == 'video':
+            path_taken = choose_video_path(job.media_info, job.target_format)
+            if self._size_targeted(job):
+                # 按目标大小编码需要调整 CRF，不能直接复制流
+                path_taken = PATH_TRANSCODE
+            format_cmd = self.video_args(job.target_format, path_taken, profile)
+        else:
+            path_taken = PATH_TRANSCODE
+            format_cmd = self.audio_args(job.target_format, profile)
+        if job.threads and path_taken != PATH_COPY:
+            format_cmd += ['-threads', str(job.threads)]
+
+        # 组合完整命令
+        cmd = base_cmd + format_cmd + [str(job.output_path)]
+        log_event('plan', level=logging.DEBUG, input=str(job.input_path),
+                  output=str(job.output_path), target=job.target_format, path=path_taken,
+                  cmd=cmd)
+        return cmd, path_taken
+
+    def build_command(self, job):
+        """生成视频或音频任务的 FFmpeg 命令"""
+        return self.plan_command(job)[0]
+
+    def video_args(self, target_format, path_taken=PATH_TRANSCODE, profile=DEFAULT_PROFILE):
+        """按处理方式组合视频任务的编码参数"""
+        codec_args = self.video_codec_args(target_format, profile)
+        if path_taken == PATH_COPY:
+            # 字幕和数据流不一定能放进目标容器，流复制时不保留
+            return ['-c:v', 'copy', '-c:a', 'copy', '-sn', '-dn'] + codec_args['format']
+
+        if path_taken == PATH_TRANSCODE:
+            # 检查编码器支持（同一 FFmpeg 只探测一次，结果缓存在磁盘上）
+            required = codec_args.get('requires')
+            if required and not self.caps.has_encoder(required[0]):
+                raise Exception(f"当前 FFmpeg 不支持 {required[1]} 编码")
+            return codec_args['audio'] + codec_args['video'] + codec_args['format']
+
+        return ['-c:v', 'copy'] + codec_args['audio'] + ['-sn', '-dn'] + codec_args['format']
+
+    def video_codec_args(self, target_format, profile=DEFAULT_PROFILE):
+        """各目标容器的音频、视频和封装参数；requires 为转码视频所需的编码器"""
+        # 最小体积方案降低音频码率（默认为 128k）
+        audio_extra = ['-b:a', '96k'] if profile == PROFILE_SMALLEST else []
+        # FLV / WMV2 / MPEG-4 Part 2 按码率编码（默认 200k）。最小体积方案把码率降到 150k，
+        # 同时开启率失真优化，弥补降码率带来的画质损失
+        mpegvideo_extra = (['-b:v', '150k', '-mbd', 'rd', '-trellis', '2', '-cmp', '2',
+                            '-subcmp', '2'] if profile == PROFILE_SMALLEST else [])
+        preset, crf = X264_PROFILES[profile]
+
+        # 根据目标格式添加特定参数
+        if target_format in ['mp4', 'mkv']:
+            return {
+                'audio': ['-c:a', 'mp3'] + audio_extra,  # 使用 mp3 替代 aac
+                'video': ['-c:v', 'libx264', '-preset', preset, '-crf', crf],
+                'format': [],
+                'requires': ('libx264', 'H.264')
+            }
+        elif target_format == 'flv':
+            return {
+                'audio': ['-c:a', 'mp3'] + audio_extra,  # 使用 mp3 替代 aac
+                'video': ['-c:v', 'flv'] + mpegvideo_extra,
+                'format': ['-f', 'flv']
+            }
+        elif target_format == 'wmv':
+            return {
+                'audio': ['-c:a', 'wmav2'] + audio_extra,
+                'video': ['-c:v', 'wmv2'] + mpegvideo_extra,
+                'format': ['-f', 'asf'],
+                'requires': ('wmv2', 'WMV')
+            }
+        elif target_format == 'avi':
+            return {
+                'audio': ['-c:a', 'mp3'] + audio_extra,
+                'video': ['-c:v', 'mpeg4'] + mpegvideo_extra,
+                'format': []
+            }
+        elif target_format == 'mov':
+            video = ['-c:v', 'h264']
+            # h264 通常由 libx264 实现，此时才能使用 preset / crf
+            if self.ffmpeg_path and self.caps.has_encoder('libx264'):
+                video += ['-preset', preset, '-crf', crf]
+            return {
+                'audio': ['-c:a', 'mp3'] + audio_extra,  # 使用 mp3 替代 aac
+                'video': video,
+                'format': ['-f', 'mov']
+            }
+        else:
+            raise ValueError(f"不支持的视频格式: {target_format}")
+
+    def audio_args(self, target_format, profile=DEFAULT_PROFILE):
+        # 检查编码器支持（同一 FFmpeg 只探测一次，结果缓存在磁盘上）
+        caps = self.caps
+        smallest = profile == PROFILE_SMALLEST
+
+        # 根据目标格式添加特定参数
+        if target_format == 'mp3':
+            if not caps.has_encoder('libmp3lame'):
+                raise Exception("当前 FFmpeg 不支持 MP3 编码")
+            args = [
+                '-c:a', 'libmp3lame',
+                '-q:a', '6' if smallest else '4'
+            ]
+            if profile == PROFILE_FASTEST:
+                # 使用 LAME 最快的编码算法
+                args += ['-compression_level', '9']
+            return args
+        elif target_format == 'wav':
+            return [
+                '-c:a', 'pcm_s16le',
+                '-ar', '44100'
+            ]
+        elif target_format == 'ogg':
+            if not caps.has_encoder('libvorbis'):
+                raise Exception("当前 FFmpeg 不支持 OGG/Vorbis 编码")
+            return [
+                '-c:a', 'libvorbis',
+                '-q:a', '2' if smallest else '4'
+            ]
+        else:
+            raise ValueError(f"不支持的音频格式: {target_format}")
+
+    def convert_many(self, jobs, concurrency=None, on_progress=None):
+        """同步执行一批任务，内部使用 convert_many_async"""
+        return asyncio.run(self.convert_many_async(jobs, concurrency, on_progress))
+
+    # ---- 异步接口 ----
+
+    async def convert_async(self, job, on_progress=None):
+        """convert 的异步版本：FFmpeg 子进程由事件循环监管，图片在线程池中处理"""
+        trace = JobTrace(job)
+        try:
+            cmd = None
+            if job.file_type == 'image':
+                trace.path_taken = PATH_IMAGE
+            else:
+                with trace.stage('probe'):
+                    await asyncio.to_thread(self._ensure_media_info, job)
+                with trace.stage('caps'):
+                    await asyncio.to_thread(getattr, self, 'caps')
+                cmd, trace.path_taken = self.plan_command(job)
+                if await asyncio.to_thread(is_eligible, job, self.pcm):
+                    trace.path_taken = PATH_PCM
+            with trace.stage('cache'):
+                key = await asyncio.to_thread(self.cache_key, job, cmd, trace.path_taken)
+                cached = await asyncio.to_thread(self._fetch_cached, job, key, on_progress)
+            if cached:
+                trace.path_taken = PATH_CACHED
+            else:
+                if job.file_type == 'image':
+                    trace.estimated_peak = await asyncio.to_thread(self.convert_image, job,
+                                                                   on_progress, trace)
+                else:
+                    _report(on_progress, 10)
+                    try:
+                        if self._size_targeted(job):
+                            await asyncio.to_thread(self.convert_to_size, job, cmd, on_progress,
+                                                    trace)
+                        else:
+                            with trace.stage('encode'):
+                                if trace.path_taken == PATH_PCM:
+                                    await asyncio.to_thread(convert_wav, job.input_path,
+                                                            job.output_path, self.pcm)
+                                elif self._use_segments(job, trace.path_taken):
+                                    trace.estimated_speedup = await asyncio.to_thread(
+                                        self.convert_segmented, job, on_progress)
+                                else:
+                                    await run_ffmpeg_async(
+                                        cmd, duration=_duration(job),
+                                        on_progress=_ffmpeg_progress(on_progress))
+                    except FFmpegError as e:
+                        raise Exception(f"FFmpeg 错误: {e}")
+                    with trace.stage('verify'):
+                        verify_output(job.output_path)
+                    _report(on_progress, 100)
+                with trace.stage('cache'):
+                    await asyncio.to_thread(self._store_cached, job, key)
+        except Exception as e:
+            raise self._fail(trace, e) from e
+        return self._finish(trace)
+
+    async def convert_batch_async(self, jobs, on_progress=None):
+        """把多个短音频放进一次 FFmpeg 调用中转换，按输入顺序返回 ConversionResult 或
+        ConversionError。批量调用失败时逐个重新转换，由单个任务报告各自的错误。
+
+        on_progress 回调的参数为 (job, percent, info)。
+        """
+        def callback(job):
+            if on_progress is None:
+                return None
+            return lambda percent, info: on_progress(job, percent, info)
+
+        results = [None] * len(jobs)
+        members = []  # (序号, JobTrace, 缓存键)
+        singles = []  # 走进程内 WAV 转换、不需要合并的任务
+        for index, job in enumerate(jobs):
+            if await asyncio.to_thread(is_eligible, job, self.pcm):
+                singles.append((index, JobTrace(job), None))
+                continue
+            trace = JobTrace(job)
+            try:
+                with trace.stage('caps'):
+                    await asyncio.to_thread(getattr, self, 'caps')
+                cmd, trace.path_taken = self.plan_command(job)
+                with trace.stage('cache'):
+                    key = await asyncio.to_thread(self.cache_key, job, cmd)
+                    cached = await asyncio.to_thread(self._fetch_cached, job, key,
+                                                     callback(job))
+            except Exception as e:
+                results[index] = self._fail(trace, e)
+                continue
+            if cached:
+                trace.path_taken = PATH_CACHED
+                results[index] = self._finish(trace)
+            else:
+                members.append((index, trace, key))
+
+        if len(members) > 1:
+            entries = [(trace.job.input_path,
+                        self.audio_args(trace.job.target_format, self.job_profile(trace.job)),
+                        trace.job.output_path) for _, trace, _ in members]
+            started = time.perf_counter()
+            try:
+                await run_ffmpeg_async(batch_command(self.ffmpeg_path, entries))
+            except FFmpegError as e:
+                log_event('audio_batch_failed', level=logging.WARNING, files=len(members),
+                          error=str(e))
+            else:
+                elapsed = time.perf_counter() - started
+                self.batch_sizer.observe(len(members), elapsed)
+                log_event('audio_batch_done', files=len(members), elapsed=round(elapsed, 6))
+                remaining = []
+                for index, trace, key in members:
+                    # 批量编码的耗时平均分摊到每个文件
+                    trace.add('encode', elapsed / len(members))
+                    job = trace.job
+                    try:
+                        with trace.stage('verify'):
+                            verify_output(job.output_path)
+                    except Exception:
+                        remaining.append((index, trace, key))
+                        continue
+                    with trace.stage('cache'):
+                        await asyncio.to_thread(self._store_cached, job, key)
+                    _report(callback(job), 100)
+                    results[index] = self._finish(trace)
+                members = remaining
+
+        # 只剩一个文件或批量调用失败时逐个转换
+        for index, trace, _ in sorted(members + singles, key=lambda member: member[0]):
+            job = trace.job
+            try:
+                results[index] = await self.convert_async(job, callback(job))
+            except ConversionError as e:
+                results[index] = e
+        return results
+
+    def convert_batch(self, jobs, on_progress=None):
+        """同步执行 convert_batch_async"""
+        return asyncio.run(self.convert_batch_async(jobs, on_progress))
+
+    async def convert_many_async(self, jobs, concurrency=None, on_progress=None):
+        """并发执行一批任务，按输入顺序返回 ConversionResult 或 ConversionError。
+
+        on_progress 回调的参数为 (job, percent, info)。
+        """
+        semaphore = asyncio.Semaphore(concurrency or os.cpu_count() or 1)
+
+        async def run_one(job):
+            callback = None
+            if on_progress is not None:
+                def callback(percent, info):
+                    on_progress(job, percent, info)
+            async with semaphore:
+                try:
+                    return await self.convert_async(job, callback)
+                except ConversionError as e:
+                    return e
+
+        return await asyncio.gather(*(run_one(job) for job in jobs))
+
+    def _wrap_error(self, job, error):
+        if isinstance(error, ConversionError):
+            return error
+        error_msg = str(error)
+        return ConversionError(f"{_ERROR_PREFIX.get(job.file_type, '转换错误')}: {error_msg}", job)
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from app_dirs import get_cache_dir
+from ffmpeg_runner import get_startupinfo
+from metrics import log_event
+
+CACHE_FILE_NAME = 'ffmpeg_caps.json'
+CACHE_VERSION = 1
+# 单次列表命令的超时（秒）
+PROBE_TIMEOUT = 30
+
+# macOS 上 Homebrew 安装的 ffmpeg
+_HOMEBREW_FFMPEG = '/opt/homebrew/bin/ffmpeg'
+
+# 编解码器列表行，例如 " V....D libx264   libx264 H.264 ..."
+_CODEC_LINE = re.compile(r'^\s*([VAS.][A-Z.]{5})\s+(\S+)\s*(.*)$')
+# 滤镜列表行，例如 " TSC scale   V->V   Scale the input video size."
+_FILTER_LINE = re.compile(r'^\s*([T.][S.][C.])\s+(\S+)\s+(\S+->\S+)\s*(.*)$')
+
+
+def find_ffmpeg():
+    """查找 ffmpeg 可执行文件，找不到时返回 None。
+
+    依次尝试：程序自带的 ffmpeg 目录（打包后在 sys._MEIPASS 下）、当前目录下的
+    ffmpeg 目录、macOS 上 Homebrew 的安装位置、PATH。
+    """
+    name = 'ffmpeg.exe' if sys.platform == 'win32' else 'ffmpeg'
+    if getattr(sys, 'frozen', False):
+        base_path = Path(sys._MEIPASS)
+    else:
+        base_path = Path(__file__).parent
+    candidates = [base_path / 'ffmpeg' / name, Path('ffmpeg') / name]
+    if sys.platform == 'darwin':
+        candidates.append(Path(_HOMEBREW_FFMPEG))
+    for candidate in candidates:
+        if candidate.is_file():
+            return str(candidate)
+    # 在 PATH 中查找，不启动 which 子进程
+    return shutil.which('ffmpeg')
+
+
+def _run_listing(ffmpeg_path, option):
+    """运行 ffmpeg <option> 返回标准输出；无法运行、超时或异常退出时返回空字符串"""
+    try:
+        result = subprocess.run(
+            [ffmpeg_path, '-hide_banner', option],
+            capture_output=True,
+            encoding='utf-8',
+            errors='replace',
+            timeout=PROBE_TIMEOUT,
+            startupinfo=get_startupinfo()
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return ''
+    return result.stdout if result.returncode == 0 else ''
+
+
+def _after_separator(text):
+    """跳过说明部分，返回分隔线之后的行"""
+    lines = text.splitlines()
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped and set(stripped) == {'-'}:
+            return lines[index + 1:]
+    return lines
+
+
+def parse_codecs(text):
+    """解析 -encoders / -decoders 的输出"""
+    codecs = {}
+    for line in _after_separator(text):
+        match = _CODEC_LINE.match(line)
+        if match:
+            flags, name, description = match.groups()
+            codecs[name.lower()] = {
+                'type': flags[0],
+                'flags': flags,
+                'description': description.strip()
+            }
+    return codecs
+
+
+def parse_formats(text):
+    """解析 -muxers / -demuxers 的输出，逗号分隔的别名分别登记"""
+    formats = {}
+    for line in _after_separator(text):
+        # 例如 "  E  mp4   MP4 (MPEG-4 Part 14)"
+        parts = line.split(None, 2)
+        if len(parts) < 2 or not set(parts[0]) <= set('DEd.'):
+            continue
+        flags, names = parts[0], parts[1]
+        description = parts[2] if len(parts) > 2 else ''
+        for name in names.split(','):
+            formats[name.lower()] = {
+                'flags': flags,
+                'description': description.strip()
+            }
+    return formats
+
+
+def parse_filters(text):
+    """解析 -filters 的输出"""
+    filters = {}
+    for line in text.splitlines():
+        match = _FILTER_LINE.match(line)
+        if match:
+            flags, name, io, description = match.groups()
+            filters[name.lower()] = {
+                'flags': flags,
+                'io': io,
+                'description': description.strip()
+            }
+    return filters
+
+
+def parse_version(text):
+    """从 -version 输出中提取版本号"""
+    match = re.search(r'ffmpeg version (\S+)', text)
+    return match.group(1) if match else ''
+
+
+class FFmpegCapabilities:
+    """某个 FFmpeg 可执行文件支持的编码器、解码器、封装格式和滤镜"""
+
+    def __init__(self, ffmpeg_path, version='', encoders=None, decoders=None,
+                 muxers=None, filters=None):
+        self.ffmpeg_path = ffmpeg_path
+        self.version = version
+        self.encoders = encoders or {}
+        self.decoders = decoders or {}
+        self.muxers = muxers or {}
+        self.filters = filters or {}
+
+    @property
+    def usable(self):
+        """探测是否成功；失败时编码器和封装格式列表为空"""
+        return bool(self.encoders and self.muxers)
+
+    def has_encoder(self, name):
+        return name.lower() in self.encoders
+
+    def has_decoder(self, name):
+        return name.lower() in self.decoders
+
+    def has_muxer(self, name):
+        return name.lower() in self.muxers
+
+    def has_filter(self, name):
+        return name.lower() in self.filters
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'encoders': self.encoders,
+            'decoders': self.decoders,
+            'muxers': self.muxers,
+            'filters': self.filters
+        }
+
+    @classmethod
+    def from_dict(cls, ffmpeg_path, data):
+        return cls(
+            ffmpeg_path,
+            version=data.get('version', ''),
+            encoders=data.get('encoders'),
+            decoders=data.get('decoders'),
+            muxers=data.get('muxers'),
+            filters=data.get('filters')
+        )
+
+    @classmethod
+    def probe(cls, ffmpeg_path):
+        """运行 FFmpeg 获取完整的能力列表"""
+        return cls(
+            ffmpeg_path,
+            version=parse_version(_run_listing(ffmpeg_path, '-version')),
+            encoders=parse_codecs(_run_listing(ffmpeg_path, '-encoders')),
+            decoders=parse_codecs(_run_listing(ffmpeg_path, '-decoders')),
+            muxers=parse_formats(_run_listing(ffmpeg_path, '-muxers')),
+            filters=parse_filters(_run_listing(ffmpeg_path, '-filters'))
+        )
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _binary_key(ffmpeg_path):
+    """以可执行文件的路径、大小和修改时间作为缓存键"""
+    resolved = Path(ffmpeg_path).resolve()
+    stat = resolved.stat()
+    return f'{resolved}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def _cache_file():
+    return get_cache_dir() / CACHE_FILE_NAME
+
+
+def _load_disk_cache():
+    try:
+        with open(_cache_file(), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('cache_version') == CACHE_VERSION:
+            return data.get('binaries', {})
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+def _save_disk_cache(binaries):
+    cache_file = _cache_file()
+    tmp_file = cache_file.with_name(cache_file.name + f'.{os.getpid()}.tmp')
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'cache_version': CACHE_VERSION, 'binaries': binaries}, f)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        log_event('caps_cache_write_failed', level=logging.WARNING, error=str(e))
+
+
+def get_capabilities(ffmpeg_path):
+    """获取 FFmpeg 能力，同一可执行文件只探测一次并持久化到磁盘。
+
+    探测失败（无法运行、超时或异常退出）的结果不缓存，下次调用时重新探测。
+    """
+    key = _binary_key(ffmpeg_path)
+    with _registry_lock:
+        caps = _registry.get(key)
+        if caps is not None:
+            return caps
+
+        binaries = _load_disk_cache()
+        if key in binaries:
+            caps = FFmpegCapabilities.from_dict(str(ffmpeg_path), binaries[key])
+        if caps is None or not caps.usable:
+            caps = FFmpegCapabilities.probe(str(ffmpeg_path))
+            if not caps.usable:
+                log_event('caps_probe_failed', level=logging.WARNING, ffmpeg=str(ffmpeg_path))
+                return caps
+            # 同一路径的旧版本记录已失效，一并清除
+            path_prefix = key.rsplit('|', 2)[0] + '|'
+            binaries = {k: v for k, v in binaries.items() if not k.startswith(path_prefix)}
+            binaries[key] = caps.to_dict()
+            _save_disk_cache(binaries)
+
+        _registry[key] = caps
+        return caps
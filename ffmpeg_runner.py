@@ -0,0 +1,238 @@
+import asyncio
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+# FFmpeg 在读取输入时打印的总时长，例如 "Duration: 01:02:03.45,"
+_DURATION_LINE = re.compile(r'Duration:\s*(\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+
+DEFAULT_STDERR_LINES = 200
+
+
+def get_startupinfo():
+    """Windows 下隐藏子进程控制台窗口"""
+    if sys.platform != 'win32':
+        return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    startupinfo.wShowWindow = subprocess.SW_HIDE
+    return startupinfo
+
+
+def format_seconds(seconds):
+    """把秒数格式化为 HH:MM:SS"""
+    if seconds is None:
+        return '--:--:--'
+    seconds = max(0, int(seconds))
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+class FFmpegError(Exception):
+    """FFmpeg 以非零状态退出，附带最后若干行错误输出"""
+
+    def __init__(self, returncode, stderr_tail):
+        self.returncode = returncode
+        self.stderr_tail = stderr_tail
+        super().__init__(stderr_tail.strip() or f"未知错误（退出码 {returncode}）")
+
+
+@dataclass
+class ProgressInfo:
+    """一次进度汇报"""
+    percent: float = None
+    out_time: float = 0.0
+    duration: float = None
+    fps: float = None
+    speed: float = None
+    eta: float = None
+    frame: int = None
+    total_size: int = None
+    done: bool = False
+
+    def describe(self):
+        parts = []
+        if self.percent is not None:
+            parts.append(f'{self.percent:.0f}%')
+        if self.fps:
+            parts.append(f'{self.fps:.0f} fps')
+        if self.speed:
+            parts.append(f'{self.speed:.2f}x')
+        if self.eta is not None:
+            parts.append(f'剩余 {format_seconds(self.eta)}')
+        return ' | '.join(parts)
+
+
+class StderrRing:
+    """只保留最后若干行的错误输出，顺便解析输入时长"""
+
+    def __init__(self, max_lines=DEFAULT_STDERR_LINES):
+        self.lines = deque(maxlen=max_lines)
+        self.duration = None
+
+    def feed(self, line):
+        line = line.rstrip()
+        if not line:
+            return
+        self.lines.append(line)
+        if self.duration is None:
+            match = _DURATION_LINE.search(line)
+            if match:
+                hours, minutes, seconds = match.groups()
+                self.duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    def tail(self):
+        return '\n'.join(self.lines)
+
+
+def _parse_float(value):
+    try:
+        return float(value.rstrip('x'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProgressParser:
+    """增量解析 `-progress` 输出的 key=value 块"""
+
+    def __init__(self, duration=None):
+        self.duration = duration
+        self.started = time.monotonic()
+        self._block = {}
+
+    def feed(self, line):
+        """喂入一行，凑满一个进度块时返回 ProgressInfo，否则返回 None"""
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        self._block[key] = value
+        if key != 'progress':
+            return None
+        block, self._block = self._block, {}
+        return self._build(block, value == 'end')
+
+    def _build(self, block, done):
+        out_time_us = _parse_int(block.get('out_time_us')) or _parse_int(block.get('out_time_ms'))
+        out_time = max(0.0, out_time_us / 1_000_000) if out_time_us else 0.0
+        info = ProgressInfo(
+            out_time=out_time,
+            duration=self.duration,
+            fps=_parse_float(block.get('fps')),
+            speed=_parse_float(block.get('speed')),
+            frame=_parse_int(block.get('frame')),
+            total_size=_parse_int(block.get('total_size')),
+            done=done
+        )
+        if done:
+            info.percent = 100.0
+            info.eta = 0.0
+        elif self.duration:
+            info.percent = min(99.9, out_time / self.duration * 100)
+            remaining = max(0.0, self.duration - out_time)
+            if info.speed:
+                info.eta = remaining / info.speed
+            elif out_time > 0:
+                elapsed = time.monotonic() - self.started
+                info.eta = remaining * elapsed / out_time
+        return info
+
+
+def with_progress_args(cmd):
+    """在 FFmpeg 命令中加入机器可读的进度输出参数"""
+    return [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+
+
+def run_ffmpeg(cmd, duration=None, on_progress=None, stderr_lines=DEFAULT_STDERR_LINES):
+    """运行 FFmpeg 并逐块回调进度。
+
+    duration 为探测到的输入时长（秒）；未提供时使用 FFmpeg 自己打印的时长。
+    错误输出只保留最后 stderr_lines 行，失败时随 FFmpegError 抛出。
+    """
+    ring = StderrRing(stderr_lines)
+    parser = ProgressParser(duration)
+
+    process = subprocess.Popen(
+        with_progress_args(cmd),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        encoding='utf-8',
+        errors='replace',
+        startupinfo=get_startupinfo()
+    )
+
+    def drain_stderr():
+        for line in process.stderr:
+            ring.feed(line)
+
+    stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+    stderr_thread.start()
+
+    try:
+        for line in process.stdout:
+            if parser.duration is None:
+                parser.duration = ring.duration
+            info = parser.feed(line)
+            if info is not None and on_progress is not None:
+                on_progress(info)
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+        stderr_thread.join()
+        process.stderr.close()
+
+    if returncode != 0:
+        raise FFmpegError(returncode, ring.tail())
+    return ring
+
+
+async def run_ffmpeg_async(cmd, duration=None, on_progress=None, stderr_lines=DEFAULT_STDERR_LINES):
+    """run_ffmpeg 的 asyncio 版本，多个任务可以在同一个事件循环里并发监管"""
+    ring = StderrRing(stderr_lines)
+    parser = ProgressParser(duration)
+
+    process = await asyncio.create_subprocess_exec(
+        *with_progress_args(cmd),
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        startupinfo=get_startupinfo()
+    )
+
+    async def drain_stderr():
+        async for line in process.stderr:
+            ring.feed(line.decode('utf-8', errors='replace'))
+
+    async def read_progress():
+        async for line in process.stdout:
+            if parser.duration is None:
+                parser.duration = ring.duration
+            info = parser.feed(line.decode('utf-8', errors='replace'))
+            if info is not None and on_progress is not None:
+                on_progress(info)
+
+    try:
+        await asyncio.gather(drain_stderr(), read_progress())
+        returncode = await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+
+    if returncode != 0:
+        raise FFmpegError(returncode, ring.tail())
+    return ring
@@ -1,280 +1,187 @@
 import os
 import sys
-import mimetypes
+import time
+
+# 启动计时的起点（--startup-profile）
+_STARTED = time.perf_counter()
+
 from pathlib import Path
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, 
                            QFileDialog, QVBoxLayout, QHBoxLayout, QWidget, QLabel,
-                           QComboBox, QMessageBox, QProgressBar, QLineEdit, QGroupBox)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from PIL import Image
-import subprocess
+                           QComboBox, QMessageBox, QProgressBar, QLineEdit, QGroupBox,
+                           QSpinBox, QTableWidget, QTableWidgetItem, QHeaderView)
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QIcon
+from ffmpeg_caps import find_ffmpeg
+from media_formats import AUDIO_FORMATS, IMAGE_FORMATS, VIDEO_FORMATS, detect_file_type
+from metrics import configure_logging, configure_metrics, log_event
+
+# 转换引擎（以及它依赖的 Pillow、asyncio 等）在窗口显示后由 StartupThread 在后台导入，
+# 界面代码在用到时才从这些模块中取名字
+
+
+class StartupProfile:
+    """--startup-profile：从导入本模块到首个窗口完成绘制的各阶段耗时（不含解释器启动）"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.last = _STARTED
+        self.phases = []
+
+    def mark(self, name):
+        if self.enabled:
+            now = time.perf_counter()
+            self.phases.append((name, now - self.last))
+            self.last = now
+
+    def report(self):
+        total = self.last - _STARTED
+        lines = ['启动耗时：']
+        lines += [f'  {name:<14}{seconds * 1000:8.1f} ms' for name, seconds in self.phases]
+        lines.append(f'  {"首个窗口":<12}{total * 1000:8.1f} ms')
+        print('\n'.join(lines), file=sys.stderr)
+        log_event('startup_profile', total=round(total, 6),
+                  phases={name: round(seconds, 6) for name, seconds in self.phases})
+
+    def report_background(self, timings):
+        lines = ['后台初始化（不阻塞窗口显示）：']
+        lines += [f'  {name:<14}{seconds * 1000:8.1f} ms' for name, seconds in timings.items()]
+        print('\n'.join(lines), file=sys.stderr)
+        log_event('startup_background',
+                  phases={name: round(seconds, 6) for name, seconds in timings.items()})
+
+
+class StartupThread(QThread):
+    """窗口显示后在后台查找 FFmpeg、导入转换模块并读取 FFmpeg 能力"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.ffmpeg_path = None
+        self.error = None
+        self.timings = {}
+
+    def run(self):
+        started = time.perf_counter()
+        self.ffmpeg_path = find_ffmpeg()
+        if self.ffmpeg_path is None:
+            self.error = "找不到 ffmpeg，请把 ffmpeg 放在程序目录的 ffmpeg 文件夹中或加入 PATH"
+            return
+        self.timings['ffmpeg'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        import job_queue  # noqa: F401  同时导入 convert_engine
+        import media_probe  # noqa: F401
+        import result_cache  # noqa: F401
+        self.timings['engine_import'] = time.perf_counter() - started
+
+        # 第一次转换时不必再等待 FFmpeg 能力探测（通常直接读磁盘缓存）
+        started = time.perf_counter()
+        try:
+            from ffmpeg_caps import get_capabilities
+            get_capabilities(self.ffmpeg_path)
+        except Exception as e:
+            log_event('caps_warmup_failed', error=str(e))
+        self.timings['ffmpeg_caps'] = time.perf_counter() - started
+
 
 class ConvertThread(QThread):
     progress = pyqtSignal(int)
+    progress_info = pyqtSignal(object)  # ProgressInfo：帧率、速度、剩余时间
     finished = pyqtSignal()
     error = pyqtSignal(str)
     
-    def __init__(self, file_path, output_path, file_type, target_format, ffmpeg_path):
+    def __init__(self, file_path, output_path, file_type, target_format, ffmpeg_path,
+                 media_info=None, profile=None):
         super().__init__()
-        self.file_path = file_path
-        self.output_path = output_path
-        self.file_type = file_type
-        self.target_format = target_format
-        self.ffmpeg_path = ffmpeg_path
+        from convert_engine import ConversionEngine, ConversionJob
+        from pcm_fast import PcmOptions
+        from result_cache import ResultCache
+        self.job = ConversionJob(file_path, output_path, file_type, target_format, media_info,
+                                 profile)
+        self.engine = ConversionEngine(ffmpeg_path, result_cache=ResultCache(),
+                                       pcm=PcmOptions())
+        self.result = None
 
     def run(self):
         try:
-            if self.file_type == "image":
-                self.convert_image()
-            elif self.file_type == "video":
-                self.convert_video()
-            else:
-                self.convert_audio()
+            self.result = self.engine.convert(self.job, on_progress=self.report_progress)
             self.finished.emit()
         except Exception as e:
             self.error.emit(str(e))
 
-    def convert_image(self):
-        try:
-            # 打开图片
-            img = Image.open(self.file_path)
-            self.progress.emit(30)
-            
-            # 如果是PNG或其他带透明通道的格式，需要先转换为RGB
-            if img.mode in ('RGBA', 'LA', 'P'):
-                # 创建白色背景
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                # 如果有透明通道，进行alpha合成
-                if 'A' in img.mode:
-                    background.paste(img, mask=img.split()[-1])
-                else:
-                    background.paste(img)
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-                
-            self.progress.emit(60)
-            
-            # 保存图片
-            img.save(str(self.output_path), 
-                    self.target_format.upper(), 
-                    quality=95,  # JPEG质量设置
-                    optimize=True)  # 优化文件大小
-            self.progress.emit(100)
-            
-        except Exception as e:
-            self.error.emit(f"图片转换错误: {str(e)}")
+    def report_progress(self, percent, info):
+        if percent is not None:
+            self.progress.emit(percent)
+        if info is not None:
+            self.progress_info.emit(info)
 
-    def convert_video(self):
-        try:
-            input_path = str(self.file_path)
-            output_path = str(self.output_path)
-            
-            print(f"开始视频转换：")
-            print(f"输入文件：{input_path}")
-            print(f"输出文件：{output_path}")
-            print(f"目标格式：{self.target_format}")
-            
-            # 检查编码器支持
-            probe_cmd = [self.ffmpeg_path, '-encoders']
-            result = subprocess.run(probe_cmd, capture_output=True, text=True)
-            encoders = result.stdout.lower()
-            print("可用编码器：", encoders)
-            
-            # 基础命令参数
-            base_cmd = [
-                self.ffmpeg_path,
-                '-hide_banner',
-                '-i', input_path,
-                '-y'
-            ]
-            
-            # 根据目标格式添加特定参数
-            if self.target_format in ['mp4', 'mkv']:
-                if 'libx264' not in encoders:
-                    raise Exception("当前 FFmpeg 不支持 H.264 编码")
-                format_cmd = [
-                    '-c:a', 'mp3',  # 使用 mp3 替代 aac
-                    '-c:v', 'libx264',
-                    '-preset', 'medium',
-                    '-crf', '23'
-                ]
-            elif self.target_format == 'flv':
-                format_cmd = [
-                    '-c:a', 'mp3',  # 使用 mp3 替代 aac
-                    '-c:v', 'flv',
-                    '-f', 'flv'
-                ]
-            elif self.target_format == 'wmv':
-                if 'wmv2' not in encoders:
-                    raise Exception("当前 FFmpeg 不支持 WMV 编码")
-                format_cmd = [
-                    '-c:a', 'wmav2',
-                    '-c:v', 'wmv2',
-                    '-f', 'asf'
-                ]
-            elif self.target_format == 'avi':
-                format_cmd = [
-                    '-c:a', 'mp3',
-                    '-c:v', 'mpeg4'
-                ]
-            elif self.target_format == 'mov':
-                format_cmd = [
-                    '-c:a', 'mp3',  # 使用 mp3 替代 aac
-                    '-c:v', 'h264',
-                    '-f', 'mov'
-                ]
-            else:
-                raise ValueError(f"不支持的视频格式: {self.target_format}")
-            
-            # 组合完整命令
-            cmd = base_cmd + format_cmd + [output_path]
-            print(f"执行命令：{' '.join(cmd)}")
-            
-            self.progress.emit(10)
-            
-            # 运行转换命令
-            startupinfo = None
-            if sys.platform == 'win32':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding='utf-8',
-                errors='replace',
-                startupinfo=startupinfo  # 添加 startupinfo
-            )
-            
-            stdout, stderr = process.communicate()
-            print(f"FFmpeg 输出：")
-            if stdout:
-                print(f"标准输出：\n{stdout}")
-            if stderr:
-                print(f"错误输出：\n{stderr}")
-            
-            if process.returncode != 0:
-                error_msg = stderr.strip() if stderr else "未知错误"
-                raise Exception(f"FFmpeg 错误: {error_msg}")
-            
-            # 检查输出文件
-            if not Path(output_path).exists():
-                raise Exception("转换失败：输出文件未生成")
-            if Path(output_path).stat().st_size == 0:
-                raise Exception("转换失败：输出文件大小为0")
-                
-            print("转换成功完成")
-            self.progress.emit(100)
-            
-        except Exception as e:
-            error_msg = str(e)
-            print(f"转换失败：{error_msg}")
-            self.error.emit(f"视频转换错误: {error_msg}")
+class BatchConvertThread(QThread):
+    """在一个事件循环中按并发限制执行整批任务"""
+    job_updated = pyqtSignal(int, int, str)  # 行号、进度、状态
+    overall_progress = pyqtSignal(int)
+    done = pyqtSignal(int, int, object)  # 成功数、失败数、按处理方式的计数
+
+    def __init__(self, jobs, ffmpeg_path, concurrency, parent=None):
+        super().__init__(parent)
+        from audio_batch import AudioBatchOptions
+        from convert_engine import ConversionEngine
+        from job_cost import SCHEDULE_SJF, CostModel, default_cost_path
+        from job_queue import JobQueue
+        from pcm_fast import PcmOptions
+        from result_cache import ResultCache
+        engine = ConversionEngine(ffmpeg_path, result_cache=ResultCache(),
+                                  audio_batch=AudioBatchOptions(), pcm=PcmOptions())
+        # 估计耗时短的任务先转换，大视频不会挡住后面的小文件
+        self.queue = JobQueue(engine, concurrency, schedule=SCHEDULE_SJF,
+                              cost_model=CostModel(default_cost_path()))
+        for job in jobs:
+            self.queue.add(job)
+
+    def run(self):
+        from job_queue import DONE, FAILED
+        self.queue.run(on_update=self.report_update)
+        self.done.emit(self.queue.count(DONE), self.queue.count(FAILED),
+                       self.queue.path_counts())
 
-    def convert_audio(self):
+    def report_update(self, queued):
+        from job_queue import STATUS_NAMES
+        status = STATUS_NAMES.get(queued.status, queued.status)
+        if queued.error:
+            status = f'{status}：{queued.error}'
+        elif not queued.finished and queued.eta:
+            status = f'{status}（预计 {time.strftime("%H:%M:%S", time.localtime(queued.eta))} 完成）'
+        self.job_updated.emit(queued.index, queued.percent, status)
+        self.overall_progress.emit(self.queue.overall_percent)
+
+    def cancel(self):
+        self.queue.cancel()
+
+class IngestThread(QThread):
+    """导入阶段：探测媒体信息、读取图片尺寸、检查磁盘空间"""
+    progress = pyqtSignal(int)
+    done = pyqtSignal(object)  # MediaInfo
+    error = pyqtSignal(str)
+
+    def __init__(self, file_path, output_dir, ffmpeg_path, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.output_dir = output_dir
+        self.ffmpeg_path = ffmpeg_path
+
+    def run(self):
         try:
-            input_path = str(self.file_path)
-            output_path = str(self.output_path)
-            
-            print(f"开始音频转换：")
-            print(f"输入文件：{input_path}")
-            print(f"输出文件：{output_path}")
-            print(f"目标格式：{self.target_format}")
-            
-            # 检查编码器支持
-            probe_cmd = [self.ffmpeg_path, '-encoders']
-            result = subprocess.run(probe_cmd, capture_output=True, text=True)
-            encoders = result.stdout.lower()
-            print("可用编码器：", encoders)
-            
-            # 基础命令参数
-            base_cmd = [
-                self.ffmpeg_path,
-                '-hide_banner',
-                '-i', input_path,
-                '-y'
-            ]
-            
-            # 根据目标格式添加特定参数
-            if self.target_format == 'mp3':
-                if 'libmp3lame' not in encoders:
-                    raise Exception("当前 FFmpeg 不支持 MP3 编码")
-                format_cmd = [
-                    '-c:a', 'libmp3lame',
-                    '-q:a', '4'
-                ]
-            elif self.target_format == 'wav':
-                format_cmd = [
-                    '-c:a', 'pcm_s16le',
-                    '-ar', '44100'
-                ]
-            elif self.target_format == 'ogg':
-                if 'libvorbis' not in encoders:
-                    raise Exception("当前 FFmpeg 不支持 OGG/Vorbis 编码")
-                format_cmd = [
-                    '-c:a', 'libvorbis',
-                    '-q:a', '4'
-                ]
-            else:
-                raise ValueError(f"不支持的音频格式: {self.target_format}")
-            
-            # 组合完整命令
-            cmd = base_cmd + format_cmd + [output_path]
-            print(f"执行命令：{' '.join(cmd)}")
-            
-            self.progress.emit(10)
-            
-            # 运行转换命令
-            startupinfo = None
-            if sys.platform == 'win32':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding='utf-8',
-                errors='replace',
-                startupinfo=startupinfo  # 添加 startupinfo
-            )
-            
-            # 等待转换完成
-            stdout, stderr = process.communicate()
-            print(f"FFmpeg 输出：")
-            if stdout:
-                print(f"标准输出：\n{stdout}")
-            if stderr:
-                print(f"错误输出：\n{stderr}")
-            
-            if process.returncode != 0:
-                error_msg = stderr.strip() if stderr else "未知错误"
-                raise Exception(f"FFmpeg 错误: {error_msg}")
-            
-            # 检查输出文件
-            if not Path(output_path).exists():
-                raise Exception("转换失败：输出文件未生成")
-            if Path(output_path).stat().st_size == 0:
-                raise Exception("转换失败：输出文件大小为0")
-                
-            print("转换成功完成")
-            self.progress.emit(100)
-            
+            from media_probe import ingest_file
+            info = ingest_file(self.file_path, self.output_dir, self.ffmpeg_path,
+                               on_progress=self.progress.emit)
+            self.done.emit(info)
         except Exception as e:
-            error_msg = str(e)
-            print(f"转换失败：{error_msg}")
-            self.error.emit(f"音频转换错误: {error_msg}")
+            self.error.emit(str(e))
 
 class FileConverterWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, startup_profile=None):
         super().__init__()
+        self.startup_profile = startup_profile or StartupProfile()
+        self._first_paint_pending = self.startup_profile.enabled
         self.setWindowTitle('媒体文件格式转换器')
         self.setGeometry(100, 100, 800, 600)  # 加大窗口尺寸
         
@@ -334,78 +241,87 @@ class FileConverterWindow(QMainWindow):
                 min-width: 200px;
             }
         """)
+        self.startup_profile.mark('stylesheet')
         
         # 支持的格式
-        self.image_formats = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.gif'}
-        self.video_formats = {'.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv'}
-        self.audio_formats = {'.mp3', '.wav', '.ogg'}  # 移除 aac
+        self.image_formats = set(IMAGE_FORMATS)
+        self.video_formats = set(VIDEO_FORMATS)
+        self.audio_formats = set(AUDIO_FORMATS)
         
         # 允许拖放
         self.setAcceptDrops(True)
         
         self.selected_file = None
         self.file_type = None
+        self.media_info = None
+        self.batch_files = []  # 批量模式下的 [(文件路径, 文件类型)]
         self.output_dir = str(Path.home() / "Downloads")
         
-        # 设置 ffmpeg 路径
-        self.ffmpeg_path = self.setup_ffmpeg()
+        # FFmpeg 在窗口显示后由后台线程查找，见 start_background_setup
+        self.ffmpeg_path = None
+        self.startup_thread = None
+        self.startup_done = False
         
         self.init_ui()
+        self.startup_profile.mark('init_ui')
+        QTimer.singleShot(0, self.start_background_setup)
 
-    def setup_ffmpeg(self):
-        """设置 ffmpeg 路径"""
-        try:
-            # 首先尝试使用系统的 ffmpeg
-            try:
-                # 在 macOS 上，ffmpeg 通常安装在 /opt/homebrew/bin/ffmpeg
-                if sys.platform == 'darwin':
-                    if Path('/opt/homebrew/bin/ffmpeg').exists():
-                        ffmpeg_path = '/opt/homebrew/bin/ffmpeg'
-                    else:
-                        # 尝试使用 which 命令查找 ffmpeg
-                        result = subprocess.run(['which', 'ffmpeg'], capture_output=True, text=True)
-                        if result.returncode == 0:
-                            ffmpeg_path = result.stdout.strip()
-                        else:
-                            raise FileNotFoundError("系统中未找到 ffmpeg")
-                else:
-                    # 在其他系统上使用原有的逻辑
-                    if getattr(sys, 'frozen', False):
-                        base_path = Path(sys._MEIPASS)
-                    else:
-                        base_path = Path(__file__).parent
-                    
-                    if sys.platform == 'win32':
-                        ffmpeg_path = str(base_path / 'ffmpeg' / 'ffmpeg.exe')
-                    else:
-                        ffmpeg_path = str(base_path / 'ffmpeg' / 'ffmpeg')
-                    
-                    if not Path(ffmpeg_path).exists():
-                        alt_path = Path('ffmpeg') / ('ffmpeg.exe' if sys.platform == 'win32' else 'ffmpeg')
-                        if alt_path.exists():
-                            ffmpeg_path = str(alt_path)
-                        else:
-                            raise FileNotFoundError(f"找不到 ffmpeg，已尝试路径：\n1. {ffmpeg_path}\n2. {alt_path}")
-            
-                print(f"FFMPEG路径: {ffmpeg_path}")
-                
-                # 设置 ffmpeg 环境变量
-                os.environ["FFMPEG_BINARY"] = ffmpeg_path
-                print(f"设置的FFMPEG环境变量: {os.environ['FFMPEG_BINARY']}")
-                
-                return ffmpeg_path
-                
-            except Exception as e:
-                error_msg = f'设置 ffmpeg 失败：{str(e)}\n当前目录：{os.getcwd()}'
-                print(error_msg)
-                QMessageBox.critical(self, '错误', error_msg)
-                sys.exit(1)
-                
-        except Exception as e:
-            error_msg = f'设置 ffmpeg 失败：{str(e)}\n当前目录：{os.getcwd()}'
+    def start_background_setup(self):
+        """在后台查找 ffmpeg 并预先导入转换模块"""
+        if self.startup_thread is not None:
+            return
+        self.startup_thread = StartupThread(self)
+        self.startup_thread.finished.connect(self.startup_finished)
+        self.startup_thread.start()
+
+    def ensure_ready(self):
+        """需要 FFmpeg 或转换模块前调用：后台初始化未完成时等待它，失败时返回 False"""
+        if not self.startup_done:
+            self.start_background_setup()
+            self.startup_thread.wait()
+            self.startup_finished()
+        return self.ffmpeg_path is not None
+
+    def startup_finished(self):
+        if self.startup_done:
+            return
+        self.startup_done = True
+        thread = self.startup_thread
+        if thread.error:
+            error_msg = f'设置 ffmpeg 失败：{thread.error}\n当前目录：{os.getcwd()}'
             print(error_msg)
             QMessageBox.critical(self, '错误', error_msg)
-            sys.exit(1)
+            QApplication.instance().exit(1)
+            return
+
+        # 设置 ffmpeg 环境变量
+        self.ffmpeg_path = thread.ffmpeg_path
+        os.environ["FFMPEG_BINARY"] = self.ffmpeg_path
+        log_event('ffmpeg_ready', path=self.ffmpeg_path)
+        self.populate_engine_options()
+        if self.startup_profile.enabled:
+            self.startup_profile.report_background(thread.timings)
+
+    def populate_engine_options(self):
+        """填入编码方案和默认并发数（来自转换模块，后台导入完成后才可用）"""
+        from convert_engine import DEFAULT_PROFILE, PROFILE_NAMES
+        from job_queue import DEFAULT_CONCURRENCY
+        for profile, name in PROFILE_NAMES.items():
+            self.profile_combo.addItem(name, profile)
+        self.profile_combo.setCurrentIndex(list(PROFILE_NAMES).index(DEFAULT_PROFILE))
+        for file_type, spin in self.concurrency_spins.items():
+            spin.setValue(DEFAULT_CONCURRENCY[file_type])
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self._first_paint_pending:
+            # 本次绘制结束后再记录，计入整个窗口的首次绘制
+            self._first_paint_pending = False
+            QTimer.singleShot(0, self.report_first_paint)
+
+    def report_first_paint(self):
+        self.startup_profile.mark('first_paint')
+        self.startup_profile.report()
 
     def init_ui(self):
         main_widget = QWidget()
@@ -479,6 +395,14 @@ class FileConverterWindow(QMainWindow):
         dir_group.setLayout(dir_layout)
         layout.addWidget(dir_group)
         
+        # 编码方案：速度与体积的取舍，对单文件和批量转换都生效
+        profile_layout = QHBoxLayout()
+        profile_layout.addWidget(QLabel('编码方案：'))
+        self.profile_combo = QComboBox()  # 选项由 populate_engine_options 填入
+        profile_layout.addWidget(self.profile_combo)
+        profile_layout.addStretch()
+        layout.addLayout(profile_layout)
+        
         # 进度显示组
         progress_group = QGroupBox("转换进度")
         progress_group.setStyleSheet("""
@@ -514,6 +438,9 @@ class FileConverterWindow(QMainWindow):
         self.select_button = QPushButton('选择文件')
         self.select_button.clicked.connect(self.select_file)
         button_layout.addWidget(self.select_button)
+        self.select_folder_button = QPushButton('选择文件夹')
+        self.select_folder_button.clicked.connect(self.select_folder)
+        button_layout.addWidget(self.select_folder_button)
         button_layout.addStretch()
         layout.addLayout(button_layout)
         
@@ -533,6 +460,45 @@ class FileConverterWindow(QMainWindow):
         format_group.addStretch()
         layout.addLayout(format_group)
         
+        # 批量模式：每种文件类型各选一个目标格式
+        batch_format_group = QHBoxLayout()
+        self.batch_format_widgets = {}
+        for file_type, type_name in (('image', '图片'), ('video', '视频'), ('audio', '音频')):
+            label = QLabel(f'{type_name}转换为：')
+            combo = QComboBox()
+            label.hide()
+            combo.hide()
+            batch_format_group.addWidget(label)
+            batch_format_group.addWidget(combo)
+            self.batch_format_widgets[file_type] = (label, combo)
+        batch_format_group.addStretch()
+        layout.addLayout(batch_format_group)
+        
+        # 批量模式：并发数设置，视频编码较重，默认并发数较小
+        concurrency_group = QHBoxLayout()
+        self.concurrency_label = QLabel('并发数：')
+        concurrency_group.addWidget(self.concurrency_label)
+        self.concurrency_spins = {}
+        for file_type, type_name in (('image', '图片'), ('video', '视频'), ('audio', '音频')):
+            spin = QSpinBox()
+            spin.setRange(1, 64)
+            spin.setPrefix(f'{type_name} ')
+            concurrency_group.addWidget(spin)
+            self.concurrency_spins[file_type] = spin
+        concurrency_group.addStretch()
+        layout.addLayout(concurrency_group)
+        self.set_batch_controls_visible(False)
+        
+        # 批量模式：每个任务的进度
+        self.job_table = QTableWidget(0, 3)
+        self.job_table.setHorizontalHeaderLabels(['文件', '进度', '状态'])
+        self.job_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.job_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.job_table.verticalHeader().hide()
+        self.job_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.job_table.hide()
+        layout.addWidget(self.job_table)
+        
         # 转换按钮
         convert_layout = QHBoxLayout()
         convert_layout.addStretch()
@@ -563,68 +529,140 @@ class FileConverterWindow(QMainWindow):
             self.dir_edit.setText(dir_path)
 
     def select_file(self):
-        file_path, _ = QFileDialog.getOpenFileName(
+        file_paths, _ = QFileDialog.getOpenFileNames(
             self,
             "选择文件",
             "",
             "所有支持的文件 (*.*)"
         )
         
-        if file_path:
-            self.selected_file = file_path
-            self.upload_progress.show()
-            
-            # 模拟上传进度
-            for i in range(101):
-                self.upload_progress.setValue(i)
-                QApplication.processEvents()
-                self.msleep(20)
-            
-            # 判断文件类型
-            self.detect_file_type(file_path)
-            
-            # 显示文件信息
-            file_name = Path(file_path).name
-            self.file_info.setText(f'已选择文件：{file_name}\n类型：{self.get_type_name()}')
-            
-            # 更新可用的目标格式
-            self.update_format_combo()
-            
-            # 显示转换相关控件
-            self.format_label.show()
-            self.format_combo.show()
-            self.convert_button.show()
-            self.status_label.setText('')
+        if len(file_paths) == 1:
+            self.start_ingest(file_paths[0])
+        elif file_paths:
+            self.start_batch(file_paths)
+
+    def select_folder(self):
+        dir_path = QFileDialog.getExistingDirectory(self, "选择要转换的文件夹", "")
+        if dir_path:
+            self.start_batch([dir_path])
+
+    def set_batch_controls_visible(self, visible):
+        self.concurrency_label.setVisible(visible)
+        for spin in self.concurrency_spins.values():
+            spin.setVisible(visible)
+
+    def start_batch(self, paths):
+        """展开目录并按类型分类，进入批量模式"""
+        from job_queue import collect_files
+        files, skipped = collect_files(paths)
+        if not files:
+            QMessageBox.critical(self, '错误', '没有找到支持的文件')
+            return
+        
+        self.batch_files = files
+        self.selected_file = None
+        self.media_info = None
+        self.upload_progress.hide()
+        self.format_label.hide()
+        self.format_combo.hide()
+        
+        counts = {}
+        for _, file_type in files:
+            counts[file_type] = counts.get(file_type, 0) + 1
+        summary = '，'.join(f'{self.get_type_name(t)} {n} 个' for t, n in counts.items())
+        text = f'已选择 {len(files)} 个文件：{summary}'
+        if skipped:
+            text += f'\n跳过 {len(skipped)} 个不支持的文件'
+        self.file_info.setText(text)
+        
+        # 每种出现的文件类型显示一个目标格式选择框
+        for file_type, (label, combo) in self.batch_format_widgets.items():
+            visible = file_type in counts
+            label.setVisible(visible)
+            combo.setVisible(visible)
+            if visible:
+                combo.clear()
+                formats = {'image': self.image_formats,
+                           'video': self.video_formats,
+                           'audio': self.audio_formats}[file_type]
+                combo.addItems([f[1:] for f in sorted(formats)])
+        self.set_batch_controls_visible(True)
+        
+        self.job_table.setRowCount(0)
+        self.job_table.hide()
+        self.convert_button.show()
+        self.convert_button.setEnabled(True)
+        self.status_label.setText('')
+
+    def leave_batch_mode(self):
+        self.batch_files = []
+        for label, combo in self.batch_format_widgets.values():
+            label.hide()
+            combo.hide()
+        self.set_batch_controls_visible(False)
+        self.job_table.hide()
 
-    def msleep(self, msecs):
-        QThread.msleep(msecs)
+    def start_ingest(self, file_path):
+        """在后台线程中读取文件信息，进度条反映实际的探测进度"""
+        if not self.ensure_ready():
+            return
+        self.leave_batch_mode()
+        self.selected_file = file_path
+        self.media_info = None
+        self.upload_progress.setValue(0)
+        self.upload_progress.show()
+        self.convert_button.setEnabled(False)
+        self.status_label.setText('正在读取文件信息...')
+        
+        self.ingest_thread = IngestThread(file_path, self.output_dir, self.ffmpeg_path, self)
+        self.ingest_thread.progress.connect(self.upload_progress.setValue)
+        self.ingest_thread.done.connect(self.ingest_finished)
+        self.ingest_thread.error.connect(self.ingest_error)
+        self.ingest_thread.start()
+
+    def ingest_finished(self, info):
+        # 忽略已被新选择的文件取代的结果
+        if self.sender() is not self.ingest_thread:
+            return
+        self.media_info = info
+        self.file_type = info.file_type
+        
+        # 显示文件信息
+        file_name = Path(self.selected_file).name
+        text = f'已选择文件：{file_name}\n类型：{self.get_type_name()}'
+        detail = info.describe()
+        if detail:
+            text += f'\n{detail}'
+        if not info.enough_disk_space:
+            text += '\n警告：输出目录所在磁盘剩余空间可能不足'
+        self.file_info.setText(text)
+        
+        # 更新可用的目标格式
+        self.update_format_combo()
+        
+        # 显示转换相关控件
+        self.format_label.show()
+        self.format_combo.show()
+        self.convert_button.show()
+        self.convert_button.setEnabled(True)
+        self.status_label.setText('')
+
+    def ingest_error(self, error_msg):
+        if self.sender() is not self.ingest_thread:
+            return
+        self.upload_progress.hide()
+        self.status_label.setText('')
+        QMessageBox.critical(self, '错误', f'无法处理文件：{error_msg}')
 
     def detect_file_type(self, file_path):
-        ext = Path(file_path).suffix.lower()
-        if ext in self.image_formats:
-            self.file_type = "image"
-        elif ext in self.video_formats:
-            self.file_type = "video"
-        elif ext in self.audio_formats:
-            self.file_type = "audio"
-        else:
-            mime_type = mimetypes.guess_type(file_path)[0]
-            if mime_type:
-                if mime_type.startswith('image/'):
-                    self.file_type = "image"
-                elif mime_type.startswith('video/'):
-                    self.file_type = "video"
-                elif mime_type.startswith('audio/'):
-                    self.file_type = "audio"
-            else:
-                raise ValueError("不支持的文件类型")
+        self.file_type = detect_file_type(file_path)
 
-    def get_type_name(self):
+    def get_type_name(self, file_type=None):
         return {
             "image": "图片文件",
             "video": "视频文件",
             "audio": "音频文件"
-        }.get(self.file_type, "未知类型")
+        }.get(file_type or self.file_type, "未知类型")
 
     def update_format_combo(self):
         self.format_combo.clear()
@@ -640,11 +678,17 @@ class FileConverterWindow(QMainWindow):
         self.format_combo.addItems([f[1:] for f in sorted(formats)])
 
     def start_convert(self):
+        if self.batch_files:
+            self.start_batch_convert()
+            return
         if not self.selected_file or not self.format_combo.currentText():
             return
+        if not self.ensure_ready():
+            return
+        from convert_engine import default_output_path
             
-        output_name = f"{Path(self.selected_file).stem}_converted.{self.format_combo.currentText()}"
-        output_path = Path(self.output_dir) / output_name
+        output_path = default_output_path(self.selected_file, self.output_dir,
+                                          self.format_combo.currentText())
         
         self.convert_progress.show()
         self.convert_progress.setValue(0)
@@ -656,21 +700,94 @@ class FileConverterWindow(QMainWindow):
             output_path,
             self.file_type,
             self.format_combo.currentText(),
-            self.ffmpeg_path
+            self.ffmpeg_path,
+            self.media_info,
+            self.profile_combo.currentData()
         )
         self.convert_thread.progress.connect(self.convert_progress.setValue)
+        self.convert_thread.progress_info.connect(self.show_progress_info)
         self.convert_thread.finished.connect(self.conversion_finished)
         self.convert_thread.error.connect(self.conversion_error)
         self.convert_thread.start()
 
+    def start_batch_convert(self):
+        if not self.ensure_ready():
+            return
+        from convert_engine import ConversionJob
+        from job_queue import PENDING, STATUS_NAMES, unique_output_path
+        targets = {file_type: combo.currentText()
+                   for file_type, (_, combo) in self.batch_format_widgets.items()}
+        concurrency = {file_type: spin.value()
+                       for file_type, spin in self.concurrency_spins.items()}
+        
+        jobs = []
+        taken = set()
+        for file_path, file_type in self.batch_files:
+            target_format = targets[file_type]
+            output_path = unique_output_path(file_path, self.output_dir, target_format, taken)
+            jobs.append(ConversionJob(file_path, output_path, file_type, target_format,
+                                      profile=self.profile_combo.currentData()))
+        
+        self.job_table.setRowCount(len(jobs))
+        for row, job in enumerate(jobs):
+            self.job_table.setItem(row, 0, QTableWidgetItem(Path(job.input_path).name))
+            bar = QProgressBar()
+            bar.setValue(0)
+            self.job_table.setCellWidget(row, 1, bar)
+            self.job_table.setItem(row, 2, QTableWidgetItem(STATUS_NAMES[PENDING]))
+        self.job_table.show()
+        
+        self.convert_progress.show()
+        self.convert_progress.setValue(0)
+        self.convert_button.setEnabled(False)
+        self.status_label.setText(f'正在转换 {len(jobs)} 个文件...')
+        
+        self.batch_thread = BatchConvertThread(jobs, self.ffmpeg_path, concurrency, self)
+        self.batch_thread.job_updated.connect(self.update_job_row)
+        self.batch_thread.overall_progress.connect(self.convert_progress.setValue)
+        self.batch_thread.done.connect(self.batch_finished)
+        self.batch_thread.start()
+
+    def update_job_row(self, row, percent, status):
+        self.job_table.cellWidget(row, 1).setValue(percent)
+        item = self.job_table.item(row, 2)
+        item.setText(status.splitlines()[0] if status else '')
+        item.setToolTip(status)
+
+    def batch_finished(self, succeeded, failed, path_counts):
+        from convert_engine import PATH_CACHED, PATH_COPY, PATH_COPY_VIDEO
+        self.convert_progress.setValue(100)
+        self.convert_button.setEnabled(True)
+        message = f'批量转换完成：成功 {succeeded} 个，失败 {failed} 个'
+        fast = path_counts.get(PATH_COPY, 0) + path_counts.get(PATH_COPY_VIDEO, 0)
+        if fast:
+            message += f'\n其中 {fast} 个视频未重新编码视频流（流复制）'
+        cached = path_counts.get(PATH_CACHED, 0)
+        if cached:
+            message += f'\n其中 {cached} 个文件直接使用了已有的转换结果'
+        self.status_label.setText(message)
+        if failed:
+            QMessageBox.warning(self, '转换完成', message)
+        else:
+            QMessageBox.information(self, '转换完成', message)
+
+    def show_progress_info(self, info):
+        detail = info.describe()
+        self.status_label.setText(f'正在转换... {detail}' if detail else '正在转换...')
+
     def conversion_finished(self):
+        from convert_engine import PATH_CACHED, PATH_COPY, PATH_COPY_VIDEO, PATH_NAMES
         self.convert_progress.setValue(100)
+        message = "文件转换已完成！"
+        result = self.convert_thread.result
+        if result is not None and result.path_taken in (PATH_COPY, PATH_COPY_VIDEO, PATH_CACHED):
+            message += f"（{PATH_NAMES[result.path_taken]}）"
         if sys.platform == 'darwin':  # macOS
             # 使用原生的 macOS 风格
             button = QPushButton('确定')
             msg_box = QMessageBox(self)
             msg_box.setWindowTitle("转换完成")
-            msg_box.setText("文件转换已完成！")
+            msg_box.setText(message)
             msg_box.addButton(button, QMessageBox.AcceptRole)
             msg_box.setTextFormat(Qt.RichText)  # 使用富文本格式
             msg_box.setStyleSheet("""
@@ -689,7 +806,7 @@ class FileConverterWindow(QMainWindow):
             # 其他系统使用标准样式
             msg_box = QMessageBox(self)
             msg_box.setWindowTitle("转换完成")
-            msg_box.setText("文件转换已完成！")
+            msg_box.setText(message)
             msg_box.setStandardButtons(QMessageBox.Ok)
             msg_box.setDefaultButton(QMessageBox.Ok)
         
@@ -731,40 +848,15 @@ class FileConverterWindow(QMainWindow):
 
     def dropEvent(self, event):
         files = [u.toLocalFile() for u in event.mimeData().urls()]
-        if files:
-            file_path = files[0]  # 只处理第一个文件
-            try:
-                # 使用现有的文件处理逻辑
-                self.selected_file = file_path
-                self.upload_progress.show()
-                
-                # 模拟上传进度
-                for i in range(101):
-                    self.upload_progress.setValue(i)
-                    QApplication.processEvents()
-                    self.msleep(20)
-                
-                # 判断文件类型
-                self.detect_file_type(file_path)
-                
-                # 显示文件信息
-                file_name = Path(file_path).name
-                self.file_info.setText(f'已选择文件：{file_name}\n类型：{self.get_type_name()}')
-                
-                # 更新可用的目标格式
-                self.update_format_combo()
-                
-                # 显示转换相关控件
-                self.format_label.show()
-                self.format_combo.show()
-                self.convert_button.show()
-                self.status_label.setText('')
-                
-            except Exception as e:
-                QMessageBox.critical(self, '错误', f'无法处理文件：{str(e)}')
+        if len(files) == 1 and Path(files[0]).is_file():
+            self.start_ingest(files[0])
+        elif files:
+            # 多个文件或目录进入批量模式
+            self.start_batch(files)
 
     def open_output_dir(self):
         """打开输出目录"""
+        import subprocess
         if sys.platform == 'darwin':  # macOS
             subprocess.run(['open', self.output_dir])
         elif sys.platform == 'win32':  # Windows
@@ -788,10 +880,20 @@ class FileConverterWindow(QMainWindow):
             return None
 
 def main():
+    # --startup-profile：在标准错误输出到首个窗口完成绘制的各阶段耗时
+    startup_profile = StartupProfile('--startup-profile' in sys.argv)
+    if startup_profile.enabled:
+        sys.argv.remove('--startup-profile')
+    startup_profile.mark('imports')
     try:
+        # 结构化日志和指标导出（由环境变量控制输出位置）
+        configure_logging()
+        configure_metrics()
         app = QApplication(sys.argv)
-        window = FileConverterWindow()
+        startup_profile.mark('qapplication')
+        window = FileConverterWindow(startup_profile)
         window.show()
+        startup_profile.mark('show')
         return app.exec_()
     except SystemExit:
         pass
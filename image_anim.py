@@ -0,0 +1,164 @@
+"""动图（GIF / WebP）逐帧转换。
+
+帧通过 ImageSequence 逐个解码，立即交给写入器：WebP 使用 Pillow 的动画编码器
+（按帧 seek 源图，不会一次性展开所有帧），GIF 使用逐帧写出的写入器。两种方式
+同一时刻只保留一两帧，内存占用与动画长度无关。帧时长和循环次数保持不变。
+"""
+from contextlib import nullcontext
+
+from ffmpeg_caps import get_capabilities
+from ffmpeg_runner import FFmpegError, run_ffmpeg
+from metrics import log_event
+
+# 支持保存为动图的目标格式
+ANIMATED_TARGETS = {'gif', 'webp'}
+
+# 帧数 × 单帧像素数超过该值时，如果 FFmpeg 可以处理则交给 FFmpeg
+FFMPEG_PIXEL_THRESHOLD = 500_000_000
+
+# GIF 中用作透明色的调色板索引
+_TRANSPARENT_INDEX = 255
+
+
+def is_animated(img):
+    return getattr(img, 'is_animated', False) and getattr(img, 'n_frames', 1) > 1
+
+
+def _duration(frame):
+    return int(frame.info.get('duration') or 100)
+
+
+class _FrameDurations(list):
+    """编码过程中按帧读取时长的列表。
+
+    Pillow 的 WebP 编码器在解码并写入第 index 帧之后才取 duration[index]，此时读取
+    源图当前帧的时长，无需为了时长预先把所有帧解码一遍（WebP 源的时长要在 load()
+    后才更新）。每取一帧同时汇报进度。
+    """
+
+    def __init__(self, img, on_progress):
+        super().__init__()
+        self.img = img
+        self.on_progress = on_progress
+        self.total = img.n_frames
+
+    def __getitem__(self, index):
+        _report(self.on_progress, 30 + int(70 * (index + 1) / self.total))
+        return _duration(self.img)
+
+
+def _report(on_progress, percent):
+    if on_progress is not None:
+        on_progress(percent, None)
+
+
+def _to_gif_frame(frame):
+    """把一帧转换为带透明色的调色板图像，返回 (图像, 透明色索引或 None)"""
+    if frame.mode == 'P' and 'transparency' not in frame.info:
+        return frame.copy(), None
+    rgba = frame.convert('RGBA')
+    alpha = rgba.getchannel('A')
+    # 255 色量化，留出一个索引给透明像素
+    paletted = rgba.convert('RGB').quantize(colors=255)
+    if alpha.getextrema()[0] >= 128:
+        return paletted, None
+    transparent = alpha.point(lambda a: 255 if a < 128 else 0)
+    paletted.paste(_TRANSPARENT_INDEX, mask=transparent)
+    return paletted, _TRANSPARENT_INDEX
+
+
+def _open_output(output_path):
+    """output_path 为文件对象时直接写入，不关闭它"""
+    if hasattr(output_path, 'write'):
+        return nullcontext(output_path)
+    return open(output_path, 'wb')
+
+
+def _save_gif(img, output_path, loop, on_progress):
+    """逐帧写出 GIF，每帧使用局部调色板"""
+    from PIL import GifImagePlugin, ImageSequence
+
+    total = img.n_frames
+    with _open_output(output_path) as fp:
+        for index, frame in enumerate(ImageSequence.Iterator(img)):
+            paletted, transparency = _to_gif_frame(frame)
+            # 转换时已解码该帧，此时 info 中一定有时长
+            if index == 0:
+                # 没有循环次数时不写循环扩展块，保持只播放一次
+                info = {} if loop is None else {'loop': loop}
+                header, _ = GifImagePlugin.getheader(paletted, info=info)
+                fp.write(b''.join(header))
+            params = {
+                'duration': _duration(frame),
+                'include_color_table': True,
+                # 每帧都是完整画面，有透明区域时需要清除上一帧
+                'disposal': 2 if transparency is not None else 1
+            }
+            if transparency is not None:
+                params['transparency'] = transparency
+            for chunk in GifImagePlugin.getdata(paletted, **params):
+                fp.write(chunk)
+            _report(on_progress, 30 + int(70 * (index + 1) / total))
+        fp.write(b';')
+
+
+def _save_webp(img, output_path, loop, on_progress):
+    # Pillow 的 WebP 动画编码器逐帧 seek 源图并立即编码；质量与静态 WebP 一致，
+    # 使用 Pillow 默认值（更高的质量会让编码器保留更多候选帧，内存明显上升）
+    if not hasattr(output_path, 'write'):
+        output_path = str(output_path)
+    # WebP 中 loop=0 表示无限循环，只播放一次要写 1
+    img.save(output_path, 'WEBP', save_all=True,
+             duration=_FrameDurations(img, on_progress),
+             loop=1 if loop is None else loop)
+    _report(on_progress, 100)
+
+
+def _can_offload(img, target_format, ffmpeg_path):
+    """源为 GIF、目标为 WebP 且 FFmpeg 带有 libwebp_anim 时可交给 FFmpeg"""
+    if not ffmpeg_path or img.format != 'GIF' or target_format != 'webp':
+        return False
+    width, height = img.size
+    if img.n_frames * width * height < FFMPEG_PIXEL_THRESHOLD:
+        return False
+    return get_capabilities(ffmpeg_path).has_encoder('libwebp_anim')
+
+
+def _save_with_ffmpeg(input_path, output_path, loop, ffmpeg_path, on_progress):
+    cmd = [
+        ffmpeg_path, '-hide_banner',
+        '-i', str(input_path), '-y',
+        '-c:v', 'libwebp_anim',
+        '-quality', '80',
+        # webp 封装默认只播放一次
+        *([] if loop is None else ['-loop', str(loop)]),
+        str(output_path)
+    ]
+
+    def callback(info):
+        if info.percent is not None:
+            _report(on_progress, 30 + int(info.percent * 0.7))
+
+    try:
+        run_ffmpeg(cmd, on_progress=callback)
+    except FFmpegError as e:
+        raise Exception(f"FFmpeg 错误: {e}")
+
+
+def save_animation(img, input_path, output_path, target_format, on_progress=None,
+                   ffmpeg_path=None):
+    """把已打开的动图逐帧转换为目标格式（gif / webp）"""
+    # 源图没有循环次数（GIF 无 NETSCAPE 扩展块）时只播放一次，记为 None
+    loop = img.info.get('loop')
+    if loop is not None:
+        loop = int(loop)
+    if _can_offload(img, target_format, ffmpeg_path):
+        # 动图较大，交给 FFmpeg 处理
+        log_event('animation_offloaded', input=str(input_path))
+        _save_with_ffmpeg(input_path, output_path, loop, ffmpeg_path, on_progress)
+        return
+
+    if target_format == 'webp':
+        _save_webp(img, output_path, loop, on_progress)
+    else:
+        _save_gif(img, output_path, loop, on_progress)
@@ -0,0 +1,140 @@
+"""多进程批量图片转换。
+
+图片解码和编码大部分时间持有 GIL，线程池只能用满一个核心；这里把任务分块
+提交到 ProcessPoolExecutor，结果以迭代器形式按完成顺序返回。任务可以是
+生成器，同时在途的块数有上限，因此内存占用与批量大小无关。
+
+    for result in convert_images(jobs, max_workers=8):
+        if isinstance(result, ConversionError):
+            ...
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from pathlib import Path
+
+from convert_engine import (PATH_IMAGE, ConversionError, ConversionJob, ConversionResult,
+                            convert_image_file)
+from image_limits import ImageLimits, format_bytes
+from job_queue import collect_files, unique_output_path
+
+DEFAULT_CHUNKSIZE = 16
+
+
+def _convert_chunk(chunk, limits=None):
+    """子进程中执行：依次转换一块图片，返回 [(序号, 错误信息, 耗时, 峰值内存)]"""
+    results = []
+    for index, input_path, output_path, target_format in chunk:
+        started = time.perf_counter()
+        peak = None
+        try:
+            peak = convert_image_file(input_path, output_path, target_format, limits=limits)
+            error = None
+        except Exception as e:
+            error = f"图片转换错误: {e}"
+        results.append((index, error, time.perf_counter() - started, peak))
+    return results
+
+
+def _chunks(jobs, chunksize):
+    iterator = iter(enumerate(jobs))
+    while True:
+        chunk = list(islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def convert_images(jobs, max_workers=None, chunksize=DEFAULT_CHUNKSIZE, max_pending=None,
+                   limits=None):
+    """在进程池中转换图片任务，按完成顺序逐个产出 ConversionResult 或 ConversionError。
+
+    jobs 为 ConversionJob 的可迭代对象（可以是生成器）；chunksize 为每次提交给
+    子进程的任务数；max_pending 为同时在途的块数，默认是进程数的两倍；
+    limits 为 ImageLimits，对每个任务生效。
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or max_workers * 2
+    chunks = _chunks(jobs, chunksize)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+
+        def submit_next():
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            payload = [(index, str(job.input_path), str(job.output_path), job.target_format)
+                       for index, job in chunk]
+            pending[pool.submit(_convert_chunk, payload, limits)] = dict(chunk)
+            return True
+
+        while len(pending) < max_pending and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk_jobs = pending.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # 子进程异常退出，整块任务记为失败
+                    results = [(index, f"图片转换错误: {e}", 0.0, None) for index in chunk_jobs]
+                for index, error, elapsed, peak in results:
+                    job = chunk_jobs[index]
+                    if error:
+                        yield ConversionError(error, job)
+                    else:
+                        yield ConversionResult(job, str(job.output_path), elapsed, PATH_IMAGE,
+                                               peak)
+                submit_next()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='多进程批量转换图片')
+    parser.add_argument('inputs', nargs='+', help='图片文件或目录')
+    parser.add_argument('-o', '--output-dir', required=True, help='输出目录')
+    parser.add_argument('-t', '--to', required=True, help='目标格式，例如 jpg')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='进程数，默认为 CPU 核心数')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help='每块任务数')
+    parser.add_argument('--max-dimension', type=int, default=None, help='输出图片最长边（像素）')
+    parser.add_argument('--memory-budget', type=int, default=None,
+                        help='单张图片的内存预算（MB），超出时缩小解码')
+    parser.add_argument('--reject-oversize', action='store_true',
+                        help='超出内存预算时拒绝转换，而不是缩小')
+    args = parser.parse_args(argv)
+    limits = ImageLimits(
+        max_dimension=args.max_dimension,
+        memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None,
+        downscale=not args.reject_oversize
+    )
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    files, _ = collect_files(args.inputs)
+    taken = set()
+    jobs = (ConversionJob(path, unique_output_path(path, output_dir, args.to, taken), 'image', args.to)
+            for path, file_type in files if file_type == 'image')
+
+    started = time.perf_counter()
+    succeeded = failed = 0
+    peak = 0
+    for result in convert_images(jobs, args.workers, args.chunksize, limits=limits):
+        if isinstance(result, ConversionError):
+            failed += 1
+            print(result, file=sys.stderr)
+        else:
+            succeeded += 1
+            peak = max(peak, result.estimated_peak or 0)
+    elapsed = time.perf_counter() - started
+    print(f"完成：成功 {succeeded} 个，失败 {failed} 个，耗时 {elapsed:.2f} 秒，"
+          f"单张图片像素缓冲峰值估算为 {format_bytes(peak)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
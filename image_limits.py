@@ -0,0 +1,143 @@
+"""超大图片的尺寸上限与内存预算。
+
+默认情况下图片按原始分辨率完整解码。设置了最长边上限或内存预算后，在分配像素
+缓冲之前先根据文件头估算所需内存：JPEG 借助 draft() 在解码时直接按 1/2、1/4、
+1/8 缩小，其他格式在解码后立即缩小；连原尺寸解码都放不进预算时直接拒绝。
+
+只有 JPEG 能在解码阶段缩小，内存预算真正限制的是 JPEG 的峰值；其他格式总是先按
+原尺寸完整解码，预算只能用来拒绝原尺寸放不下的图片，缩小只减少后续缓冲。
+
+内存按同时存在的像素缓冲估算（解码结果、缩放结果、转为 RGB 的结果），
+Pillow 的分配不经过 Python 的内存分配器，无法精确统计；记录到日志和指标中的
+estimated_peak 也是这个估算值，不是实测的峰值。
+"""
+from dataclasses import dataclass
+
+from metrics import log_event
+
+
+@dataclass
+class ImageLimits:
+    """图片转换的尺寸和内存限制，None 表示不限制"""
+    max_dimension: int = None  # 输出图片最长边（像素）
+    memory_budget: int = None  # 单个任务的像素缓冲上限（字节）
+    downscale: bool = True     # 超出预算时缩小图片；False 时直接拒绝
+
+    @property
+    def active(self):
+        return bool(self.max_dimension or self.memory_budget)
+
+
+def bytes_per_pixel(mode):
+    """Pillow 内部每个像素占用的字节数（RGB 按 4 字节存储）"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def image_bytes(size, mode):
+    width, height = size
+    return width * height * bytes_per_pixel(mode)
+
+
+def format_bytes(size):
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+def jpeg_draft_size(size, requested):
+    """JPEG 调用 draft(mode, requested) 后实际解码的尺寸（与 Pillow 的选择规则一致）"""
+    width, height = size
+    scale = min(width // max(requested[0], 1), height // max(requested[1], 1))
+    for factor in (8, 4, 2, 1):
+        if scale >= factor:
+            break
+    return ((width + factor - 1) // factor, (height + factor - 1) // factor)
+
+
+def estimate_peak(decoded_size, mode, output_size):
+    """解码、缩放并转为 RGB 时同时存在的像素缓冲总量"""
+    peak = image_bytes(decoded_size, mode)
+    if mode in ('1', 'P'):
+        # 调色板和二值图先转为 RGBA / L 再缩放
+        mode = 'RGBA' if mode == 'P' else 'L'
+        peak += image_bytes(decoded_size, mode)
+    if output_size != decoded_size:
+        peak += image_bytes(output_size, mode)
+    if mode != 'RGB':
+        peak += image_bytes(output_size, 'RGB')
+    return peak
+
+
+def _scaled(size, scale):
+    return (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+
+
+def plan_decode(img, limits):
+    """根据文件头决定解码方式，返回 (输出尺寸, 是否使用 JPEG draft, 预计峰值)。
+
+    超出预算且不能缩小时抛出异常，此时尚未分配像素缓冲。
+    """
+    size, mode = img.size, img.mode
+    is_jpeg = img.format == 'JPEG'
+
+    def decoded(output_size):
+        if is_jpeg and output_size != size:
+            return jpeg_draft_size(size, output_size)
+        return size
+
+    scale = 1.0
+    if limits.max_dimension and max(size) > limits.max_dimension:
+        scale = limits.max_dimension / max(size)
+    output_size = _scaled(size, scale)
+    peak = estimate_peak(decoded(output_size), mode, output_size)
+
+    budget = limits.memory_budget
+    if budget and peak > budget:
+        if not limits.downscale:
+            raise Exception(f"图片 {size[0]}x{size[1]} 预计占用 {format_bytes(peak)}，"
+                            f"超出内存预算 {format_bytes(budget)}")
+        if not is_jpeg and image_bytes(size, mode) > budget:
+            raise Exception(f"图片 {size[0]}x{size[1]} 原尺寸解码需要 "
+                            f"{format_bytes(image_bytes(size, mode))}，超出内存预算 "
+                            f"{format_bytes(budget)}，且该格式不支持缩小解码")
+        # 逐步缩小输出尺寸，直到预计峰值放进预算
+        while peak > budget and max(output_size) > 1:
+            scale *= 0.9
+            output_size = _scaled(size, scale)
+            peak = estimate_peak(decoded(output_size), mode, output_size)
+        if peak > budget:
+            raise Exception(f"内存预算 {format_bytes(budget)} 过小，无法转换该图片")
+    return output_size, is_jpeg and output_size != size, peak
+
+
+def load_within_limits(img, limits):
+    """在限制内解码图片，返回 (图片, 预计峰值字节数)"""
+    output_size, use_draft, peak = plan_decode(img, limits)
+    if use_draft:
+        # 解码器直接输出缩小后的图像，不分配原尺寸缓冲
+        img.draft(img.mode, output_size)
+    img.load()
+    if img.size == output_size:
+        return img, peak
+
+    log_event('image_downscaled', source_size=list(img.size), output_size=list(output_size))
+    from PIL import Image
+
+    if img.mode in ('1', 'P'):
+        img = img.convert('RGBA' if img.mode == 'P' else 'L')
+    return img.resize(output_size, Image.LANCZOS, reducing_gap=3.0), peak
+
+
+def check_frame_budget(img, limits):
+    """动图逐帧转换，按单帧的缓冲检查预算，超出时拒绝；返回预计峰值。
+
+    动图不做缩小，最长边上限对动图不生效。
+    """
+    peak = estimate_peak(img.size, img.mode, img.size)
+    budget = limits.memory_budget
+    if budget and peak > budget:
+        raise Exception(f"动图单帧预计占用 {format_bytes(peak)}，超出内存预算 "
+                        f"{format_bytes(budget)}")
+    return peak
@@ -0,0 +1,193 @@
+"""按存储设备调度读写，以及在临时目录中生成输出。
+
+同一块机械硬盘、U 盘或网络盘上的多个任务并行读写时，磁头来回寻道、带宽被
+平分，总吞吐量反而下降。任务队列用 st_dev 识别输入和输出所在的设备，按设备类型
+限制同时访问它的任务数：机械硬盘和 USB 存储每次一个，网络文件系统两个，SSD、
+内存文件系统等不限制。设备类型在 Linux 上读取 /sys/dev/block 和 /proc/self/mountinfo，
+其他平台一律视为不限制。
+
+OutputStaging 让 FFmpeg 和 Pillow 先写到快速的本地临时目录（例如 tmpfs），
+成功后再移动到输出位置：同一文件系统内直接 rename，跨文件系统时先复制为输出
+目录中的隐藏文件再 rename，输出目录中不会出现写了一半的文件；失败的任务只需
+删除临时文件。
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+
+from metrics import log_event
+
+DEVICE_ROTATIONAL = 'rotational'
+DEVICE_USB = 'usb'
+DEVICE_NETWORK = 'network'
+DEVICE_MEMORY = 'memory'
+DEVICE_SSD = 'ssd'
+DEVICE_UNKNOWN = 'unknown'
+
+# 各类设备默认同时访问的任务数，未列出的类型不限制
+DEVICE_CONCURRENCY = {
+    DEVICE_ROTATIONAL: 1,
+    DEVICE_USB: 1,
+    DEVICE_NETWORK: 2
+}
+
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', 'sshfs', '9p',
+                       'afs', 'ceph', 'glusterfs', 'fuse.glusterfs', 'davfs', 'fuse.rclone'}
+MEMORY_FILESYSTEMS = {'tmpfs', 'ramfs'}
+
+_kinds = {}
+_kinds_lock = threading.Lock()
+
+
+def device_of(path):
+    """路径所在设备的 st_dev；路径还不存在（如输出文件）时取最近的已存在的上级目录"""
+    path = Path(path).absolute()
+    for candidate in (path,) + tuple(path.parents):
+        try:
+            return candidate.stat().st_dev
+        except OSError:
+            continue
+    return None
+
+
+def job_devices(input_path, output_path):
+    """任务读写涉及的设备，按序号排序去重"""
+    devices = {device_of(input_path), device_of(output_path)}
+    devices.discard(None)
+    return tuple(sorted(devices))
+
+
+def _mount_types():
+    """st_dev -> 文件系统类型，来自 /proc/self/mountinfo"""
+    types = {}
+    try:
+        with open('/proc/self/mountinfo', encoding='utf-8') as fp:
+            for line in fp:
+                fields, _, rest = line.partition(' - ')
+                major, _, minor = fields.split()[2].partition(':')
+                types[os.makedev(int(major), int(minor))] = rest.split()[0]
+    except (OSError, ValueError, IndexError):
+        pass
+    return types
+
+
+def _block_kind(dev):
+    """块设备的类型：USB、机械硬盘或 SSD"""
+    node = Path(f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}')
+    try:
+        resolved = str(node.resolve(strict=True))
+    except OSError:
+        return DEVICE_UNKNOWN
+    if '/usb' in resolved:
+        return DEVICE_USB
+    # 分区没有 queue 目录，取所在磁盘的
+    for queue in (node / 'queue', node.resolve().parent / 'queue'):
+        try:
+            rotational = (queue / 'rotational').read_text().strip()
+        except OSError:
+            continue
+        return DEVICE_ROTATIONAL if rotational == '1' else DEVICE_SSD
+    return DEVICE_UNKNOWN
+
+
+def device_kind(dev):
+    """设备类型，结果按 st_dev 缓存"""
+    with _kinds_lock:
+        if dev in _kinds:
+            return _kinds[dev]
+    kind = DEVICE_UNKNOWN
+    if sys.platform.startswith('linux'):
+        fs_type = _mount_types().get(dev)
+        if fs_type in NETWORK_FILESYSTEMS:
+            kind = DEVICE_NETWORK
+        elif fs_type in MEMORY_FILESYSTEMS:
+            kind = DEVICE_MEMORY
+        elif os.major(dev) != 0:
+            kind = _block_kind(dev)
+    with _kinds_lock:
+        _kinds[dev] = kind
+    return kind
+
+
+def device_limit(dev, per_device=None):
+    """同时访问该设备的任务数上限，None 表示不限制；per_device 为统一指定的上限"""
+    if per_device:
+        return per_device
+    return DEVICE_CONCURRENCY.get(device_kind(dev))
+
+
+def default_scratch_dir():
+    """优先使用内存文件系统 /dev/shm，没有时使用系统临时目录"""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def move_into_place(source, target):
+    """把 source 原子地移动为 target：目标位置要么是旧文件，要么是完整的新文件"""
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(source, target)
+        return
+    except OSError:
+        # 跨文件系统不能 rename，先复制到目标目录中的隐藏文件
+        pass
+    partial = target.with_name(f'.{target.name}.{os.getpid()}.part')
+    try:
+        shutil.copyfile(source, partial)
+        os.replace(partial, target)
+    except BaseException:
+        try:
+            os.unlink(partial)
+        except OSError:
+            pass
+        raise
+    os.unlink(source)
+
+
+class OutputStaging:
+    """把任务的输出暂时改到 scratch_dir 中，成功后移动到原来的位置"""
+
+    def __init__(self, scratch_dir, reserve=2.0):
+        self.scratch_dir = Path(scratch_dir)
+        self.reserve = reserve  # 临时目录的剩余空间至少为输入大小的倍数，不足时直接写输出
+        self.scratch_dir.mkdir(parents=True, exist_ok=True)
+
+    def begin(self, job):
+        """改写 job.output_path，返回原输出路径；空间不足时不改写，返回 None"""
+        try:
+            needed = os.path.getsize(job.input_path) * self.reserve
+            if shutil.disk_usage(self.scratch_dir).free < needed:
+                return None
+        except OSError:
+            return None
+        final = job.output_path
+        # 只生成文件名，由 FFmpeg / Pillow 创建文件，权限与直接写输出时相同
+        job.output_path = str(self.scratch_dir / f'stage_{uuid.uuid4().hex}_{Path(final).name}')
+        return final
+
+    def commit(self, job, final, result):
+        """转换成功：移动到原输出路径并更新结果"""
+        staged = job.output_path
+        job.output_path = final
+        try:
+            move_into_place(staged, final)
+        except OSError:
+            os.unlink(staged)
+            raise
+        result.output_path = str(final)
+        log_event('output_staged', output=str(final), scratch=str(staged))
+
+    def abort(self, job, final):
+        """转换失败：删除临时文件，原输出路径保持不变"""
+        staged = job.output_path
+        job.output_path = final
+        try:
+            os.unlink(staged)
+        except OSError:
+            pass
@@ -0,0 +1,219 @@
+"""任务耗时估计与调度顺序。
+
+每个任务先换算成工作量：视频为 时长 × 百万像素，音频为时长，图片为 百万像素 × 帧数；
+没有探测信息（导入阶段未探测，JobQueue 补探测也失败）时退回到文件大小（MB）。耗时 = 固定开销 + 工作量 / 吞吐量，
+吞吐量按 (源扩展名, 目标格式, 处理方式, 工作量单位) 分别记录，初始为经验值，
+每完成一个任务按指数滑动平均修正，并保存在缓存目录中供下次使用。
+
+JobQueue 用估计值决定启动顺序：
+
+- fifo：按提交顺序（默认）；
+- sjf：估计耗时最短的先启动；
+- fair：按文件类型加权公平分配，每类累计已启动的估计耗时 / 权重，最少的一类先启动，
+  类内按 sjf。
+
+sjf 和 fair 都带老化：排序分数 = 估计耗时 − aging × 已等待时间，大任务等得越久
+分数越低，不会一直被后来的小任务插队。
+"""
+import json
+import math
+import os
+import threading
+from pathlib import Path
+
+from app_dirs import get_cache_dir
+from convert_engine import PATH_CACHED, PATH_COPY, PATH_COPY_VIDEO, choose_video_path
+
+SCHEDULE_FIFO = 'fifo'
+SCHEDULE_SJF = 'sjf'
+SCHEDULE_FAIR = 'fair'
+SCHEDULES = (SCHEDULE_FIFO, SCHEDULE_SJF, SCHEDULE_FAIR)
+
+COST_FILE_NAME = 'job_costs.json'
+
+# 工作量单位
+UNIT_MPIXEL = 'mpixel'                # 图片：百万像素 × 帧数
+UNIT_MPIXEL_SECOND = 'mpixel_second'  # 视频：时长（秒）× 百万像素
+UNIT_SECOND = 'second'                # 音频：时长（秒）
+UNIT_MEGABYTE = 'megabyte'            # 没有探测信息时：输入文件大小（MB）
+
+# 吞吐量经验值（工作量单位 / 秒），在没有历史记录时使用
+DEFAULT_RATES = {
+    ('image', UNIT_MPIXEL): 30.0,
+    ('image', UNIT_MEGABYTE): 20.0,
+    ('video', UNIT_MPIXEL_SECOND): 3.0,
+    ('video', UNIT_MEGABYTE): 1.0,
+    ('audio', UNIT_SECOND): 300.0,
+    ('audio', UNIT_MEGABYTE): 30.0
+}
+# 流复制只重新封装，比重新编码快得多
+COPY_SPEEDUP = 100.0
+# 每个任务的固定开销（秒）：启动 FFmpeg、打开文件等
+OVERHEAD = {'image': 0.005, 'video': 0.1, 'audio': 0.03}
+# 新样本在滑动平均中的权重
+SMOOTHING = 0.3
+DEFAULT_AGING = 1.0
+
+
+def default_cost_path():
+    return get_cache_dir() / COST_FILE_NAME
+
+
+def work_units(job):
+    """任务的 (工作量单位, 工作量)"""
+    info = job.media_info
+    if info is not None:
+        if job.file_type == 'image' and info.width and info.height:
+            return UNIT_MPIXEL, info.width * info.height / 1e6 * max(1, info.n_frames or 1)
+        if job.file_type == 'video' and info.duration:
+            pixels = (info.width or 1280) * (info.height or 720) / 1e6
+            return UNIT_MPIXEL_SECOND, info.duration * pixels
+        if job.file_type == 'audio' and info.duration:
+            return UNIT_SECOND, info.duration
+    try:
+        size = os.path.getsize(job.input_path)
+    except OSError:
+        size = info.size if info is not None else 0
+    return UNIT_MEGABYTE, size / 1e6
+
+
+def _path_kind(job, path_taken=None):
+    """吞吐量分组用的处理方式：视频区分流复制和重新编码，其他类型只有一种"""
+    if job.file_type != 'video':
+        return job.file_type
+    if path_taken is None:
+        path_taken = choose_video_path(job.media_info, job.target_format)
+    return 'copy' if path_taken in (PATH_COPY, PATH_COPY_VIDEO) else 'transcode'
+
+
+class CostModel:
+    """各格式组合的吞吐量；path 不为 None 时从该文件读取历史记录，save() 写回"""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self._rates = {}  # 分组键 -> [吞吐量, 样本数]
+        self._lock = threading.Lock()
+        if self.path is not None:
+            try:
+                with open(self.path, encoding='utf-8') as fp:
+                    self._rates = {key: list(value) for key, value in json.load(fp).items()}
+            except (OSError, ValueError):
+                pass
+
+    @staticmethod
+    def _key(job, unit, path_taken=None):
+        source = Path(job.input_path).suffix.lower().lstrip('.')
+        return f'{source}>{job.target_format}:{_path_kind(job, path_taken)}:{unit}'
+
+    def rate(self, job, unit):
+        with self._lock:
+            learned = self._rates.get(self._key(job, unit))
+        if learned:
+            return learned[0]
+        rate = DEFAULT_RATES.get((job.file_type, unit), 1.0)
+        if _path_kind(job) == 'copy':
+            rate *= COPY_SPEEDUP
+        return rate
+
+    def estimate(self, job, work=None):
+        """预计耗时（秒）；work 为 work_units(job) 的结果，None 时在这里计算"""
+        unit, units = work or work_units(job)
+        return OVERHEAD.get(job.file_type, 0.0) + units / self.rate(job, unit)
+
+    def record(self, job, result, work=None):
+        """用完成的任务修正吞吐量；命中缓存的结果不反映转换速度，忽略。
+
+        work 应与估计耗时时使用的相同：引擎在转换中可能补上 media_info，重新计算
+        会换成另一种工作量单位，记录到估计时不会读取的分组中。
+        """
+        if result is None or result.path_taken == PATH_CACHED or not result.elapsed:
+            return
+        unit, units = work or work_units(job)
+        if units <= 0:
+            return
+        # 很小的任务耗时接近固定开销，至少按一半耗时计算，避免吞吐量被高估
+        busy = max(result.elapsed - OVERHEAD.get(job.file_type, 0.0), result.elapsed / 2)
+        sample = units / busy
+        key = self._key(job, unit, result.path_taken)
+        with self._lock:
+            learned = self._rates.get(key)
+            if learned:
+                # 在对数上平均，偶尔一次特别慢（或快）的任务不会让估计值剧烈变化
+                rate = math.exp((1 - SMOOTHING) * math.log(learned[0])
+                                + SMOOTHING * math.log(sample))
+                self._rates[key] = [rate, learned[1] + 1]
+            else:
+                self._rates[key] = [sample, 1]
+
+    def save(self):
+        """原子地写回历史记录"""
+        if self.path is None:
+            return
+        with self._lock:
+            data = json.dumps(self._rates, ensure_ascii=False, indent=1)
+        tmp = self.path.with_name(self.path.name + f'.{os.getpid()}.tmp')
+        try:
+            tmp.write_text(data, encoding='utf-8')
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+
+def _of_type(ranked, file_type, wanted):
+    return (queued for queued in ranked if queued.job.file_type == file_type and wanted(queued))
+
+
+class Scheduler:
+    """决定等待中任务的启动顺序"""
+
+    def __init__(self, mode=SCHEDULE_FIFO, cost_model=None, aging=DEFAULT_AGING, weights=None):
+        if mode not in SCHEDULES:
+            raise ValueError(f"未知的调度方式: {mode}")
+        self.mode = mode
+        self.cost_model = cost_model or CostModel()
+        self.aging = aging
+        self.weights = weights or {}  # 文件类型 -> 权重，fair 模式使用，默认均为 1
+        self._virtual = {}            # 文件类型 -> 已启动的估计耗时 / 权重
+
+    def rank(self, queued):
+        """排序键，越小越先启动。
+
+        分数 估计耗时 − aging × (当前时间 − 加入时间) 对所有任务减去的是同一个
+        aging × 当前时间，顺序与 估计耗时 + aging × 加入时间 相同，不随时间变化，
+        排好序的列表可以一直使用到有新任务加入。
+        """
+        if self.mode == SCHEDULE_FIFO:
+            return queued.index
+        return queued.estimate + self.aging * queued.enqueued
+
+    def order(self, ranked, types, wanted):
+        """从按 rank 排好序的列表中逐个产生满足 wanted 的任务（生成器，可以提前停止）"""
+        if self.mode != SCHEDULE_FAIR:
+            yield from (queued for queued in ranked if wanted(queued))
+            return
+        # fair：每次从累计值最小的类型中取排在最前的任务
+        virtual = dict(self._virtual)
+        streams = {file_type: _of_type(ranked, file_type, wanted) for file_type in types}
+        heads = {}
+        for file_type, stream in streams.items():
+            head = next(stream, None)
+            if head is not None:
+                heads[file_type] = head
+        while heads:
+            file_type = min(heads, key=lambda name: (virtual.get(name, 0.0), name))
+            queued = heads[file_type]
+            yield queued
+            virtual[file_type] = virtual.get(file_type, 0.0) + self._charge(queued)
+            head = next(streams[file_type], None)
+            if head is None:
+                del heads[file_type]
+            else:
+                heads[file_type] = head
+
+    def _charge(self, queued):
+        return queued.estimate / self.weights.get(queued.job.file_type, 1.0)
+
+    def started(self, queued):
+        """任务启动时计入所属类型的累计值"""
+        file_type = queued.job.file_type
+        self._virtual[file_type] = self._virtual.get(file_type, 0.0) + self._charge(queued)
@@ -0,0 +1,453 @@
+"""批量转换任务队列：展开目录、分类文件、按类型限制并发执行"""
+import asyncio
+import os
+import time
+from dataclasses import astuple, dataclass
+from pathlib import Path
+
+from audio_batch import is_batchable
+from convert_engine import (PATH_CACHED, ConversionError, ConversionJob, ConversionResult,
+                            default_output_path)
+from io_devices import OutputStaging, device_limit, job_devices
+from job_cost import SCHEDULE_FIFO, Scheduler, work_units
+from media_formats import detect_file_type
+from metrics import log_event
+from result_cache import file_digest, link_file
+
+_CPU_COUNT = os.cpu_count() or 1
+
+# 图片转换在线程池中执行，可以多开；视频编码本身会占满多个核心，默认只并发少量任务
+DEFAULT_CONCURRENCY = {
+    'image': _CPU_COUNT,
+    'video': max(1, _CPU_COUNT // 8),
+    'audio': max(1, _CPU_COUNT // 2)
+}
+
+# 由 FFmpeg 处理、参与线程分配的任务类型
+FFMPEG_TYPES = ('video', 'audio')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+STATUS_NAMES = {
+    PENDING: '等待中',
+    RUNNING: '转换中',
+    DONE: '已完成',
+    FAILED: '失败',
+    CANCELLED: '已取消'
+}
+
+# 重新估计完成时间的最短间隔（秒）
+PREDICT_INTERVAL = 1.0
+
+
+def collect_files(paths, recursive=True):
+    """展开文件和目录，返回 ([(文件路径, 文件类型)], [不支持的文件])"""
+    files = []
+    skipped = []
+
+    def add(path):
+        try:
+            files.append((str(path), detect_file_type(path)))
+        except ValueError:
+            skipped.append(str(path))
+
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            if recursive:
+                walker = os.walk(path)
+            else:
+                walker = [(str(path), [], os.listdir(path))]
+            for root, dirs, names in walker:
+                dirs.sort()
+                for name in sorted(names):
+                    child = Path(root) / name
+                    if child.is_file() and not name.startswith('.'):
+                        add(child)
+        elif path.is_file():
+            add(path)
+    return files, skipped
+
+
+def unique_output_path(input_path, output_dir, target_format, taken):
+    """同一批次中重名的输出文件追加序号"""
+    output_path = default_output_path(input_path, output_dir, target_format)
+    counter = 1
+    while str(output_path) in taken:
+        output_path = output_path.with_name(
+            f"{Path(input_path).stem}_converted_{counter}.{target_format}")
+        counter += 1
+    taken.add(str(output_path))
+    return output_path
+
+
+@dataclass
+class QueuedJob:
+    """队列中的一个任务及其状态"""
+    index: int
+    job: ConversionJob
+    status: str = PENDING
+    percent: int = 0
+    error: str = None
+    result: object = None
+    content_key: tuple = None  # (输入内容哈希, 文件类型, 目标格式, 编码方案, 目标大小)，用于批内去重
+    batchable: bool = False    # 短音频，可以与其他任务合并到一次 FFmpeg 调用中
+    devices: tuple = ()        # 读写涉及的存储设备（st_dev）
+    estimate: float = None     # 预计耗时（秒），见 job_cost.CostModel
+    work: tuple = None         # 估计耗时时的 (工作量单位, 工作量)，完成后按同一单位修正吞吐量
+    eta: float = None          # 预计完成时间（time.time() 时间戳），运行中随进度更新
+    enqueued: float = None     # 加入队列的时间（time.monotonic()）
+    started: float = None      # 开始转换的时间（time.monotonic()）
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+
+class JobQueue:
+    """按文件类型分别限制并发数的任务队列。
+
+    所有任务在一个事件循环中调度，FFmpeg 子进程由 ConversionEngine 的异步接口监管。
+    on_update(queued_job) 在任务状态或进度变化时调用。thread_budget 为 True 时，
+    同时运行的 FFmpeg 任务平分 CPU 核心，而不是各自按全部核心开线程。
+    引擎设置了 audio_batch 时，短音频任务按批合并转换，一批只占一个并发名额。
+
+    除了按类型限制，同时读写同一存储设备的任务数也有上限（见 io_devices）：
+    per_device 为 None 时按设备类型决定，为整数时所有设备统一使用该上限。
+    设置 scratch_dir 时输出先写到该目录，成功后再移动到输出位置，设备按临时目录计算。
+
+    schedule 决定等待中任务的启动顺序（fifo / sjf / fair，见 job_cost），每个任务的
+    预计耗时和完成时间写在 QueuedJob.estimate / eta 中；cost_model 为 CostModel，
+    完成的任务用来修正吞吐量估计。
+    """
+
+    def __init__(self, engine, concurrency=None, thread_budget=True, per_device=None,
+                 scratch_dir=None, schedule=SCHEDULE_FIFO, cost_model=None):
+        self.engine = engine
+        self.thread_budget = thread_budget
+        self.concurrency = dict(DEFAULT_CONCURRENCY)
+        if concurrency:
+            self.concurrency.update(concurrency)
+        self.per_device = per_device
+        self.staging = OutputStaging(scratch_dir) if scratch_dir else None
+        self.jobs = []
+        self._running = {file_type: 0 for file_type in self.concurrency}
+        self._device_running = {}
+        self._cancelled = False
+        self.scheduler = Scheduler(schedule, cost_model)
+        self._ranked = []
+        self._predicted = None
+
+    def add(self, job):
+        queued = QueuedJob(len(self.jobs), job, enqueued=time.monotonic())
+        self.jobs.append(queued)
+        return queued
+
+    def cancel(self):
+        """不再启动新任务，已在运行的任务会继续完成"""
+        self._cancelled = True
+
+    @property
+    def overall_percent(self):
+        if not self.jobs:
+            return 100
+        total = sum(100 if queued.finished else queued.percent for queued in self.jobs)
+        return total // len(self.jobs)
+
+    def count(self, status):
+        return sum(1 for queued in self.jobs if queued.status == status)
+
+    def path_counts(self):
+        """已完成任务按处理方式（流复制 / 重新编码等）计数"""
+        counts = {}
+        for queued in self.jobs:
+            if queued.status == DONE:
+                path = queued.result.path_taken
+                counts[path] = counts.get(path, 0) + 1
+        return counts
+
+    def run(self, on_update=None):
+        """阻塞执行全部任务"""
+        asyncio.run(self.run_async(on_update))
+        return self.jobs
+
+    async def run_async(self, on_update=None):
+        notify = on_update or (lambda queued: None)
+        tasks = set()
+        await asyncio.to_thread(self._assign_content_keys)
+        if any(queued.batchable for queued in self.jobs):
+            await asyncio.to_thread(self.engine.batch_sizer.calibrate, self.engine.ffmpeg_path)
+        self.predict()
+
+        while True:
+            if self._cancelled:
+                for queued in self.jobs:
+                    if queued.status == PENDING:
+                        queued.status = CANCELLED
+                        notify(queued)
+
+            queued = self._next_job()
+            while queued is not None:
+                self._acquire(queued)
+                group = self._batch_for(queued)
+                for member in group:
+                    member.status = RUNNING
+                    member.started = time.monotonic()
+                    self.scheduler.started(member)
+                    notify(member)
+                if len(group) > 1:
+                    tasks.add(asyncio.ensure_future(self._run_batch(group, notify)))
+                else:
+                    if self.thread_budget and queued.job.file_type in FFMPEG_TYPES \
+                            and queued.job.threads is None:
+                        queued.job.threads = self._threads_per_job()
+                    tasks.add(asyncio.ensure_future(self._run_job(queued, notify)))
+                queued = self._next_job()
+
+            if time.monotonic() - self._predicted >= PREDICT_INTERVAL:
+                self.predict()
+            if not tasks:
+                break
+            _, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+        await asyncio.to_thread(self.scheduler.cost_model.save)
+        return self.jobs
+
+    def _assign_content_keys(self):
+        """计算每个任务的内容键，内容和目标相同的任务只转换一次；同时标记可以合并转换的
+        短音频，记录任务读写的存储设备；导入时未探测的任务先探测，再估计耗时"""
+        output_dir = self.staging.scratch_dir if self.staging else None
+        for queued in self.jobs:
+            if queued.estimate is None:
+                # 导入时未探测的任务（例如批量转换、监视目录）先探测，按时长和分辨率估计
+                if queued.status == PENDING:
+                    self.engine.probe_job(queued.job)
+                self._estimate(queued)
+            if queued.content_key is None and queued.status == PENDING:
+                job = queued.job
+                queued.batchable = is_batchable(job, self.engine.audio_batch)
+                queued.devices = job_devices(job.input_path, output_dir or job.output_path)
+                try:
+                    # 编码方案或目标大小不同的任务输出不同，不能互相复用；
+                    # 未指定方案的任务与显式使用引擎默认方案的任务输出相同
+                    profile = job.profile or self.engine.profile
+                    size_target = astuple(job.size_target) if job.size_target else None
+                    queued.content_key = (file_digest(job.input_path), job.file_type,
+                                          job.target_format, profile, size_target)
+                except OSError:
+                    pass
+
+    def _twin(self, queued, status):
+        """内容键相同、处于指定状态的另一个任务"""
+        if queued.content_key is None:
+            return None
+        for other in self.jobs:
+            if other is not queued and other.status == status \
+                    and other.content_key == queued.content_key:
+                return other
+        return None
+
+    def _threads_per_job(self):
+        """按接下来同时运行的 FFmpeg 任务数平分 CPU 核心"""
+        slots = 0
+        for file_type in FFMPEG_TYPES:
+            unfinished = sum(1 for queued in self.jobs if queued.job.file_type == file_type
+                             and queued.status in (PENDING, RUNNING))
+            slots += min(self.concurrency.get(file_type, 1), unfinished)
+        return max(1, _CPU_COUNT // max(1, slots))
+
+    def _can_start(self, queued):
+        file_type = queued.job.file_type
+        if self._running.get(file_type, 0) >= self.concurrency.get(file_type, 1):
+            return False
+        for device in queued.devices:
+            limit = device_limit(device, self.per_device)
+            if limit is not None and self._device_running.get(device, 0) >= limit:
+                return False
+        return True
+
+    def _acquire(self, queued):
+        """占用任务类型和存储设备的并发名额"""
+        self._running[queued.job.file_type] += 1
+        for device in queued.devices:
+            self._device_running[device] = self._device_running.get(device, 0) + 1
+
+    def _release(self, queued):
+        self._running[queued.job.file_type] -= 1
+        for device in queued.devices:
+            self._device_running[device] -= 1
+
+    def _estimate(self, queued):
+        queued.work = work_units(queued.job)
+        queued.estimate = self.scheduler.cost_model.estimate(queued.job, queued.work)
+
+    def _ranked_jobs(self):
+        """按调度方式的排序键排好的全部任务，有新任务加入时重新排序"""
+        if len(self._ranked) != len(self.jobs):
+            for queued in self.jobs:
+                if queued.estimate is None:
+                    self._estimate(queued)
+            self._ranked = sorted(self.jobs, key=self.scheduler.rank)
+        return self._ranked
+
+    def _pending_order(self):
+        return self.scheduler.order(self._ranked_jobs(), self.concurrency,
+                                    lambda queued: queued.status == PENDING)
+
+    def _next_job(self):
+        """按调度顺序选出下一个可以启动的任务"""
+        if self._cancelled:
+            return None
+        for queued in self._pending_order():
+            # 相同内容的任务正在转换时等它完成，之后直接复用结果
+            if self._can_start(queued) and self._twin(queued, RUNNING) is None:
+                return queued
+        return None
+
+    def predict(self):
+        """按调度顺序模拟各类型的并发名额，更新未完成任务的预计完成时间"""
+        now, wall = time.monotonic(), time.time()
+        slots = {file_type: [0.0] * max(1, limit) for file_type, limit in self.concurrency.items()}
+
+        def assign(queued, seconds):
+            free = slots.setdefault(queued.job.file_type, [0.0])
+            index = free.index(min(free))
+            free[index] += seconds
+            queued.eta = wall + free[index]
+
+        ranked = self._ranked_jobs()
+        for queued in self.jobs:
+            if queued.status == RUNNING:
+                elapsed = now - queued.started
+                if queued.percent > 0:
+                    # 按已用时间和进度外推，比初始估计更准
+                    remaining = elapsed * (100 - queued.percent) / queued.percent
+                else:
+                    remaining = max(0.0, queued.estimate - elapsed)
+                assign(queued, remaining)
+        for queued in self.scheduler.order(ranked, self.concurrency,
+                                           lambda queued: queued.status == PENDING):
+            assign(queued, queued.estimate)
+        self._predicted = now
+
+    def _batch_for(self, queued):
+        """短音频任务与后面等待中的短音频合并为一批，返回本次启动的任务列表"""
+        if not queued.batchable or self._twin(queued, DONE) is not None:
+            return [queued]
+        size = self.engine.batch_sizer.batch_size
+        group = [queued]
+        keys = {queued.content_key}
+        for other in self.jobs:
+            if len(group) >= size:
+                break
+            # 一批只占一份设备名额，只合并读写设备相同的任务
+            if other is queued or other.status != PENDING or not other.batchable \
+                    or other.devices != queued.devices:
+                continue
+            # 相同内容的任务不放进同一批，等结果出来后直接复用
+            if other.content_key is not None and (
+                    other.content_key in keys or self._twin(other, RUNNING) is not None
+                    or self._twin(other, DONE) is not None):
+                continue
+            group.append(other)
+            keys.add(other.content_key)
+        return group
+
+    async def _run_batch(self, group, notify):
+        by_job = {id(queued.job): queued for queued in group}
+
+        def on_progress(job, percent, info):
+            queued = by_job[id(job)]
+            if percent is not None and percent != queued.percent:
+                queued.percent = percent
+                notify(queued)
+
+        finals = [self._stage(queued) for queued in group]
+        try:
+            try:
+                results = await self.engine.convert_batch_async([queued.job for queued in group],
+                                                                on_progress)
+            except Exception as e:
+                # 意外错误（例如无法启动 FFmpeg）时整批记为失败，同样清理临时输出
+                results = [self.engine._wrap_error(queued.job, e) for queued in group]
+            results = [await asyncio.to_thread(self._unstage, queued, final, result)
+                       for queued, final, result in zip(group, finals, results)]
+        finally:
+            self._release(group[0])
+        for queued, result in zip(group, results):
+            if isinstance(result, ConversionError):
+                queued.status = FAILED
+                queued.error = str(result)
+            else:
+                queued.status = DONE
+                queued.percent = 100
+                queued.result = result
+            notify(queued)
+
+    async def _run_job(self, queued, notify):
+        def on_progress(percent, info):
+            if percent is not None and percent != queued.percent:
+                queued.percent = percent
+                notify(queued)
+
+        try:
+            twin = self._twin(queued, DONE)
+            if twin is not None:
+                queued.result = await asyncio.to_thread(self._reuse, twin, queued)
+            else:
+                final = self._stage(queued)
+                try:
+                    result = await self.engine.convert_async(queued.job, on_progress)
+                except Exception as e:
+                    # 除转换失败外的意外错误也记为失败，同样清理临时输出
+                    result = self.engine._wrap_error(queued.job, e)
+                result = await asyncio.to_thread(self._unstage, queued, final, result)
+                if isinstance(result, ConversionError):
+                    raise result
+                queued.result = result
+                self.scheduler.cost_model.record(queued.job, result, queued.work)
+            queued.status = DONE
+            queued.percent = 100
+        except Exception as e:
+            queued.status = FAILED
+            queued.error = str(e)
+        finally:
+            self._release(queued)
+        notify(queued)
+
+    def _stage(self, queued):
+        """启用临时目录时把输出改到临时目录，返回原输出路径"""
+        if self.staging is None:
+            return None
+        return self.staging.begin(queued.job)
+
+    def _unstage(self, queued, final, result):
+        """成功的输出移动到原位置，失败的删除临时文件；返回结果或 ConversionError"""
+        if final is None:
+            return result
+        job = queued.job
+        if isinstance(result, ConversionError):
+            self.staging.abort(job, final)
+            return result
+        try:
+            self.staging.commit(job, final, result)
+        except OSError as e:
+            return ConversionError(f"移动输出文件失败: {e}", job)
+        return result
+
+    def _reuse(self, twin, queued):
+        """用同批次中相同内容的转换结果生成输出"""
+        started = time.perf_counter()
+        job = queued.job
+        try:
+            link_file(twin.result.output_path, job.output_path)
+        except OSError as e:
+            raise ConversionError(f"复制转换结果失败: {e}", job)
+        log_event('twin_reused', input=str(job.input_path), source=str(twin.job.input_path),
+                  output=str(job.output_path))
+        return ConversionResult(job, str(job.output_path), time.perf_counter() - started,
+                                PATH_CACHED)
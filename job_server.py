@@ -0,0 +1,709 @@
+"""任务服务器：多个进程、多台机器上的 worker 共同处理一个转换队列。
+
+服务器只保存任务状态（SQLite），通过 HTTP/JSON 接口提供：
+
+    POST /jobs                   提交任务 {"input_path", "target_format", 可选 "output_path",
+                                 "file_type", "profile"}，或 {"jobs": [...]}；返回任务编号
+    GET  /jobs[?status=状态]     任务列表；GET /jobs/<编号> 查询单个任务
+    POST /lease                  worker 领取一个等待中的任务 {"worker", 可选 "types"}，
+                                 没有任务时返回 204
+    POST /jobs/<编号>/heartbeat  续租并报告进度 {"token", "percent"}
+    POST /jobs/<编号>/complete   报告结果 {"token", "output_path", "elapsed", "path_taken"}
+    POST /jobs/<编号>/fail       报告失败 {"token", "error", "retry"}
+
+服务器启动时用 --token 设置共享令牌后，所有请求都要带上 Authorization: Bearer <令牌>
+（客户端用 --token 或环境变量 FORMATCONVERTER_JOB_TOKEN 指定）；用 --root 指定一个或多个
+目录后，任务的输入和输出路径都必须位于其中。监听局域网地址时应当至少设置令牌，否则任何能
+连上服务器的人都可以让 worker 覆盖任意路径上的文件。
+
+worker 不保存状态：领取任务时得到一个有期限的租约（token），转换期间每隔租期的三分之一
+发送一次心跳。worker 进程退出或所在机器断线后租约过期，任务回到等待状态，由其他 worker
+重新领取，领取次数超过 max_attempts 时记为失败。租约已经失效的 worker 再报告结果时
+返回 409，结果被丢弃。
+
+输入和输出路径在所有节点上必须相同（共享文件系统）。worker 先写到输出目录中的隐藏文件
+（.converting. 开头），转换完成后再原子地改名，重复领取的任务不会在输出位置留下写了一半
+的文件。worker 每次心跳时更新隐藏文件的修改时间；被强制结束的 worker 留下的隐藏文件
+不再更新，之后向同一目录输出的 worker 会把它删除。
+
+    python job_server.py serve --host 0.0.0.0 --port 8765 --token 令牌 --root /共享目录
+    python job_server.py worker http://服务器:8765 -p 4
+    python job_server.py submit http://服务器:8765 文件或目录... -t mp4 [-o 输出目录]
+    python job_server.py status http://服务器:8765
+"""
+import argparse
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from convert_engine import ConversionError, ConversionJob, default_output_path
+from io_devices import move_into_place
+from job_queue import (CANCELLED, DONE, FAILED, PENDING, RUNNING, STATUS_NAMES,
+                       collect_files)
+from media_formats import detect_file_type, target_type
+from metrics import configure_logging, log_event
+
+DEFAULT_PORT = 8765
+DEFAULT_LEASE_SECONDS = 30.0
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_SECONDS = 1.0
+# 客户端未指定 --token 时读取的环境变量
+TOKEN_ENV = 'FORMATCONVERTER_JOB_TOKEN'
+# 报告结果失败时重试间隔的上限（秒），间隔从 poll 开始逐次加倍
+REPORT_MAX_BACKOFF = 30.0
+# 输出目录中暂存文件的前缀，以及多久没有更新的暂存文件视为无人写入（至少为 3 个租期）
+STAGING_PREFIX = '.converting.'
+STAGING_STALE_SECONDS = 600.0
+
+_COLUMNS = ('id', 'input_path', 'output_path', 'file_type', 'target_format', 'profile',
+            'status', 'attempts', 'worker', 'percent', 'error', 'result', 'submitted', 'updated')
+
+
+class LeaseLost(Exception):
+    """租约已过期或任务已被其他 worker 领取"""
+
+
+class JobStore:
+    """任务状态；所有方法都是线程安全的，db_path 为 None 时只保存在内存中"""
+
+    def __init__(self, db_path=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path) if db_path else ':memory:',
+                                     check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                               'id INTEGER PRIMARY KEY AUTOINCREMENT, input_path TEXT, '
+                               'output_path TEXT, file_type TEXT, target_format TEXT, '
+                               'profile TEXT, status TEXT, attempts INTEGER DEFAULT 0, '
+                               'worker TEXT, token TEXT, lease_until REAL, '
+                               'percent INTEGER DEFAULT 0, error TEXT, result TEXT, '
+                               'submitted REAL, updated REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)')
+
+    def _row(self, row):
+        job = {name: row[name] for name in _COLUMNS}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['status_name'] = STATUS_NAMES.get(job['status'], job['status'])
+        return job
+
+    def submit(self, specs):
+        """保存一组已经检查过的任务（见 job_spec），返回任务编号列表"""
+        now = time.time()
+        with self._lock, self._conn:
+            ids = []
+            for spec in specs:
+                cursor = self._conn.execute(
+                    'INSERT INTO jobs (input_path, output_path, file_type, target_format, '
+                    'profile, status, submitted, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (spec['input_path'], spec['output_path'], spec['file_type'],
+                     spec['target_format'], spec['profile'], PENDING, now, now))
+                ids.append(cursor.lastrowid)
+        log_event('server_submitted', count=len(ids))
+        return ids
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        return self._row(row)
+
+    def list(self, status=None):
+        with self._lock:
+            self._expire(time.time())
+            if status:
+                rows = self._conn.execute('SELECT * FROM jobs WHERE status = ? ORDER BY id',
+                                          (status,)).fetchall()
+            else:
+                rows = self._conn.execute('SELECT * FROM jobs ORDER BY id').fetchall()
+        return [self._row(row) for row in rows]
+
+    def counts(self):
+        with self._lock:
+            self._expire(time.time())
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')
+            return {status: count for status, count in rows}
+
+    def _expire(self, now):
+        """租约过期的任务回到等待状态；领取次数用完的记为失败。调用方持有锁"""
+        expired = self._conn.execute(
+            'SELECT id, worker, attempts FROM jobs WHERE status = ? AND lease_until < ?',
+            (RUNNING, now)).fetchall()
+        if not expired:
+            return
+        with self._conn:
+            for job_id, worker, attempts in expired:
+                if attempts >= self.max_attempts:
+                    self._conn.execute(
+                        'UPDATE jobs SET status = ?, token = NULL, error = ?, updated = ? '
+                        'WHERE id = ?',
+                        (FAILED, f"worker 失联，已尝试 {attempts} 次", now, job_id))
+                else:
+                    self._conn.execute(
+                        'UPDATE jobs SET status = ?, token = NULL, worker = NULL, percent = 0, '
+                        'updated = ? WHERE id = ?', (PENDING, now, job_id))
+                log_event('server_lease_expired', job=job_id, worker=worker, attempts=attempts)
+
+    def lease(self, worker, types=None):
+        """把最早提交的等待中任务租给 worker，返回 (任务, token)；没有任务时返回 None"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            query = 'SELECT * FROM jobs WHERE status = ?'
+            params = [PENDING]
+            if types:
+                query += f" AND file_type IN ({', '.join('?' * len(types))})"
+                params += list(types)
+            row = self._conn.execute(query + ' ORDER BY id LIMIT 1', params).fetchone()
+            if row is None:
+                return None
+            token = uuid.uuid4().hex
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, worker = ?, token = ?, lease_until = ?, '
+                    'attempts = attempts + 1, percent = 0, error = NULL, updated = ? '
+                    'WHERE id = ?',
+                    (RUNNING, worker, token, now + self.lease_seconds, now, row['id']))
+            job = self._row(row)
+        job.update(status=RUNNING, worker=worker, attempts=job['attempts'] + 1)
+        log_event('server_leased', job=job['id'], worker=worker, attempts=job['attempts'])
+        return job, token
+
+    def _check_lease(self, job_id, token, now):
+        """租约已失效时抛出 LeaseLost。调用方持有锁"""
+        self._expire(now)
+        row = self._conn.execute('SELECT status, token FROM jobs WHERE id = ?',
+                                 (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        if row['status'] != RUNNING or row['token'] != token:
+            raise LeaseLost(f"任务 {job_id} 的租约已失效")
+
+    def heartbeat(self, job_id, token, percent=None):
+        """续租，返回新的租约期限（秒）"""
+        now = time.time()
+        with self._lock:
+            self._check_lease(job_id, token, now)
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE jobs SET lease_until = ?, percent = COALESCE(?, percent), '
+                    'updated = ? WHERE id = ?',
+                    (now + self.lease_seconds, percent, now, job_id))
+        return self.lease_seconds
+
+    def complete(self, job_id, token, result):
+        now = time.time()
+        with self._lock:
+            self._check_lease(job_id, token, now)
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, token = NULL, percent = 100, result = ?, '
+                    'updated = ? WHERE id = ?', (DONE, json.dumps(result), now, job_id))
+        log_event('server_completed', job=job_id, **result)
+
+    def fail(self, job_id, token, error, retry=False):
+        """retry 为 True 且还有剩余次数时任务回到等待状态（例如输入暂时不可见）"""
+        now = time.time()
+        with self._lock:
+            self._check_lease(job_id, token, now)
+            attempts = self._conn.execute('SELECT attempts FROM jobs WHERE id = ?',
+                                          (job_id,)).fetchone()[0]
+            status = PENDING if retry and attempts < self.max_attempts else FAILED
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, token = NULL, error = ?, updated = ? '
+                    'WHERE id = ?', (status, error, now, job_id))
+        log_event('server_failed', job=job_id, error=error, requeued=status == PENDING)
+
+    def cancel(self, job_id):
+        """取消等待中的任务；已被领取的任务不受影响，返回是否取消成功"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?',
+                (CANCELLED, time.time(), job_id, PENDING))
+            return cursor.rowcount == 1
+
+
+def _within(path, roots):
+    """path（解析符号链接后）是否位于 roots 中的某个目录下"""
+    real = os.path.realpath(path)
+    for root in roots:
+        try:
+            if os.path.commonpath([real, root]) == root:
+                return True
+        except ValueError:
+            # Windows 上不同盘符的路径没有公共部分
+            pass
+    return False
+
+
+def job_spec(data, roots=None):
+    """检查并补全一个提交的任务，缺少输出路径时放在输入文件旁边。
+
+    roots 为允许访问的目录（已解析符号链接的绝对路径），输入或输出不在其中时抛出
+    PermissionError。
+    """
+    input_path = data.get('input_path')
+    target_format = (data.get('target_format') or '').lower().lstrip('.')
+    if not input_path or not target_format:
+        raise ValueError("任务需要 input_path 和 target_format")
+    input_path = os.path.abspath(input_path)
+    output_path = os.path.abspath(data.get('output_path') or str(
+        default_output_path(input_path, os.path.dirname(input_path), target_format)))
+    if roots:
+        for path in (input_path, output_path):
+            if not _within(path, roots):
+                raise PermissionError(f"路径不在允许的目录中: {path}")
+    file_type = data.get('file_type') or detect_file_type(input_path)
+    if target_type(target_format) != file_type:
+        raise ValueError(f"{Path(input_path).name} 不能转换为 {target_format}")
+    return {'input_path': input_path, 'output_path': output_path,
+            'file_type': file_type, 'target_format': target_format,
+            'profile': data.get('profile')}
+
+
+def staging_path(final):
+    """输出目录中的暂存文件（保留扩展名，FFmpeg 按它选择封装格式）"""
+    final = Path(final)
+    return final.with_name(f'{STAGING_PREFIX}{uuid.uuid4().hex[:8]}.{final.name}')
+
+
+def sweep_staging(directory, stale_seconds=STAGING_STALE_SECONDS):
+    """删除目录中超过 stale_seconds 没有更新的暂存文件，返回删除的个数"""
+    cutoff = time.time() - stale_seconds
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.name.startswith(STAGING_PREFIX):
+            continue
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        log_event('worker_staging_swept', directory=str(directory), removed=removed)
+    return removed
+
+
+def serve(store, host='127.0.0.1', port=DEFAULT_PORT, roots=None, token=None):
+    """在后台线程中提供 HTTP/JSON 接口，返回服务器对象。
+
+    roots 为允许作为输入和输出的目录；token 不为 None 时所有请求都要带上该令牌。
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    roots = [os.path.realpath(root) for root in roots or []]
+    expected = f'Bearer {token}'.encode('utf-8') if token is not None else None
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, data=None):
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8') if data is not None else b''
+            self.send_response(status)
+            if body:
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+        def _dispatch(self, method):
+            url = urlparse(self.path)
+            parts = [part for part in url.path.split('/') if part]
+            if expected is not None and not hmac.compare_digest(
+                    self.headers.get('Authorization', '').encode('utf-8'), expected):
+                return self._send(401, {'error': "缺少或错误的访问令牌"})
+            try:
+                data = self._body() if method == 'POST' else {}
+                if method == 'GET' and parts == ['jobs']:
+                    status = parse_qs(url.query).get('status', [None])[0]
+                    return self._send(200, {'jobs': store.list(status), 'counts': store.counts()})
+                if method == 'GET' and len(parts) == 2 and parts[0] == 'jobs':
+                    return self._send(200, store.get(int(parts[1])))
+                if method == 'POST' and parts == ['jobs']:
+                    specs = [job_spec(item, roots) for item in data.get('jobs', [data])]
+                    return self._send(201, {'ids': store.submit(specs)})
+                if method == 'POST' and parts == ['lease']:
+                    leased = store.lease(data.get('worker') or self.client_address[0],
+                                         data.get('types'))
+                    if leased is None:
+                        return self._send(204)
+                    job, token = leased
+                    return self._send(200, {'job': job, 'token': token,
+                                            'lease_seconds': store.lease_seconds})
+                if method == 'POST' and len(parts) == 3 and parts[0] == 'jobs':
+                    job_id, action = int(parts[1]), parts[2]
+                    if action == 'heartbeat':
+                        return self._send(200, {'lease_seconds': store.heartbeat(
+                            job_id, data.get('token'), data.get('percent'))})
+                    if action == 'complete':
+                        result = {key: data.get(key)
+                                  for key in ('output_path', 'elapsed', 'path_taken', 'worker')}
+                        store.complete(job_id, data.get('token'), result)
+                        return self._send(200, {})
+                    if action == 'fail':
+                        store.fail(job_id, data.get('token'), data.get('error') or '未知错误',
+                                   bool(data.get('retry')))
+                        return self._send(200, {})
+                    if action == 'cancel':
+                        return self._send(200, {'cancelled': store.cancel(job_id)})
+                self._send(404, {'error': f"未知的接口: {method} {url.path}"})
+            except KeyError as e:
+                self._send(404, {'error': f"任务不存在: {e}"})
+            except LeaseLost as e:
+                self._send(409, {'error': str(e)})
+            except PermissionError as e:
+                self._send(403, {'error': str(e)})
+            except ValueError as e:
+                self._send(400, {'error': str(e)})
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log_event('server_started', host=host, port=server.server_address[1])
+    return server
+
+
+class ServerClient:
+    """任务服务器的 HTTP 客户端"""
+
+    def __init__(self, url, timeout=30, token=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.token = token
+
+    def request(self, method, path, data=None):
+        """返回 (状态码, JSON 内容)；4xx 错误也作为返回值，不抛出异常"""
+        body = json.dumps(data).encode('utf-8') if data is not None else None
+        headers = {'Content-Type': 'application/json'}
+        if self.token is not None:
+            headers['Authorization'] = f'Bearer {self.token}'
+        request = urllib.request.Request(self.url + path, data=body, method=method,
+                                         headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        return status, json.loads(payload) if payload else None
+
+    def submit(self, jobs):
+        status, data = self.request('POST', '/jobs', {'jobs': jobs})
+        if status != 201:
+            raise Exception(f"提交失败: {data['error']}")
+        return data['ids']
+
+    def jobs(self, status=None):
+        status_code, data = self.request('GET', '/jobs' + (f'?status={status}' if status else ''))
+        if status_code != 200:
+            raise Exception(f"查询失败: {data['error']}")
+        return data
+
+
+class JobWorker:
+    """从任务服务器领取任务并转换；不保存状态，可以随时启动或停止任意数量的 worker"""
+
+    def __init__(self, url, engine, worker_id=None, types=None, poll=DEFAULT_POLL_SECONDS,
+                 token=None):
+        self.client = ServerClient(url, token=token)
+        self.engine = engine
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.types = types  # 只领取这些类型的任务，例如没有 FFmpeg 的节点只处理 image
+        self.poll = poll
+        self._stopped = False
+        self._swept = set()  # 已经清理过暂存文件的输出目录
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self, max_jobs=None):
+        """循环领取任务，直到调用 stop()、完成 max_jobs 个任务或收到 KeyboardInterrupt"""
+        handled = 0
+        log_event('worker_started', worker=self.worker_id, server=self.client.url)
+        try:
+            while not self._stopped and (max_jobs is None or handled < max_jobs):
+                try:
+                    status, data = self.client.request(
+                        'POST', '/lease', {'worker': self.worker_id, 'types': self.types})
+                except OSError as e:
+                    log_event('worker_server_unreachable', worker=self.worker_id, error=str(e))
+                    time.sleep(self.poll)
+                    continue
+                if status == 401:
+                    # 令牌错误，重试也不会成功
+                    log_event('worker_unauthorized', level=logging.ERROR, worker=self.worker_id,
+                              error=data['error'])
+                    break
+                if status != 200:
+                    time.sleep(self.poll)
+                    continue
+                self.process(data['job'], data['token'], data['lease_seconds'])
+                handled += 1
+        except KeyboardInterrupt:
+            pass
+        return handled
+
+    def process(self, job_data, token, lease_seconds):
+        """转换一个已领取的任务：转换期间后台线程发送心跳，完成后报告结果"""
+        job_id = job_data['id']
+        final = job_data['output_path']
+        # 先写到输出目录中的隐藏文件
+        staged = staging_path(final)
+        if staged.parent not in self._swept:
+            # 每个输出目录只清理一次：其他 worker 被强制结束时留下的暂存文件
+            self._swept.add(staged.parent)
+            sweep_staging(staged.parent, max(STAGING_STALE_SECONDS, 3 * lease_seconds))
+        job = ConversionJob(job_data['input_path'], str(staged), job_data['file_type'],
+                            job_data['target_format'], profile=job_data['profile'])
+        progress = {'percent': 0}
+        lost = threading.Event()
+        done = threading.Event()
+
+        def beat():
+            while not done.wait(lease_seconds / 3):
+                try:
+                    # 更新修改时间，其他 worker 据此判断暂存文件仍在写入
+                    os.utime(staged)
+                except OSError:
+                    pass
+                try:
+                    status, _ = self.client.request(
+                        'POST', f'/jobs/{job_id}/heartbeat',
+                        {'token': token, 'percent': progress['percent']})
+                except OSError:
+                    # 服务器暂时连不上：继续转换，恢复后再续租
+                    continue
+                if status == 409:
+                    lost.set()
+                    return
+
+        heartbeat = threading.Thread(target=beat, daemon=True)
+        heartbeat.start()
+        error, retry, result = None, False, None
+        try:
+            if not os.path.exists(job.input_path):
+                # 本节点看不到输入文件（共享目录未挂载），交给其他节点
+                raise FileNotFoundError(f"找不到输入文件: {job.input_path}")
+            staged.parent.mkdir(parents=True, exist_ok=True)
+            result = self.engine.convert(
+                job, lambda percent, info: progress.update(percent=percent or progress['percent']))
+            if not lost.is_set():
+                move_into_place(staged, final)
+        except ConversionError as e:
+            error = str(e)
+        except Exception as e:
+            error, retry = str(e), True
+        finally:
+            done.set()
+            heartbeat.join()
+            if staged.exists():
+                staged.unlink()
+
+        if lost.is_set():
+            log_event('worker_lease_lost', worker=self.worker_id, job=job_id)
+            return
+        if error is None:
+            data = {'token': token, 'output_path': final, 'elapsed': round(result.elapsed, 3),
+                    'path_taken': result.path_taken, 'worker': self.worker_id}
+            status = self._report(f'/jobs/{job_id}/complete', data)
+        else:
+            status = self._report(f'/jobs/{job_id}/fail',
+                                  {'token': token, 'error': error, 'retry': retry})
+        if status == 409:
+            log_event('worker_lease_lost', worker=self.worker_id, job=job_id)
+
+    def _report(self, path, data):
+        """报告结果，返回状态码。
+
+        服务器暂时连不上（或返回 5xx）时按逐次加倍的间隔重试，输出已经就位，不能因为
+        一次网络错误丢掉结果；租约在此期间过期时，恢复后服务器返回 409。调用 stop()
+        后不再重试，返回 None，任务在租约过期后由其他 worker 重新处理。
+        """
+        delay = self.poll
+        while True:
+            try:
+                status, _ = self.client.request('POST', path, data)
+                if status < 500:
+                    return status
+                error = f'HTTP {status}'
+            except OSError as e:
+                error = str(e)
+            if self._stopped:
+                return None
+            log_event('worker_report_retry', worker=self.worker_id, path=path, error=error,
+                      delay=delay)
+            time.sleep(delay)
+            delay = min(delay * 2, REPORT_MAX_BACKOFF)
+
+
+def _run_worker(url, ffmpeg_path, types, poll, token=None):
+    """一个 worker 进程的入口"""
+    from convert_engine import ConversionEngine
+    from pcm_fast import PcmOptions
+    from result_cache import ResultCache
+
+    configure_logging()
+    engine = ConversionEngine(ffmpeg_path, result_cache=ResultCache(), pcm=PcmOptions())
+    JobWorker(url, engine, types=types, poll=poll, token=token).run()
+
+
+def main(argv=None):
+    from ffmpeg_caps import find_ffmpeg
+
+    parser = argparse.ArgumentParser(description='任务服务器与 worker')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = sub.add_parser('serve', help='启动任务服务器')
+    serve_parser.add_argument('--host', default='127.0.0.1',
+                              help='监听地址，默认只接受本机连接；局域网使用 0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='端口')
+    serve_parser.add_argument('--state', default=None,
+                              help='任务数据库路径，重启后继续处理；默认只保存在内存中')
+    serve_parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS,
+                              help='租约期限（秒），worker 超过该时间没有心跳视为失联')
+    serve_parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                              help='一个任务最多被领取的次数')
+    serve_parser.add_argument('--root', action='append', default=None,
+                              help='允许作为输入和输出的目录，可重复指定；默认不限制')
+
+    worker_parser = sub.add_parser('worker', help='启动 worker')
+    worker_parser.add_argument('url', help='服务器地址，例如 http://127.0.0.1:8765')
+    worker_parser.add_argument('-p', '--processes', type=int, default=1, help='本机启动的 worker 进程数')
+    worker_parser.add_argument('--type', action='append', choices=['image', 'video', 'audio'],
+                               help='只处理某类文件，可重复指定')
+    worker_parser.add_argument('--ffmpeg', default=None, help='ffmpeg 路径，默认使用自带或 PATH 中的')
+    worker_parser.add_argument('--poll', type=float, default=DEFAULT_POLL_SECONDS,
+                               help='没有任务时的轮询间隔（秒）')
+
+    submit_parser = sub.add_parser('submit', help='提交文件或目录')
+    submit_parser.add_argument('url', help='服务器地址')
+    submit_parser.add_argument('paths', nargs='+', help='文件或目录（所有节点上路径相同）')
+    submit_parser.add_argument('-t', '--to', required=True, help='目标格式')
+    submit_parser.add_argument('-o', '--output-dir', default=None, help='输出目录，默认为输入文件所在目录')
+    submit_parser.add_argument('--profile', default=None, help='编码方案')
+
+    status_parser = sub.add_parser('status', help='查看任务状态')
+    status_parser.add_argument('url', help='服务器地址')
+    status_parser.add_argument('--status', default=None, help='只列出该状态的任务')
+
+    for command_parser in (serve_parser, worker_parser, submit_parser, status_parser):
+        command_parser.add_argument('--token', default=os.environ.get(TOKEN_ENV),
+                                    help=f'共享访问令牌，默认读取环境变量 {TOKEN_ENV}')
+
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    if args.command == 'serve':
+        if args.token is None and args.host not in ('127.0.0.1', 'localhost', '::1'):
+            print(f"警告：监听 {args.host} 但没有设置 --token，任何能连上的人都可以提交任务",
+                  file=sys.stderr)
+        store = JobStore(args.state, args.lease, args.max_attempts)
+        server = serve(store, args.host, args.port, args.root, args.token)
+        print(f"任务服务器已启动：http://{args.host}:{server.server_address[1]}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    if args.command == 'worker':
+        ffmpeg_path = args.ffmpeg or find_ffmpeg()
+        types = args.type
+        if not ffmpeg_path:
+            if types and set(types) - {'image'}:
+                print("找不到 ffmpeg，请用 --ffmpeg 指定", file=sys.stderr)
+                return 2
+            # 没有 FFmpeg 的节点只处理图片
+            types = ['image']
+        if args.processes <= 1:
+            _run_worker(args.url, ffmpeg_path, types, args.poll, args.token)
+            return 0
+        processes = [multiprocessing.Process(target=_run_worker,
+                                             args=(args.url, ffmpeg_path, types, args.poll,
+                                                   args.token))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
+        return 0
+
+    client = ServerClient(args.url, token=args.token)
+    if args.command == 'submit':
+        target_format = args.to.lower().lstrip('.')
+        try:
+            wanted = target_type(target_format)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        files, skipped = collect_files(args.paths)
+        jobs = []
+        for path, file_type in files:
+            if file_type != wanted:
+                skipped.append(path)
+                continue
+            output_dir = args.output_dir or os.path.dirname(os.path.abspath(path))
+            jobs.append({'input_path': os.path.abspath(path), 'file_type': file_type,
+                         'target_format': target_format, 'profile': args.profile,
+                         'output_path': str(default_output_path(path, os.path.abspath(output_dir),
+                                                                target_format))})
+        try:
+            ids = client.submit(jobs) if jobs else []
+        except Exception as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f"已提交 {len(ids)} 个任务，跳过 {len(skipped)} 个类型不符或不支持的文件")
+        return 0
+
+    try:
+        data = client.jobs(args.status)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 1
+    for job in data['jobs']:
+        line = f"{job['id']:>6}  {job['status_name']:<4} {job['percent']:>3}%  {job['input_path']}"
+        if job['error']:
+            line += f"  ({job['error']})"
+        print(line)
+    print('  '.join(f"{STATUS_NAMES.get(status, status)} {count}"
+                    for status, count in sorted(data['counts'].items())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
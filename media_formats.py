@@ -0,0 +1,200 @@
+"""支持的文件格式与文件类型判断"""
+from pathlib import Path
+
+# 支持的格式
+IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.gif'}
+VIDEO_FORMATS = {'.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv'}
+AUDIO_FORMATS = {'.mp3', '.wav', '.ogg'}  # 移除 aac
+
+FORMATS_BY_TYPE = {
+    'image': IMAGE_FORMATS,
+    'video': VIDEO_FORMATS,
+    'audio': AUDIO_FORMATS
+}
+
+# 判断类型时读取的文件头长度
+HEADER_BYTES = 4096
+# 没有固定文件头的格式：MP3 可以直接以音频帧开始，前面还可能有填充数据
+WEAK_SIGNATURES = {'.mp3'}
+# 音频文件中作为封面的“视频流”
+COVER_CODECS = {'mjpeg', 'png', 'bmp', 'gif'}
+
+# ISO 媒体文件（ftyp）的主品牌
+_AUDIO_BRANDS = {b'M4A ', b'M4B ', b'M4P ', b'F4A ', b'F4B '}
+_IMAGE_BRANDS = {b'heic', b'heix', b'hevc', b'heim', b'heis', b'mif1', b'msf1', b'avif', b'avis'}
+# 没有 ftyp 的旧 QuickTime 文件开头的 atom
+_QUICKTIME_ATOMS = {b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+# ASF 头中的流类型 GUID（WMV / WMA 共用 ASF 容器）
+_ASF_HEADER = bytes.fromhex('3026b2758e66cf11a6d900aa0062ce6c')
+_ASF_VIDEO_MEDIA = bytes.fromhex('c0ef19bc4d5bcf11a8fd00805f5c442b')
+_ASF_AUDIO_MEDIA = bytes.fromhex('409e69f84d5bcf11a8fd00805f5c442b')
+# Ogg 第一个数据包开头的编码标识
+_OGG_AUDIO_CODECS = (b'\x01vorbis', b'OpusHead', b'\x7fFLAC', b'Speex   ')
+_OGG_VIDEO_CODECS = (b'\x80theora', b'\x01video\x00\x00\x00', b'fishead\x00')
+# BMP 信息头的长度（BITMAPCOREHEADER 到 BITMAPV5HEADER）
+_BMP_HEADER_SIZES = {12, 16, 40, 52, 56, 64, 108, 124}
+
+
+def extension_type(file_path):
+    """只按扩展名判断文件类型，不支持的扩展名返回 None"""
+    ext = Path(file_path).suffix.lower()
+    for file_type, formats in FORMATS_BY_TYPE.items():
+        if ext in formats:
+            return file_type
+    return None
+
+
+def _mpeg_audio_frame(header, offset=0):
+    """offset 处是否为合法的 MPEG 音频帧头（MP3）或 ADTS 帧头（AAC）"""
+    if len(header) < offset + 4 or header[offset] != 0xFF or header[offset + 1] & 0xE0 != 0xE0:
+        return False
+    version = (header[offset + 1] >> 3) & 0x03
+    layer = (header[offset + 1] >> 1) & 0x03
+    if layer == 0:
+        # ADTS：版本位只用 1 位，层固定为 0
+        return header[offset + 1] & 0xF6 == 0xF0
+    bitrate = header[offset + 2] >> 4
+    sample_rate = (header[offset + 2] >> 2) & 0x03
+    return version != 1 and bitrate != 0x0F and sample_rate != 0x03
+
+
+def _ogg_type(header):
+    """按 Ogg 第一页中第一个数据包的编码标识判断"""
+    if len(header) < 27:
+        return None
+    packet = header[27 + header[26]:]
+    if packet.startswith(_OGG_VIDEO_CODECS):
+        return 'video'
+    if packet.startswith(_OGG_AUDIO_CODECS):
+        return 'audio'
+    return None
+
+
+def sniff_file_type(header):
+    """按文件头特征判断类型，返回 (文件类型, 是否确定)；不认识时返回 None。
+
+    MP4 / MKV / MPEG-TS 等容器既可以装视频也可以只装音频，只看文件头不能确定，
+    这时按视频处理并标记为不确定。
+    """
+    if header.startswith(b'\xff\xd8\xff') or header.startswith(b'\x89PNG\r\n\x1a\n') \
+            or header[:6] in (b'GIF87a', b'GIF89a') \
+            or header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'image', True
+    if header.startswith(b'BM') and int.from_bytes(header[14:18], 'little') in _BMP_HEADER_SIZES:
+        return 'image', True
+    if header[:4] in (b'RIFF', b'RF64', b'BW64'):
+        kind = header[8:12]
+        if kind == b'WEBP':
+            return 'image', True
+        if kind == b'WAVE':
+            return 'audio', True
+        if kind in (b'AVI ', b'AVIX'):
+            return 'video', True
+        return None
+    if header[4:8] == b'ftyp':
+        brand = header[8:12]
+        if brand in _IMAGE_BRANDS:
+            return 'image', True
+        if brand in _AUDIO_BRANDS:
+            return 'audio', True
+        return 'video', brand == b'qt  '
+    if header[4:8] in _QUICKTIME_ATOMS:
+        return 'video', False
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        # Matroska / WebM（EBML 头），也可能是只有音轨的 MKA
+        return 'video', False
+    if header.startswith(b'FLV\x01') and len(header) > 4:
+        # 第 5 字节的标志位：0x01 有视频，0x04 有音频
+        return ('video' if header[4] & 0x01 else 'audio'), True
+    if header.startswith(_ASF_HEADER):
+        if _ASF_VIDEO_MEDIA in header:
+            return 'video', True
+        if _ASF_AUDIO_MEDIA in header:
+            return 'audio', True
+        return 'video', False
+    if header.startswith(b'OggS'):
+        ogg_type = _ogg_type(header)
+        return (ogg_type, True) if ogg_type else ('audio', False)
+    if header.startswith((b'ID3', b'fLaC', b'#!AMR')) \
+            or (header.startswith(b'FORM') and header[8:12] in (b'AIFF', b'AIFC')):
+        return 'audio', True
+    if _mpeg_audio_frame(header):
+        return 'audio', True
+    if header.startswith(b'\x00\x00\x01\xba') \
+            or (len(header) > 376 and header[0] == header[188] == header[376] == 0x47):
+        # MPEG-PS / MPEG-TS
+        return 'video', False
+    return None
+
+
+def sniff_container(header):
+    """按文件头判断容器格式，返回对应的扩展名（不带点）；不认识时返回 None"""
+    if header[4:8] == b'ftyp':
+        return 'm4a' if header[8:12] in _AUDIO_BRANDS else 'mp4'
+    if header[4:8] in _QUICKTIME_ATOMS:
+        return 'mov'
+    if header[:4] == b'RIFF':
+        return {b'WAVE': 'wav', b'AVI ': 'avi', b'WEBP': 'webp'}.get(header[8:12])
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'mkv'
+    if header.startswith(b'FLV\x01'):
+        return 'flv'
+    if header.startswith(_ASF_HEADER):
+        return 'wmv'
+    if header.startswith(b'OggS'):
+        return 'ogg'
+    if header.startswith(b'ID3') or _mpeg_audio_frame(header):
+        return 'mp3'
+    return None
+
+
+def _probe_file_type(file_path, ffmpeg_path):
+    """文件头不能确定类型时探测媒体流：有视频流（封面图除外）为 video，只有音频流为 audio"""
+    from media_probe import probe_media
+
+    try:
+        info = probe_media(file_path, ffmpeg_path, 'video')
+    except Exception:
+        raise ValueError("不支持的文件类型")
+    if any(stream.codec_name not in COVER_CODECS for stream in info.video_streams):
+        return 'video'
+    if info.audio_streams:
+        return 'audio'
+    raise ValueError("不支持的文件类型")
+
+
+def detect_file_type(file_path, ffmpeg_path=None):
+    """判断文件类型，返回 image / video / audio。
+
+    读取文件头识别格式，扩展名与内容不符时以内容为准，不认识的内容直接抛出
+    ValueError，不必等到转换时才由 FFmpeg 报错。文件头不能确定类型（例如只有
+    音轨的 MP4）且与扩展名矛盾时，指定了 ffmpeg_path 才探测媒体流。文件无法
+    读取时只按扩展名判断。
+    """
+    by_extension = extension_type(file_path)
+    try:
+        with open(file_path, 'rb') as fp:
+            header = fp.read(HEADER_BYTES)
+    except OSError:
+        if by_extension is None:
+            raise ValueError("不支持的文件类型")
+        return by_extension
+
+    sniffed = sniff_file_type(header)
+    if sniffed is not None:
+        file_type, certain = sniffed
+        if certain or file_type == by_extension:
+            return file_type
+    elif Path(file_path).suffix.lower() not in WEAK_SIGNATURES:
+        raise ValueError("不支持的文件类型")
+    if ffmpeg_path:
+        return _probe_file_type(file_path, ffmpeg_path)
+    return sniffed[0] if sniffed is not None else by_extension
+
+
+def target_type(target_format):
+    """目标格式对应的文件类型，例如 jpg -> image"""
+    for file_type, formats in FORMATS_BY_TYPE.items():
+        if f'.{target_format}' in formats:
+            return file_type
+    raise ValueError(f"不支持的目标格式: {target_format}")
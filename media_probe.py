@@ -0,0 +1,252 @@
+"""文件导入阶段：探测媒体信息、图片尺寸和输出磁盘空间"""
+import json
+import re
+import shutil
+import subprocess
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from media_formats import detect_file_type
+from ffmpeg_runner import get_startupinfo
+
+# ffmpeg -i 输出中的流信息，例如 "Stream #0:0[0x1](und): Video: h264 (High) ..."
+_STREAM_LINE = re.compile(r'Stream #\d+:(\d+)\S*: (Video|Audio|Subtitle|Data|Attachment): (\w+)(.*)')
+_DURATION_LINE = re.compile(r'Duration:\s*(\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+_INPUT_LINE = re.compile(r'^Input #0, (\S+), from', re.MULTILINE)
+_RESOLUTION = re.compile(r'\b(\d{2,5})x(\d{2,5})\b')
+_SAMPLE_RATE = re.compile(r'(\d+) Hz')
+_FRAME_RATE = re.compile(r'([\d.]+)(k?) fps')
+_CHANNELS = {'mono': 1, 'stereo': 2, '2.1': 3, 'quad': 4, '5.0': 5, '5.1': 6, '6.1': 7, '7.1': 8}
+
+
+@dataclass
+class StreamInfo:
+    """输入文件中的一路流"""
+    index: int
+    codec_type: str
+    codec_name: str
+    width: int = None
+    height: int = None
+    sample_rate: int = None
+    channels: int = None
+    frame_rate: float = None
+
+
+@dataclass
+class MediaInfo:
+    """导入阶段得到的文件信息"""
+    path: str
+    file_type: str
+    size: int = 0
+    duration: float = None
+    format_name: str = None
+    streams: list = field(default_factory=list)
+    width: int = None
+    height: int = None
+    frame_rate: float = None
+    mode: str = None
+    n_frames: int = 1
+    disk_free: int = None
+
+    @property
+    def video_streams(self):
+        return [s for s in self.streams if s.codec_type == 'video']
+
+    @property
+    def audio_streams(self):
+        return [s for s in self.streams if s.codec_type == 'audio']
+
+    @property
+    def enough_disk_space(self):
+        # 粗略估计：输出大小不超过输入大小
+        return self.disk_free is None or self.disk_free >= self.size
+
+    def describe(self):
+        """用于界面展示的简要信息"""
+        parts = []
+        if self.width and self.height:
+            parts.append(f'{self.width}x{self.height}')
+        if self.mode:
+            parts.append(self.mode)
+        if self.n_frames > 1:
+            parts.append(f'{self.n_frames} 帧')
+        if self.duration:
+            minutes, seconds = divmod(int(self.duration), 60)
+            parts.append(f'时长 {minutes // 60:02d}:{minutes % 60:02d}:{seconds:02d}')
+        codecs = [s.codec_name for s in self.streams if s.codec_type in ('video', 'audio')]
+        if codecs:
+            parts.append('编码 ' + '/'.join(codecs))
+        return '，'.join(parts)
+
+
+def find_ffprobe(ffmpeg_path):
+    """优先使用与 ffmpeg 同目录的 ffprobe，其次查找 PATH"""
+    if ffmpeg_path:
+        name = 'ffprobe.exe' if sys.platform == 'win32' else 'ffprobe'
+        candidate = Path(ffmpeg_path).with_name(name)
+        if candidate.exists():
+            return str(candidate)
+    return shutil.which('ffprobe')
+
+
+def _run(cmd):
+    return subprocess.run(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        encoding='utf-8',
+        errors='replace',
+        startupinfo=get_startupinfo()
+    )
+
+
+def _probe_with_ffprobe(ffprobe_path, info):
+    result = _run([
+        ffprobe_path, '-v', 'error',
+        '-print_format', 'json',
+        '-show_format', '-show_streams',
+        info.path
+    ])
+    if result.returncode != 0:
+        raise Exception(f"ffprobe 错误: {result.stderr.strip() or '未知错误'}")
+
+    data = json.loads(result.stdout or '{}')
+    fmt = data.get('format', {})
+    info.format_name = fmt.get('format_name')
+    try:
+        info.duration = float(fmt['duration'])
+    except (KeyError, ValueError):
+        pass
+
+    for stream in data.get('streams', []):
+        info.streams.append(StreamInfo(
+            index=stream.get('index', len(info.streams)),
+            codec_type=stream.get('codec_type', ''),
+            codec_name=stream.get('codec_name', ''),
+            width=stream.get('width'),
+            height=stream.get('height'),
+            sample_rate=int(stream['sample_rate']) if stream.get('sample_rate') else None,
+            channels=stream.get('channels'),
+            frame_rate=_parse_rate(stream.get('avg_frame_rate'))
+        ))
+
+
+def _parse_rate(value):
+    """ffprobe 的帧率（例如 "30000/1001"），未知（"0/0"）时返回 None"""
+    try:
+        numerator, _, denominator = (value or '').partition('/')
+        rate = float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate or None
+
+
+def parse_ffmpeg_input_info(text, info):
+    """解析 `ffmpeg -i` 打印的输入信息，用于没有 ffprobe 的环境"""
+    match = _INPUT_LINE.search(text)
+    if match:
+        info.format_name = match.group(1)
+    match = _DURATION_LINE.search(text)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info.duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    for line in text.splitlines():
+        match = _STREAM_LINE.search(line)
+        if not match:
+            continue
+        index, codec_type, codec_name, rest = match.groups()
+        stream = StreamInfo(int(index), codec_type.lower(), codec_name)
+        if stream.codec_type == 'video':
+            resolution = _RESOLUTION.search(rest)
+            if resolution:
+                stream.width, stream.height = int(resolution.group(1)), int(resolution.group(2))
+            rate = _FRAME_RATE.search(rest)
+            if rate:
+                stream.frame_rate = float(rate.group(1)) * (1000 if rate.group(2) else 1)
+        elif stream.codec_type == 'audio':
+            rate = _SAMPLE_RATE.search(rest)
+            if rate:
+                stream.sample_rate = int(rate.group(1))
+            for layout, channels in _CHANNELS.items():
+                if f', {layout}' in rest:
+                    stream.channels = channels
+                    break
+            else:
+                count = re.search(r'(\d+) channels', rest)
+                if count:
+                    stream.channels = int(count.group(1))
+        info.streams.append(stream)
+
+
+def probe_media(file_path, ffmpeg_path, file_type=None):
+    """探测音视频文件的时长、流和编码"""
+    info = MediaInfo(str(file_path), file_type or detect_file_type(file_path, ffmpeg_path))
+    info.size = Path(file_path).stat().st_size
+
+    ffprobe_path = find_ffprobe(ffmpeg_path)
+    if ffprobe_path:
+        _probe_with_ffprobe(ffprobe_path, info)
+    else:
+        # 没有 ffprobe 时让 ffmpeg 只读取输入信息
+        result = _run([ffmpeg_path, '-hide_banner', '-i', str(file_path)])
+        parse_ffmpeg_input_info(result.stderr, info)
+        if not info.streams:
+            lines = result.stderr.strip().splitlines()
+            raise Exception(f"无法读取媒体信息: {lines[-1] if lines else '未知错误'}")
+
+    video = info.video_streams
+    if video:
+        info.width, info.height = video[0].width, video[0].height
+        info.frame_rate = video[0].frame_rate
+    return info
+
+
+def probe_image(file_path):
+    """读取图片尺寸和模式；Image.open 只解析文件头，不解码像素"""
+    from PIL import Image
+
+    info = MediaInfo(str(file_path), 'image')
+    info.size = Path(file_path).stat().st_size
+    with Image.open(file_path) as img:
+        info.width, info.height = img.size
+        info.mode = img.mode
+        info.format_name = img.format
+        info.n_frames = getattr(img, 'n_frames', 1)
+    return info
+
+
+def check_disk_space(output_dir):
+    """返回输出目录所在磁盘的剩余空间（字节）"""
+    path = Path(output_dir)
+    # 目录可能尚未创建，向上找到存在的父目录
+    while not path.exists() and path.parent != path:
+        path = path.parent
+    return shutil.disk_usage(path).free
+
+
+def ingest_file(file_path, output_dir, ffmpeg_path, on_progress=None):
+    """导入一个文件：判断类型、探测信息、检查输出磁盘空间。
+
+    on_progress(percent) 在每个阶段完成时调用。
+    """
+    def report(percent):
+        if on_progress is not None:
+            on_progress(percent)
+
+    file_type = detect_file_type(file_path, ffmpeg_path)
+    report(20)
+
+    if file_type == 'image':
+        info = probe_image(file_path)
+    else:
+        info = probe_media(file_path, ffmpeg_path, file_type)
+    report(80)
+
+    try:
+        info.disk_free = check_disk_space(output_dir)
+    except OSError:
+        info.disk_free = None
+    report(100)
+    return info
@@ -0,0 +1,283 @@
+"""任务分阶段计时、结构化日志和 Prometheus 指标。
+
+每个转换任务按阶段（探测、能力检查、编码、校验等）计时，结束时输出一行 JSON 日志，
+并累加到指标注册表中。指标可以写成 Prometheus 文本格式文件（供 node_exporter 的
+textfile collector 采集），也可以通过本地 HTTP 端口提供。
+
+日志默认不输出，调用 configure_logging() 后才写到标准错误或文件；环境变量
+FORMATCONVERTER_LOG_FILE / FORMATCONVERTER_LOG_LEVEL 可以指定文件和级别，
+FORMATCONVERTER_METRICS_FILE / FORMATCONVERTER_METRICS_PORT 用于 configure_metrics()。
+"""
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+logger = logging.getLogger('formatconverter')
+logger.addHandler(logging.NullHandler())
+
+# 阶段耗时直方图的分桶（秒）
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+_METRICS = {
+    'formatconverter_jobs_total': ('counter', '转换任务数'),
+    'formatconverter_input_bytes_total': ('counter', '输入文件总字节数'),
+    'formatconverter_output_bytes_total': ('counter', '输出文件总字节数'),
+    'formatconverter_job_seconds': ('histogram', '任务总耗时（秒）'),
+    'formatconverter_stage_seconds': ('histogram', '各阶段耗时（秒）')
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'event': record.getMessage()
+        }
+        data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """输出一条结构化日志"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+def configure_logging(path=None, level=None, stream=None):
+    """把结构化日志写到文件（path）或标准错误；未指定时读取环境变量"""
+    path = path or os.environ.get('FORMATCONVERTER_LOG_FILE')
+    level = level or os.environ.get('FORMATCONVERTER_LOG_LEVEL', 'INFO')
+    if path:
+        handler = logging.FileHandler(path, encoding='utf-8')
+    else:
+        handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    return handler
+
+
+class JobTrace:
+    """一个任务的分阶段计时"""
+
+    def __init__(self, job):
+        self.job = job
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.path_taken = None
+        self.estimated_peak = None
+        self.estimated_speedup = None
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        """累加一个阶段的耗时（例如分摊到每个文件的批量编码耗时）"""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def record(self, error=None):
+        """任务结束时的日志和指标记录"""
+        job = self.job
+        record = {
+            'input': str(job.input_path),
+            'output': str(job.output_path),
+            'type': job.file_type,
+            'target': job.target_format,
+            'status': 'failed' if error else 'done',
+            'path': self.path_taken,
+            'stages': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            'total': round(self.elapsed, 6)
+        }
+        for name, value in (('estimated_peak', self.estimated_peak),
+                            ('estimated_speedup', self.estimated_speedup)):
+            if value is not None:
+                record[name] = value
+        for name, path in (('input_size', job.input_path), ('output_size', job.output_path)):
+            try:
+                record[name] = os.path.getsize(path)
+            except OSError:
+                pass
+        if error:
+            record['error'] = str(error)
+        return record
+
+
+def stage(trace, name):
+    """trace 为 None 时不计时"""
+    return trace.stage(name) if trace is not None else nullcontext()
+
+
+@contextmanager
+def profiled(output_dir, name):
+    """用 cProfile 采集一段代码，结果写入 output_dir/<name>.prof；output_dir 为空时不采集"""
+    if not output_dir:
+        yield
+        return
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / f'{name}_{os.getpid()}_{time.time_ns()}.prof'
+        profiler.dump_stats(str(path))
+        log_event('profile_saved', level=logging.DEBUG, path=str(path))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class MetricsRegistry:
+    """进程内的计数器和直方图，按 Prometheus 文本格式导出"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (名称, 标签) -> 值
+        self._histograms = {}  # (名称, 标签) -> [各桶计数, 总和, 次数]
+        self.textfile = None
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None, buckets=STAGE_BUCKETS):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * len(buckets), 0.0, 0, buckets]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def record_job(self, record):
+        """累加一个任务的结果，并在配置了文本文件时刷新它"""
+        file_type = record['type']
+        self.inc('formatconverter_jobs_total', {
+            'type': file_type, 'target': record['target'],
+            'path': record['path'] or '', 'status': record['status']
+        })
+        self.observe('formatconverter_job_seconds', record['total'], {'type': file_type})
+        for stage_name, seconds in record['stages'].items():
+            self.observe('formatconverter_stage_seconds', seconds,
+                         {'type': file_type, 'stage': stage_name})
+        if record['status'] == 'done':
+            self.inc('formatconverter_input_bytes_total', {'type': file_type},
+                     record.get('input_size', 0))
+            self.inc('formatconverter_output_bytes_total', {'type': file_type},
+                     record.get('output_size', 0))
+        if self.textfile:
+            try:
+                self.write_textfile(self.textfile)
+            except OSError as e:
+                log_event('metrics_write_failed', level=logging.WARNING, error=str(e))
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, [list(entry[0]), entry[1], entry[2], entry[3]])
+                                for key, entry in self._histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                kind, help_text = _METRICS.get(name, ('untyped', name))
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                described.add(name)
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f'{name}{_label_text(labels)} {value}')
+        for (name, labels), (counts, total, count, buckets) in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_label_text(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{_label_text(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_label_text(labels)} {total}')
+            lines.append(f'{name}_count{_label_text(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """原子地写入文本格式文件，采集方不会读到写了一半的内容"""
+        path = Path(path)
+        tmp = path.with_name(path.name + f'.{os.getpid()}.tmp')
+        tmp.write_text(self.render(), encoding='utf-8')
+        os.replace(tmp, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """在后台线程中通过 HTTP 提供 /metrics，返回服务器对象"""
+        # 只有启用 HTTP 接口时才需要，不在导入时加载
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# 默认的全局注册表，引擎未指定时使用
+REGISTRY = MetricsRegistry()
+
+
+def configure_metrics(textfile=None, port=None, registry=REGISTRY):
+    """启用指标导出：每个任务结束后刷新文本文件，和/或在本地端口提供 HTTP 接口"""
+    textfile = textfile or os.environ.get('FORMATCONVERTER_METRICS_FILE')
+    port = port or os.environ.get('FORMATCONVERTER_METRICS_PORT')
+    if textfile:
+        registry.textfile = textfile
+    if port:
+        return registry.serve(int(port))
+    return None
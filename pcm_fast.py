@@ -0,0 +1,214 @@
+"""WAV → WAV 的进程内快速路径。
+
+转换为 WAV 时 FFmpeg 做的只是采样格式转换（统一为 16 位整数）和重采样到 44100 Hz。
+对几秒钟的小文件，启动 FFmpeg 进程、读写管道的开销远大于转换本身，这里改用标准库
+wave 模块读写，NumPy 按块做向量化处理，内存占用只和块大小有关，与文件长度无关。
+
+- 采样格式：8 位无符号、16 / 24 / 32 位有符号整数；不需要重采样时按 FFmpeg 相同的
+  规则（截断低位）直接转换，结果与 FFmpeg 逐位一致；
+- 声道：保持不变，或平均下混为单声道；
+- 重采样：Kaiser 窗 sinc 插值，按有理数比例 up/down 预先计算每个相位的滤波器系数，
+  降采样时截止频率随比例降低以抑制混叠。
+
+浮点、A-law、WAVE_FORMAT_EXTENSIBLE 等 wave 模块不支持的文件，以及没有安装 NumPy
+时抛出 PcmUnsupported，由调用方改用 FFmpeg。不需要重采样时任何长度都比 FFmpeg 快；
+需要重采样且超过 max_resample_duration 的文件交给 FFmpeg，它的 C 实现重采样更快，
+进程启动开销在长文件上可以忽略（python benchmark.py pcm 可以测出本机的分界点）。
+"""
+import math
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+
+PCM_SAMPLE_WIDTH = 2  # 输出统一为 16 位（pcm_s16le）
+
+
+class PcmUnsupported(Exception):
+    """输入不能走进程内路径，应改用 FFmpeg"""
+
+
+@dataclass
+class PcmOptions:
+    """进程内 WAV 转换参数"""
+    max_resample_duration: float = 5.0  # 需要重采样时只处理不超过该时长（秒）的文件
+    sample_rate: int = 44100            # 输出采样率，与 FFmpeg 路径的 -ar 一致
+    taps: int = 32                      # 重采样滤波器每个相位的系数个数
+    chunk_frames: int = 65536           # 每次读取的帧数
+
+
+def read_params(path):
+    """WAV 文件的 wave 参数；wave 模块读不了时抛出 PcmUnsupported"""
+    try:
+        with wave.open(str(path), 'rb') as wav:
+            params = wav.getparams()
+    except (wave.Error, EOFError) as e:
+        raise PcmUnsupported(str(e))
+    if params.sampwidth not in (1, 2, 3, 4) or params.nchannels < 1 or params.framerate < 1:
+        raise PcmUnsupported(f"不支持的采样格式: {params.sampwidth * 8} 位")
+    return params
+
+
+def is_eligible(job, options):
+    """WAV 转 WAV、wave 模块能读取且（需要重采样时）时长不超过上限时返回 True"""
+    if (options is None or job.file_type != 'audio' or job.target_format != 'wav'
+            or Path(job.input_path).suffix.lower() != '.wav'):
+        return False
+    try:
+        import numpy  # noqa: F401
+        params = read_params(job.input_path)
+    except (ImportError, PcmUnsupported, OSError):
+        return False
+    if params.framerate == options.sample_rate:
+        return True
+    return params.nframes <= options.max_resample_duration * params.framerate
+
+
+def _to_int16(data, sampwidth, np):
+    """整数采样转为 16 位，规则与 FFmpeg 的 swresample 相同"""
+    if sampwidth == 1:
+        return ((np.frombuffer(data, np.uint8).astype(np.int16) - 128) << 8).astype(np.int16)
+    if sampwidth == 2:
+        return np.frombuffer(data, '<i2')
+    return (_to_int32(data, sampwidth, np) >> 16).astype(np.int16)
+
+
+def _to_int32(data, sampwidth, np):
+    """16 / 24 / 32 位采样左对齐到 32 位整数"""
+    if sampwidth == 3:
+        raw = np.frombuffer(data, np.uint8).reshape(-1, 3).astype(np.int32)
+        return (raw[:, 0] << 8) | (raw[:, 1] << 16) | (raw[:, 2] << 24)
+    if sampwidth == 4:
+        return np.frombuffer(data, '<i4')
+    return _to_int16(data, sampwidth, np).astype(np.int32) << 16
+
+
+def _to_float(data, sampwidth, np):
+    """采样转为 [-1, 1) 范围的 float32"""
+    if sampwidth <= 2:
+        return _to_int16(data, sampwidth, np).astype(np.float32) / 32768.0
+    return (_to_int32(data, sampwidth, np).astype(np.float64) / 2147483648.0).astype(np.float32)
+
+
+def _float_to_int16(samples, np):
+    return np.clip(np.rint(samples * 32768.0), -32768, 32767).astype('<i2')
+
+
+class Resampler:
+    """按块重采样，块与块之间保留滤波器需要的历史采样，输出与一次处理整段相同"""
+
+    def __init__(self, np, in_rate, out_rate, channels, taps=32):
+        self.np = np
+        divisor = math.gcd(in_rate, out_rate)
+        self.up, self.down = out_rate // divisor, in_rate // divisor
+        half = taps // 2
+        self.taps = taps
+        offsets = np.arange(-half + 1, half + 1)
+        # 每个相位（输出位置的小数部分 p / up）一行系数：sinc 低通 × Kaiser 窗
+        cutoff = min(1.0, out_rate / in_rate)
+        distance = offsets[None, :] - np.arange(self.up)[:, None] / self.up
+        beta = 8.0
+        window = np.i0(beta * np.sqrt(np.clip(1 - (distance / half) ** 2, 0, None))) / np.i0(beta)
+        kernel = np.sinc(cutoff * distance) * window
+        self.table = (kernel / kernel.sum(axis=1, keepdims=True)).astype(np.float32)
+        # 缓冲区开头补 half 个 0，相当于信号之前全是静音
+        self.buffer = np.zeros((half, channels), np.float32)
+        self.start = -half  # buffer[0] 对应的输入帧序号
+        self.received = 0   # 已经收到的输入帧数
+        self.produced = 0   # 已经输出的帧数
+        self.half = half
+
+    def _emit(self, end_frame):
+        """输出所有在 end_frame 之前的输出帧，返回 (帧数, 声道) 数组。
+
+        序号模 up 相同的输出帧使用同一行系数，对应的输入窗口间隔固定为 down 帧，
+        因此按相位分组，每组是输入滑动窗口视图上的一次步进切片加一次矩阵乘法，
+        不需要逐帧收集输入。
+        """
+        np = self.np
+        count = max(0, end_frame - self.produced)
+        channels = self.buffer.shape[1]
+        out = np.empty((count, channels), np.float32)
+        # (窗口起点, 声道, taps)，只是视图，不复制数据
+        windows = np.lib.stride_tricks.sliding_window_view(self.buffer, self.taps, axis=0)
+        for residue in range(min(self.up, count)):
+            first = self.produced + residue
+            rows = (count - residue + self.up - 1) // self.up
+            begin = (first * self.down) // self.up - self.half + 1 - self.start
+            selected = windows[begin:begin + (rows - 1) * self.down + 1:self.down]
+            out[residue::self.up] = selected @ self.table[(first * self.down) % self.up]
+        self.produced += count
+        # 丢掉之后不会再用到的历史采样
+        keep_from = (self.produced * self.down) // self.up - self.half + 1 - self.start
+        if keep_from > 0:
+            self.buffer = self.buffer[keep_from:]
+            self.start += keep_from
+        return out
+
+    def _ready(self, available):
+        """输入帧 [0, available) 已知时可以计算的输出帧数"""
+        # 输出帧 n 需要输入帧 base(n) + half 及之前的采样
+        return max(0, ((available - self.half) * self.up + self.down - 1) // self.down)
+
+    def feed(self, samples):
+        self.buffer = self.np.concatenate([self.buffer, samples])
+        self.received += len(samples)
+        return self._emit(self._ready(self.received))
+
+    def flush(self):
+        """输入结束：尾部补 0，输出剩余的帧，总帧数为 ceil(输入帧数 × up / down)"""
+        total = -(-self.received * self.up // self.down)
+        padding = self.np.zeros((self.half + 1, self.buffer.shape[1]), self.np.float32)
+        self.buffer = self.np.concatenate([self.buffer, padding])
+        return self._emit(total)
+
+
+def convert_wav(input_path, output_path, options=None, channels=None):
+    """把 WAV 转换为 16 位 PCM、options.sample_rate 采样率的 WAV，返回输出帧数。
+
+    channels 为 None 时保持声道数，为 1 时下混为单声道。输入不受支持时抛出
+    PcmUnsupported，此时不会创建输出文件。
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise PcmUnsupported("未安装 NumPy")
+
+    options = options or PcmOptions()
+    params = read_params(input_path)
+    in_channels, sampwidth, in_rate = params.nchannels, params.sampwidth, params.framerate
+    if channels not in (None, 1, in_channels):
+        raise PcmUnsupported(f"不支持 {in_channels} 声道转 {channels} 声道")
+    out_channels = channels or in_channels
+    downmix = out_channels != in_channels
+    resampler = None
+    if in_rate != options.sample_rate:
+        resampler = Resampler(np, in_rate, options.sample_rate, out_channels, options.taps)
+    # 只需要截断位数时走整数路径，与 FFmpeg 的结果逐位一致
+    integer_path = resampler is None and not downmix
+
+    written = 0
+    with wave.open(str(input_path), 'rb') as source, wave.open(str(output_path), 'wb') as target:
+        target.setnchannels(out_channels)
+        target.setsampwidth(PCM_SAMPLE_WIDTH)
+        target.setframerate(options.sample_rate)
+        while True:
+            data = source.readframes(options.chunk_frames)
+            if not data:
+                break
+            if integer_path:
+                out = _to_int16(data, sampwidth, np).astype('<i2', copy=False)
+                target.writeframes(out.tobytes())
+                written += len(out) // out_channels
+                continue
+            samples = _to_float(data, sampwidth, np).reshape(-1, in_channels)
+            if downmix:
+                samples = samples.mean(axis=1, keepdims=True, dtype=np.float32)
+            if resampler is not None:
+                samples = resampler.feed(samples)
+            target.writeframes(_float_to_int16(samples, np).tobytes())
+            written += len(samples)
+        if resampler is not None:
+            tail = resampler.flush()
+            target.writeframes(_float_to_int16(tail, np).tobytes())
+            written += len(tail)
+    return written
@@ -0,0 +1,226 @@
+"""按内容寻址的转换结果缓存。
+
+缓存键由输入文件的内容哈希与完整的转换参数（目标格式、编码参数、FFmpeg 版本等）
+共同计算。命中时用 reflink（写时复制）或硬链接生成输出文件，不再重新转换；
+都不支持时退回普通复制。缓存按总大小做 LRU 淘汰，索引保存在 SQLite 中，
+多个进程可以共用同一个缓存目录。
+
+硬链接的输出与缓存条目共用同一份数据，引擎在覆盖已有输出前会先删除它，
+避免原地写入时改坏缓存。
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from app_dirs import get_cache_dir
+from metrics import log_event
+
+CACHE_DIR_NAME = 'results'
+INDEX_FILE_NAME = 'index.sqlite'
+CACHE_VERSION = 1
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+
+# 计算哈希时每次读取的块大小
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Linux 上 FICLONE ioctl 的请求号，用于 reflink
+_FICLONE = 0x40049409
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def file_digest(path):
+    """输入文件的完整内容哈希；同一文件（路径、大小、修改时间不变）只计算一次。
+
+    大文件也读完全部内容：只取部分片段时，内容不同的文件可能得到相同的哈希，
+    缓存和批内去重就会交出错误的输出。
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        digest = _hash_memo.get(memo_key)
+    if digest is not None:
+        return digest
+
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(str(stat.st_size).encode())
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(HASH_BLOCK_SIZE), b''):
+            hasher.update(block)
+    digest = hasher.hexdigest()
+    with _hash_lock:
+        _hash_memo[memo_key] = digest
+    return digest
+
+
+def make_key(input_digest, params):
+    """由输入哈希和转换参数（可 JSON 序列化）计算缓存键"""
+    payload = json.dumps({'version': CACHE_VERSION, 'input': input_digest, 'params': params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+
+
+def link_file(src, dst):
+    """把 src 的内容放到 dst：优先 reflink，其次硬链接，最后复制。返回所用方式"""
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    if _reflink(src, dst):
+        return 'reflink'
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        shutil.copyfile(src, dst)
+        return 'copy'
+
+
+def unlink_shared(path):
+    """path 与其他文件共用数据（硬链接）时先删除，避免覆盖写入时修改缓存条目"""
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ResultCache:
+    """转换结果缓存。
+
+    cache = ResultCache(max_size=2 * 1024 ** 3)
+    if not cache.fetch(key, output_path):
+        ...  # 转换
+        cache.store(key, output_path)
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = Path(cache_dir) if cache_dir else get_cache_dir() / CACHE_DIR_NAME
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'key TEXT PRIMARY KEY, name TEXT, size INTEGER, '
+                         'last_used REAL, hits INTEGER DEFAULT 0)')
+            # 容量可能比上次使用时调小了
+            self._evict(conn)
+
+    @contextmanager
+    def _connect(self):
+        """每次操作使用独立连接，便于在线程和子进程间共用；退出时提交并关闭"""
+        conn = sqlite3.connect(str(self.cache_dir / INDEX_FILE_NAME), timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _entry_path(self, name):
+        return self.cache_dir / name[:2] / name
+
+    def fetch(self, key, output_path):
+        """命中时生成输出文件并返回 True"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT name, size FROM entries WHERE key = ?', (key,)).fetchone()
+            entry = self._entry_path(row[0]) if row else None
+            if entry is not None and (not entry.exists() or entry.stat().st_size != row[1]):
+                # 缓存文件丢失或被改动，作废
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                entry = None
+            if entry is None:
+                with self._lock:
+                    self.misses += 1
+                return False
+            conn.execute('UPDATE entries SET last_used = ?, hits = hits + 1 WHERE key = ?',
+                         (time.time(), key))
+
+        try:
+            method = link_file(entry, output_path)
+        except FileNotFoundError:
+            # 其他进程刚好淘汰了该条目
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        log_event('cache_hit', output=str(output_path), method=method)
+        return True
+
+    def store(self, key, output_path):
+        """把转换结果放入缓存，超出容量时淘汰最久未使用的条目"""
+        size = os.path.getsize(output_path)
+        if size > self.max_size:
+            return
+        name = key + Path(output_path).suffix.lower()
+        entry = self._entry_path(name)
+        link_file(output_path, entry)
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO entries (key, name, size, last_used, hits) '
+                         'VALUES (?, ?, ?, ?, 0)', (key, name, size, time.time()))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = conn.execute('SELECT key, name, size FROM entries ORDER BY last_used').fetchall()
+        for key, name, size in rows:
+            if total <= self.max_size:
+                break
+            try:
+                self._entry_path(name).unlink()
+            except FileNotFoundError:
+                pass
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+
+    def clear(self):
+        with self._connect() as conn:
+            for (name,) in conn.execute('SELECT name FROM entries').fetchall():
+                try:
+                    self._entry_path(name).unlink()
+                except FileNotFoundError:
+                    pass
+            conn.execute('DELETE FROM entries')
+
+    def stats(self):
+        """本实例的命中/未命中次数，以及缓存中的条目数和总大小"""
+        with self._connect() as conn:
+            entries, size = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'size': size,
+            'max_size': self.max_size
+        }
@@ -0,0 +1,304 @@
+"""按目标大小（或目标码率）编码 MP4 / MKV / MOV。
+
+固定 CRF 的输出大小随内容变化很大。这里先在整个时长内均匀取几个短窗口，每个窗口
+只解码一次，同时用几个候选 CRF 编码视频，得到每秒字节数；x264 的码率与 CRF 近似
+呈指数关系（CRF 每增加 6，码率约减半），但斜率随 CRF 变化（高 CRF 一端常常变平），
+因此 ln(码率) 在相邻抽样点之间取割线，反解出使视频部分正好用完预算（目标大小减去
+音频和封装开销）的 CRF。抽样结果与完整编码相差通常不到 2%，误差主要来自抽样点之间
+的插值（候选 CRF 中间可达 4%，超出候选范围外推时更大），所以反解出的 CRF 离已抽样
+的点较远时，在该 CRF 上补测抽样后重新反解（最多 MAX_REFINEMENTS 次），再完整编码
+一次。抽样只编码 窗口数 × 窗口长度 的视频，长视频上相对完整编码可以忽略。
+
+封装开销按数据包计：MP4 / MOV 的索引和 MKV 的块头每个包（一帧视频或一个音频帧）
+占固定的字节数，与码率无关，目标大小越小占比越高。
+
+每个窗口都从一个关键帧开始，文件头和 x264 的版本信息也各占一份，窗口越短，抽样
+的码率比完整编码偏高得越多（GOP 较长、画面平稳的视频可达 15% 以上）。因此每个
+窗口同时只编码第一帧（各候选 CRF 一份，另有一份 CRF 51 的近似为纯文件头），
+从窗口大小中扣掉第一帧，再按完整编码的关键帧间隔（-g，默认 250 帧）把关键帧的
+大小加回去。
+
+视频不长于全部抽样窗口时不抽样（抽样就等于把整个视频编码几遍），直接用默认 CRF
+完整编码，用实际大小建立模型，省下的编码次数用来多修正一次。
+
+完整编码的大小超出容差时，让模型经过实际的 (CRF, 码率) 点（两次以上时改用实测点
+之间的斜率），修正 CRF 后重新编码，最多 max_retries 次。1～2 分钟的视频、1～12 MB
+的目标实测首次完整编码的误差在 ±2.5% 以内，默认 5% 的容差下一般只完整编码一次；
+容差设到 2% 以下时通常要多编码一两次。
+"""
+import math
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+from ffmpeg_runner import run_ffmpeg
+from metrics import log_event, stage
+
+# 支持按目标大小编码的容器（视频为 libx264，CRF 可调）
+SIZE_TARGET_FORMATS = {'mp4', 'mkv', 'mov'}
+
+# 未指定 -b:a 时 MP3 编码器（LAME）的默认码率：立体声 128k，单声道减半
+DEFAULT_AUDIO_BITRATE = 128000
+# 封装中每个数据包的开销（字节）：MP4 / MOV 的索引表，MKV 的块头
+PACKET_OVERHEAD = {'mp4': 15, 'mov': 15, 'mkv': 8}
+# MP3 每帧的采样数，以及探测不到采样率时假定的采样率
+MP3_FRAME_SAMPLES = 1152
+DEFAULT_SAMPLE_RATE = 44100
+# 拟合失败（候选点不足或斜率异常）时使用的斜率：CRF 每增加 6，码率减半
+DEFAULT_SLOPE = -math.log(2) / 6
+MIN_CRF, MAX_CRF = 0, 51
+# 未指定 -g 时 x264 的关键帧间隔（帧），以及探测不到帧率时假定的帧率
+X264_KEYINT = 250
+DEFAULT_FRAME_RATE = 25.0
+# 反解出的 CRF 与最近的抽样点相差超过该值时，在该 CRF 上补测抽样，最多补测的次数
+REFINE_DISTANCE = 1.0
+MAX_REFINEMENTS = 2
+
+
+@dataclass
+class SizeTarget:
+    """目标大小参数，size 与 bitrate 二选一"""
+    size: int = None                 # 目标文件大小（字节）
+    bitrate: int = None              # 目标平均码率（bit/s，音视频合计）
+    tolerance: float = 0.05          # 实际大小与目标的相对误差上限
+    samples: int = 3                 # 抽样窗口数
+    window: float = 4.0              # 每个窗口的时长（秒）
+    candidates: tuple = (20, 26, 32)  # 抽样时使用的候选 CRF
+    max_retries: int = 1             # 超出容差时最多重新编码的次数
+
+    def target_bytes(self, duration):
+        if (self.size is None) == (self.bitrate is None):
+            raise ValueError("size 和 bitrate 需要且只能指定一个")
+        if self.size is not None:
+            return self.size
+        return self.bitrate * duration / 8
+
+
+def sample_windows(duration, samples, window):
+    """均匀分布的抽样窗口 [(开始时间, 时长)]；视频太短时整段作为一个窗口"""
+    if duration <= samples * window:
+        return [(0.0, duration)]
+    step = duration / samples
+    return [(round(step * (index + 0.5) - window / 2, 3), window) for index in range(samples)]
+
+
+def _crf_index(args):
+    try:
+        return args.index('-crf')
+    except ValueError:
+        raise Exception("当前视频编码参数不支持 CRF，不能按目标大小编码")
+
+
+def with_crf(args, crf):
+    """替换参数列表中 -crf 的值，返回新列表"""
+    args = list(args)
+    args[_crf_index(args) + 1] = f'{crf:g}'
+    return args
+
+
+def crf_of(args):
+    """参数列表中 -crf 的值"""
+    return float(args[_crf_index(args) + 1])
+
+
+def keyframe_interval(video_args, frame_rate=None):
+    """完整编码的关键帧间隔（秒）"""
+    keyint = X264_KEYINT
+    if '-g' in video_args:
+        keyint = int(video_args[video_args.index('-g') + 1])
+    return keyint / (frame_rate or DEFAULT_FRAME_RATE)
+
+
+def audio_bitrate(audio_args, media_info=None):
+    """输出中音频的码率（bit/s），源文件没有音轨时为 0"""
+    if media_info is not None and not media_info.audio_streams:
+        return 0
+    if '-b:a' in audio_args:
+        value = audio_args[audio_args.index('-b:a') + 1].lower()
+        return int(float(value.rstrip('k')) * (1000 if value.endswith('k') else 1))
+    channels = 2
+    if media_info is not None and media_info.audio_streams[0].channels:
+        # MP3 最多两个声道，多声道源会被缩混为立体声
+        channels = min(2, media_info.audio_streams[0].channels)
+    return DEFAULT_AUDIO_BITRATE * channels // 2
+
+
+def container_overhead(target_format, media_info=None):
+    """封装开销（字节/秒）：每秒的视频帧数和 MP3 帧数 × 每个数据包的开销"""
+    frame_rate = getattr(media_info, 'frame_rate', None) or DEFAULT_FRAME_RATE
+    packets = frame_rate
+    if media_info is None or media_info.audio_streams:
+        sample_rate = None
+        if media_info is not None:
+            sample_rate = media_info.audio_streams[0].sample_rate
+        packets += (sample_rate or DEFAULT_SAMPLE_RATE) / MP3_FRAME_SAMPLES
+    return PACKET_OVERHEAD.get(target_format, max(PACKET_OVERHEAD.values())) * packets
+
+
+class SizeModel:
+    """ln(每秒字节数) 关于 CRF 的分段线性模型：相邻两点之间取割线，超出范围时沿用
+    最外侧的一段；只有一个点时使用默认斜率"""
+
+    def __init__(self, points):
+        # points 为 [(CRF, 每秒字节数)]，同一 CRF 只保留最后一个
+        points = dict((crf, math.log(rate)) for crf, rate in points if rate > 0)
+        if not points:
+            raise Exception("抽样编码没有输出，无法估计大小")
+        self.points = sorted(points.items())
+
+    def _segment(self, index):
+        """第 index 段的 (起点 CRF, 起点 ln(码率), 斜率)；斜率异常时使用默认斜率"""
+        if len(self.points) == 1:
+            return self.points[0] + (DEFAULT_SLOPE,)
+        (x0, y0), (x1, y1) = self.points[index], self.points[index + 1]
+        slope = (y1 - y0) / (x1 - x0)
+        return x0, y0, slope if slope < 0 else DEFAULT_SLOPE
+
+    def _last(self):
+        return max(0, len(self.points) - 2)
+
+    def predict(self, crf):
+        index = 0
+        while index < self._last() and crf > self.points[index + 1][0]:
+            index += 1
+        x0, y0, slope = self._segment(index)
+        return math.exp(y0 + slope * (crf - x0))
+
+    def crf_for(self, rate):
+        """达到每秒 rate 字节所需的 CRF，限制在 x264 的取值范围内，保留一位小数"""
+        target = math.log(rate)
+        # 码率随 CRF 增大而下降，从低 CRF 一端找到 rate 所在的一段
+        index = 0
+        while index < self._last() and target < self.points[index + 1][1]:
+            index += 1
+        x0, y0, slope = self._segment(index)
+        crf = x0 + (target - y0) / slope
+        return round(min(MAX_CRF, max(MIN_CRF, crf)), 1)
+
+    def anchor(self, crf, rate):
+        """形状不变，整体平移让模型经过实际测得的点"""
+        shift = math.log(rate) - math.log(self.predict(crf))
+        self.points = [(x, y + shift) for x, y in self.points]
+
+    def refit(self, measured):
+        """用完整编码实际测得的 [(CRF, 每秒字节数)] 修正模型。
+
+        只有一个点时保持抽样得到的形状、平移模型；有两个以上 CRF 不同的点时，
+        改用最近两次完整编码的割线，抽样窗口与完整编码的差异不再影响斜率。
+        """
+        crf, rate = measured[-1]
+        for previous_crf, previous_rate in reversed(measured[:-1]):
+            if previous_crf != crf and previous_rate != rate:
+                if (math.log(rate) - math.log(previous_rate)) / (crf - previous_crf) < 0:
+                    self.points = sorted([(previous_crf, math.log(previous_rate)),
+                                          (crf, math.log(rate))])
+                    return
+                break
+        self.anchor(crf, rate)
+
+
+def measure_samples(ffmpeg_path, input_path, video_args, windows, candidates, work_dir,
+                    duration, gop_seconds):
+    """每个窗口解码一次、按各候选 CRF 编码视频，返回按完整编码的关键帧间隔校正后的
+    [(CRF, 每秒字节数)]。抽样写成裸 H.264 流，不含封装开销"""
+    steady = {crf: 0 for crf in candidates}     # 扣掉第一帧后的窗口大小
+    keyframes = {crf: 0 for crf in candidates}  # 第一帧（关键帧）扣掉文件头后的大小
+    seconds = sum(length for _, length in windows)
+    for number, (start, length) in enumerate(windows):
+        cmd = [ffmpeg_path, '-hide_banner', '-y',
+               '-ss', str(start), '-t', str(length), '-i', str(input_path)]
+        outputs = {}
+        for crf in candidates + (MAX_CRF,):
+            sample = Path(work_dir) / f'sample_{number}_{crf:g}.h264'
+            first = Path(work_dir) / f'first_{number}_{crf:g}.h264'
+            args = ['-map', '0:v:0', '-an'] + with_crf(video_args, crf) + ['-f', 'h264']
+            if crf in candidates:
+                cmd += args + [str(sample)]
+            cmd += args + ['-frames:v', '1', str(first)]
+            outputs[crf] = (sample, first)
+        run_ffmpeg(cmd)
+        header = outputs[MAX_CRF][1].stat().st_size
+        for crf in candidates:
+            sample, first = (path.stat().st_size for path in outputs[crf])
+            steady[crf] += sample - first
+            keyframes[crf] += max(0, first - header)
+    # 完整编码中按关键帧间隔插入的关键帧数（场景切换产生的关键帧已包含在窗口中）
+    forced = math.ceil(duration / gop_seconds)
+    return [(crf, steady[crf] / seconds + keyframes[crf] / len(windows) * forced / duration)
+            for crf in candidates]
+
+
+def encode_to_size(ffmpeg_path, input_path, output_path, cmd, video_args, audio_bps, duration,
+                   target, on_progress=None, trace=None, frame_rate=None, overhead_bps=0):
+    """抽样选出 CRF 后完整编码，cmd 为默认 CRF 的完整命令；返回选用的 CRF。
+
+    overhead_bps 为封装开销（字节/秒），见 container_overhead。
+    """
+    if not duration:
+        raise Exception("无法获取视频时长，不能按目标大小编码")
+    target_bytes = target.target_bytes(duration)
+    # 音频和封装之外的部分，每秒字节数
+    fixed_bps = audio_bps / 8 + overhead_bps
+    video_budget = target_bytes - fixed_bps * duration
+    if video_budget <= 0:
+        fixed_mb = fixed_bps * duration / 1024 ** 2
+        raise Exception(f"目标大小过小：音频和封装开销就需要约 {fixed_mb:.1f} MB")
+
+    if duration <= target.samples * target.window:
+        # 太短的视频不抽样，先用默认 CRF 完整编码，由实际大小建立模型
+        model = None
+        crf = crf_of(cmd)
+        retries = target.max_retries + 1
+    else:
+        with stage(trace, 'sample'):
+            with tempfile.TemporaryDirectory(prefix='.size_',
+                                             dir=Path(output_path).parent) as work_dir:
+                windows = sample_windows(duration, target.samples, target.window)
+                candidates = tuple(target.candidates)
+                gop_seconds = keyframe_interval(video_args, frame_rate)
+                points = measure_samples(ffmpeg_path, input_path, video_args, windows,
+                                         candidates, work_dir, duration, gop_seconds)
+                model = SizeModel(points)
+                crf = model.crf_for(video_budget / duration)
+                for _ in range(MAX_REFINEMENTS):
+                    # CRF 51 已是最小的输出，再抽样也不会改变选择
+                    if crf >= MAX_CRF or min(abs(crf - sampled) for sampled, _ in points) \
+                            <= REFINE_DISTANCE:
+                        break
+                    points += measure_samples(ffmpeg_path, input_path, video_args, windows,
+                                              (crf,), work_dir, duration, gop_seconds)
+                    model = SizeModel(points)
+                    crf = model.crf_for(video_budget / duration)
+        retries = target.max_retries
+
+    def predict(crf):
+        if model is None:
+            return None
+        return int((model.predict(crf) + fixed_bps) * duration)
+
+    measured = []
+    for attempt in range(retries + 1):
+        with stage(trace, 'encode'):
+            run_ffmpeg(with_crf(cmd, crf), duration=duration, on_progress=on_progress)
+        actual = os.path.getsize(output_path)
+        error = actual / target_bytes - 1
+        log_event('size_target', input=str(input_path), crf=crf, attempt=attempt + 1,
+                  target=int(target_bytes), predicted=predict(crf), actual=actual,
+                  error=round(error, 4))
+        if abs(error) <= target.tolerance or attempt == retries:
+            break
+        video_actual = actual - fixed_bps * duration
+        if video_actual <= 0:
+            break
+        measured.append((crf, video_actual / duration))
+        if model is None:
+            model = SizeModel(measured)
+        else:
+            model.refit(measured)
+        new_crf = model.crf_for(video_budget / duration)
+        if new_crf == crf:
+            # 已经到达 CRF 取值范围的边界，重新编码也不会改变大小
+            break
+        crf = new_crf
+    return crf
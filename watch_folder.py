@@ -0,0 +1,453 @@
+"""监视文件夹（热文件夹）模式：放进目录的文件自动转换。
+
+每个输入目录配置一条规则（各文件类型的目标格式和输出目录）。Linux 上通过
+inotify 接收文件变化，其他平台或 inotify 不可用时定时轮询。新文件在大小和
+修改时间连续 settle 秒不变后才开始转换，避免读到仍在复制中的文件。
+
+处理过的文件按 (路径, 大小, 修改时间) 记录在 SQLite 中，重启后只转换新增或
+改动过的文件；转换失败的文件在内容改动前不会重试。
+
+    python watch_folder.py --rule ~/热文件夹/图片 jpg --rule ~/热文件夹/音频 mp3 输出目录
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from app_dirs import get_cache_dir
+from audio_batch import AudioBatchOptions
+from convert_engine import ConversionEngine, ConversionJob, default_output_path
+from io_devices import default_scratch_dir
+from job_cost import SCHEDULE_FIFO, SCHEDULES, CostModel, default_cost_path
+from job_queue import DONE, JobQueue
+from media_formats import detect_file_type, target_type
+from metrics import configure_logging, configure_metrics, log_event
+from pcm_fast import PcmOptions
+from result_cache import ResultCache
+
+STATE_FILE_NAME = 'watch_state.sqlite'
+DEFAULT_OUTPUT_SUBDIR = 'converted'
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_SECONDS = 5.0
+
+# inotify 事件（见 inotify(7)）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+@dataclass
+class WatchRule:
+    """一个输入目录的转换规则"""
+    input_dir: str
+    targets: dict = field(default_factory=dict)  # 文件类型 -> 目标格式，例如 {'image': 'jpg'}
+    output_dir: str = None  # 默认为输入目录下的 converted 子目录（不会被监视）
+    recursive: bool = True
+
+    def __post_init__(self):
+        self.input_dir = os.path.abspath(self.input_dir)
+        self.output_dir = os.path.abspath(
+            self.output_dir or os.path.join(self.input_dir, DEFAULT_OUTPUT_SUBDIR))
+
+    @classmethod
+    def parse(cls, input_dir, formats, output_dir=None):
+        """由命令行参数创建，formats 为逗号分隔的目标格式，例如 "jpg,mp3" """
+        targets = {}
+        for target_format in formats.lower().split(','):
+            target_format = target_format.strip().lstrip('.')
+            if target_format:
+                targets[target_type(target_format)] = target_format
+        return cls(input_dir, targets, output_dir)
+
+    def match(self, path):
+        """文件属于本规则时返回 (文件类型, 目标格式)，否则返回 None"""
+        if not _is_under(path, self.input_dir) or _is_under(path, self.output_dir):
+            return None
+        if not self.recursive and os.path.dirname(path) != self.input_dir:
+            return None
+        if os.path.basename(path).startswith('.'):
+            return None
+        try:
+            file_type = detect_file_type(path)
+        except ValueError:
+            return None
+        target_format = self.targets.get(file_type)
+        if target_format is None or Path(path).suffix.lower() == f'.{target_format}':
+            return None
+        return file_type, target_format
+
+    def output_path(self, path, target_format):
+        """输出保持输入目录中的相对位置"""
+        relative = os.path.relpath(os.path.dirname(path), self.input_dir)
+        return default_output_path(path, os.path.join(self.output_dir, relative), target_format)
+
+
+def _is_under(path, directory):
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+class WatchState:
+    """已处理文件的记录，键为 (路径, 大小, 修改时间)"""
+
+    def __init__(self, db_path=None):
+        self.db_path = Path(db_path) if db_path else get_cache_dir() / STATE_FILE_NAME
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                         'status TEXT, output TEXT, error TEXT, updated REAL)')
+            # 启动时一次性读入，之后的查询不再访问数据库
+            self._known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                           conn.execute('SELECT path, size, mtime_ns FROM files')}
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def processed(self, path, size, mtime_ns):
+        return self._known.get(path) == (size, mtime_ns)
+
+    def mark(self, records):
+        """records 为 [(路径, 大小, 修改时间, 状态, 输出路径, 错误信息)]"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO files '
+                             '(path, size, mtime_ns, status, output, error, updated) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             [record + (now,) for record in records])
+        for path, size, mtime_ns, *_ in records:
+            self._known[path] = (size, mtime_ns)
+
+    def __len__(self):
+        return len(self._known)
+
+
+def _walk_files(directory, recursive, skip_dir):
+    """目录下的所有文件；跳过隐藏目录和输出目录"""
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            if recursive and not _is_under(entry.path, skip_dir):
+                yield from _walk_files(entry.path, recursive, skip_dir)
+        elif entry.is_file():
+            yield entry.path
+
+
+class PollingWatcher:
+    """定时轮询：每隔 interval 秒要求重新扫描一次"""
+
+    def __init__(self, rules, interval=DEFAULT_POLL_SECONDS):
+        self.interval = interval
+        self._next_scan = time.monotonic() + interval
+
+    def wait(self, timeout):
+        """等待文件变化，返回 (变化的路径, 是否需要完整扫描)"""
+        now = time.monotonic()
+        time.sleep(max(0.0, min(timeout, self._next_scan - now)))
+        if time.monotonic() >= self._next_scan:
+            self._next_scan = time.monotonic() + self.interval
+            return [], True
+        return [], False
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify，新建的子目录会自动加入监视"""
+
+    def __init__(self, rules):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify 初始化失败")
+        self._dirs = {}  # 监视描述符 -> 目录
+        self._rules = rules
+        try:
+            for rule in rules:
+                self._add_tree(rule.input_dir, rule)
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"无法监视目录: {directory}")
+        self._dirs[wd] = directory
+
+    def _add_tree(self, directory, rule):
+        self._add(directory)
+        if not rule.recursive:
+            return
+        for root, dirs, _ in os.walk(directory):
+            dirs[:] = [name for name in dirs if not name.startswith('.')
+                       and not _is_under(os.path.join(root, name), rule.output_dir)]
+            for name in dirs:
+                self._add(os.path.join(root, name))
+
+    def _rule_for(self, path):
+        for rule in self._rules:
+            if _is_under(path, rule.input_dir) and not _is_under(path, rule.output_dir):
+                return rule
+        return None
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return [], False
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return [], False
+
+        paths, rescan = [], False
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，丢失的事件只能靠完整扫描补上
+                rescan = True
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                rule = self._rule_for(path)
+                if rule is not None and rule.recursive and not name.startswith('.'):
+                    # 新目录（可能是整个移进来的目录树）：加入监视并扫描已有的文件
+                    try:
+                        self._add_tree(path, rule)
+                    except OSError as e:
+                        log_event('watch_add_failed', path=path, error=str(e))
+                    paths.extend(_walk_files(path, True, rule.output_dir))
+            else:
+                paths.append(path)
+        return paths, rescan
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(rules, poll_interval=DEFAULT_POLL_SECONDS, force_polling=False):
+    """优先使用 inotify，不可用时退回轮询"""
+    if not force_polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(rules)
+        except (OSError, AttributeError) as e:
+            log_event('inotify_unavailable', error=str(e))
+    return PollingWatcher(rules, poll_interval)
+
+
+@dataclass
+class _Pending:
+    """等待写入完成的文件"""
+    rule: WatchRule
+    file_type: str
+    target_format: str
+    size: int
+    mtime_ns: int
+    stable_since: float
+
+
+class FolderWatcher:
+    """监视多个输入目录，按规则转换新文件"""
+
+    def __init__(self, rules, engine, state=None, settle=DEFAULT_SETTLE_SECONDS,
+                 poll_interval=DEFAULT_POLL_SECONDS, force_polling=False, queue_options=None):
+        self.rules = rules
+        self.engine = engine
+        self.queue_options = queue_options or {}  # 传给 JobQueue 的参数，如 scratch_dir
+        self.state = state or WatchState()
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.force_polling = force_polling
+        self._pending = {}  # 路径 -> _Pending
+        self._matches = {}  # 路径 -> ((大小, 修改时间), 规则, (文件类型, 目标格式))
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def _match(self, path, stat):
+        """匹配规则；结果按 (大小, 修改时间) 记住，文件没有改动时不再读取文件头"""
+        key = (stat.st_size, stat.st_mtime_ns)
+        cached = self._matches.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+        found = None, None
+        for rule in self.rules:
+            matched = rule.match(path)
+            if matched:
+                found = rule, matched
+                break
+        self._matches[path] = (key,) + found
+        return found
+
+    def observe(self, path):
+        """记录一个可能有变化的文件；大小或修改时间变化时重新开始计时"""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)
+            self._matches.pop(path, None)
+            return
+        # 先查处理记录再匹配规则，已处理且未改动的文件不读取文件头
+        if self.state.processed(path, stat.st_size, stat.st_mtime_ns):
+            self._pending.pop(path, None)
+            return
+        rule, matched = self._match(path, stat)
+        if rule is None:
+            self._pending.pop(path, None)
+            return
+        pending = self._pending.get(path)
+        if pending is None or (pending.size, pending.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            self._pending[path] = _Pending(rule, matched[0], matched[1], stat.st_size,
+                                           stat.st_mtime_ns, time.monotonic())
+
+    def scan(self):
+        """完整扫描所有输入目录，已处理且未改动的文件只做一次 stat"""
+        for rule in self.rules:
+            for path in _walk_files(rule.input_dir, rule.recursive, rule.output_dir):
+                self.observe(path)
+
+    def _ready(self):
+        """大小和修改时间连续 settle 秒未变、可以转换的文件"""
+        now = time.monotonic()
+        ready = []
+        for path in list(self._pending):
+            pending = self._pending[path]
+            self.observe(path)  # 重新检查大小，文件仍在写入时会重置计时
+            current = self._pending.get(path)
+            if current is pending and pending.size > 0 and now - pending.stable_since >= self.settle:
+                ready.append((path, self._pending.pop(path)))
+        return ready
+
+    def convert(self, ready):
+        """转换一批已写完的文件并记录状态"""
+        queue = JobQueue(self.engine, **self.queue_options)
+        for path, pending in ready:
+            output_path = pending.rule.output_path(path, pending.target_format)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            queue.add(ConversionJob(path, str(output_path), pending.file_type,
+                                    pending.target_format))
+        queue.run()
+
+        records = []
+        for queued, (path, pending) in zip(queue.jobs, ready):
+            done = queued.status == DONE
+            records.append((path, pending.size, pending.mtime_ns, queued.status,
+                            queued.job.output_path if done else None, queued.error))
+            log_event('watch_converted' if done else 'watch_failed', input=path,
+                      output=queued.job.output_path, error=queued.error)
+        self.state.mark(records)
+
+    def run(self):
+        """阻塞运行，直到调用 stop() 或收到 KeyboardInterrupt"""
+        for rule in self.rules:
+            Path(rule.input_dir).mkdir(parents=True, exist_ok=True)
+        watcher = create_watcher(self.rules, self.poll_interval, self.force_polling)
+        log_event('watch_started', watcher=type(watcher).__name__,
+                  folders=[rule.input_dir for rule in self.rules], known_files=len(self.state))
+        try:
+            self.scan()
+            while not self._stopped:
+                # 有等待中的文件时按 settle 的一半复查，否则等待事件
+                timeout = self.settle / 2 if self._pending else self.poll_interval
+                paths, rescan = watcher.wait(timeout)
+                for path in paths:
+                    self.observe(path)
+                if rescan:
+                    self.scan()
+                ready = self._ready()
+                if ready:
+                    self.convert(ready)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+
+def main(argv=None):
+    from ffmpeg_caps import find_ffmpeg
+
+    parser = argparse.ArgumentParser(description='监视文件夹，自动转换放入的文件')
+    parser.add_argument('--rule', nargs='+', action='append', required=True,
+                        metavar='参数',
+                        help='输入目录 目标格式[,目标格式...] [输出目录]，可重复指定；'
+                             '例如 --rule 图片 jpg --rule 媒体 mp3,mp4 输出')
+    parser.add_argument('--ffmpeg', default=None, help='ffmpeg 路径，默认使用自带或 PATH 中的')
+    parser.add_argument('--state', default=None, help='状态数据库路径，默认在缓存目录中')
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help='文件大小保持不变多少秒后开始转换')
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_SECONDS,
+                        help='轮询间隔（秒），inotify 不可用时使用')
+    parser.add_argument('--force-polling', action='store_true', help='不使用 inotify')
+    parser.add_argument('--no-recursive', action='store_true', help='不监视子目录')
+    parser.add_argument('--metrics-port', type=int, default=None, help='在该端口提供 /metrics')
+    parser.add_argument('--scratch', nargs='?', const=default_scratch_dir(), default=None,
+                        help='输出先写到该临时目录（默认 /dev/shm），成功后再移动到输出目录')
+    parser.add_argument('--per-device', type=int, default=None,
+                        help='每个存储设备同时读写的任务数，默认按设备类型决定')
+    parser.add_argument('--schedule', choices=SCHEDULES, default=SCHEDULE_FIFO,
+                        help='同一批文件的转换顺序：提交顺序、估计耗时最短优先或按类型公平分配')
+    args = parser.parse_args(argv)
+
+    rules = []
+    for values in args.rule:
+        if len(values) not in (2, 3):
+            parser.error('--rule 需要 2 或 3 个参数：输入目录 目标格式 [输出目录]')
+        try:
+            rule = WatchRule.parse(*values)
+        except ValueError as e:
+            parser.error(str(e))
+        rule.recursive = not args.no_recursive
+        rules.append(rule)
+
+    configure_logging()
+    configure_metrics(port=args.metrics_port)
+    ffmpeg_path = args.ffmpeg or find_ffmpeg()
+    if not ffmpeg_path and any(set(rule.targets) - {'image'} for rule in rules):
+        print("找不到 ffmpeg，请用 --ffmpeg 指定", file=sys.stderr)
+        return 2
+    engine = ConversionEngine(ffmpeg_path, result_cache=ResultCache(),
+                              audio_batch=AudioBatchOptions(), pcm=PcmOptions())
+    queue_options = {'per_device': args.per_device, 'scratch_dir': args.scratch,
+                     'schedule': args.schedule, 'cost_model': CostModel(default_cost_path())}
+    FolderWatcher(rules, engine, WatchState(args.state), args.settle, args.poll,
+                  args.force_polling, queue_options).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())